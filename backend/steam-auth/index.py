@@ -3,8 +3,10 @@ import os
 import re
 import urllib.parse
 import urllib.request
+import time
 from datetime import datetime, timedelta
 import psycopg2
+import psycopg2.pool
 
 def handler(event: dict, context) -> dict:
     """API для авторизации через Steam OpenID"""
@@ -171,7 +173,7 @@ def get_steam_user_data(steam_id: str) -> dict:
 def save_user_to_db(steam_id: str, user_data: dict) -> dict:
     """Сохраняет или обновляет пользователя в БД. Новым пользователям присваивается роль 'no_access'"""
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_db_connection()
     cur = conn.cursor()
     
     try:
@@ -221,7 +223,64 @@ def save_user_to_db(steam_id: str, user_data: dict) -> dict:
             }
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
+
+
+# Пул подключений живёт на уровне модуля и переживает тёплые вызовы handler
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+# Простаивавшее дольше стольких секунд подключение проверяется SELECT 1 перед выдачей
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+_db_pool = None
+_db_last_used = {}
+
+
+def get_db_pool():
+    """Пул подключений процесса (создаётся при первом обращении)"""
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = psycopg2.pool.ThreadedConnectionPool(0, DB_POOL_SIZE, os.environ['DATABASE_URL'])
+        _db_last_used.clear()
+    return _db_pool
+
+
+def is_connection_alive(conn) -> bool:
+    """Проверка живости подключения при выдаче из пула"""
+    if conn.closed:
+        return False
+    last_used = _db_last_used.get(conn)
+    if last_used is None or time.monotonic() - last_used < DB_POOL_PING_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        print(f"[db_pool] dropping dead connection: {e}")
+        return False
+
+
+def get_db_connection():
+    """Берёт подключение из пула; оборванные подключения заменяются новыми"""
+    pool = get_db_pool()
+    for _ in range(DB_POOL_SIZE + 1):
+        conn = pool.getconn()
+        if is_connection_alive(conn):
+            return conn
+        _db_last_used.pop(conn, None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError('No live database connection')
+
+
+def release_db_connection(conn):
+    """Возвращает подключение в пул (незавершённая транзакция откатывается пулом)"""
+    if conn.closed:
+        _db_last_used.pop(conn, None)
+    else:
+        _db_last_used[conn] = time.monotonic()
+    get_db_pool().putconn(conn, close=bool(conn.closed))
 
 
 def create_session_token(user: dict) -> str:
@@ -1,41 +1,145 @@
+import base64
+import email.utils
+import gzip
+import hashlib
+import io
 import json
+import math
 import os
+import re
+import sys
+import time
+from collections import OrderedDict
 import psycopg2
-from datetime import datetime
+import psycopg2.pool
+import psycopg2.extras
+from psycopg2.extras import Json
+from datetime import datetime, timezone
+
+# Необязательные ускорители: без них работают gzip и стандартный json
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Без Pillow картинки хранятся как загружены, без вариантов
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
 
 def handler(event: dict, context) -> dict:
     """API для управления статьями и категориями Wiki"""
     
     method = event.get('httpMethod', 'GET')
-    query = event.get('queryStringParameters') or {}
-    action = query.get('action', '')
     
     if method == 'OPTIONS':
         return cors_response(200, '')
     
+    ctx = RequestContext(event)
+    action = ctx.query.get('action', '')
+    
+    try:
+        if method == 'GET' and action in CACHED_ACTIONS:
+            response = cached_read(method, action, ctx)
+        else:
+            response = dispatch(method, action, ctx)
+    finally:
+        ctx.close()
+    
+    return compress_response(event, response)
+
+
+class RequestContext:
+    """Контекст вызова: тело, пользователь и одно подключение к БД на все обработчики"""
+
+    # Всё лениво: анонимный GET не ходит в users, а запрос без БД не берёт подключение.
+    # Обработчики сами делают commit; close() возвращает подключение в пул.
+
+    def __init__(self, event: dict):
+        self.event = event
+        self.query = event.get('queryStringParameters') or {}
+        self._body = None
+        self._conn = None
+        self._user = None
+        self._user_resolved = False
+
+    @property
+    def body(self) -> dict:
+        if self._body is None:
+            self._body = json.loads(self.event.get('body') or '{}')
+        return self._body
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = get_db_connection()
+        return self._conn
+
+    @property
+    def user(self):
+        if not self._user_resolved:
+            self._user = validate_user(self)
+            self._user_resolved = True
+        return self._user
+
+    def close(self):
+        if self._conn is not None:
+            release_db_connection(self._conn)
+            self._conn = None
+
+
+def dispatch(method: str, action: str, ctx: RequestContext) -> dict:
+    """Маршрутизация по параметру action"""
+    
     if action == 'categories':
-        return handle_categories(method, event)
+        return handle_categories(method, ctx)
     elif action == 'articles':
-        return handle_articles(method, event)
+        return handle_articles(method, ctx)
+    elif action == 'article':
+        return handle_article(method, ctx)
+    elif action == 'articles_bulk':
+        return handle_articles_bulk(method, ctx)
+    elif action == 'search':
+        return handle_search(method, ctx)
+    elif action == 'changes':
+        return handle_changes(method, ctx)
     elif action == 'users':
-        return handle_users(method, event)
+        return handle_users(method, ctx)
     elif action == 'upload_image':
-        return handle_upload_image(method, event)
+        return handle_upload_image(method, ctx)
     elif action == 'hosting_images':
-        return handle_hosting_images(method, event)
+        return handle_hosting_images(method, ctx)
+    elif action == 'upload_url':
+        return handle_upload_url(method, ctx)
+    elif action == 'upload_confirm':
+        return handle_upload_confirm(method, ctx)
+    elif action == 'gc_images':
+        return handle_gc_images(method, ctx)
     elif action == 'me':
-        return handle_me(method, event)
+        return handle_me(method, ctx)
     elif action == 'draft':
-        return handle_draft(method, event)
+        return handle_draft(method, ctx)
+    elif action == 'cache_stats':
+        return handle_cache_stats(method, ctx)
+    elif action == 'snapshot':
+        return handle_snapshot(method, ctx)
+    elif action == 'export':
+        return handle_export(method, ctx)
     
     return cors_response(404, {'error': 'Not found'})
 
 
-def handle_categories(method: str, event: dict) -> dict:
+def handle_categories(method: str, ctx: RequestContext) -> dict:
     """Управление категориями"""
     
-    conn = get_db_connection()
+    conn = ctx.conn
     cur = conn.cursor()
     
     try:
@@ -44,15 +148,12 @@ def handle_categories(method: str, event: dict) -> dict:
             categories = cur.fetchall()
             
             return cors_response(200, {
-                'categories': [
-                    {'id': c[0], 'name': c[1], 'icon': c[2], 'created_at': c[3].isoformat() if c[3] else None}
-                    for c in categories
-                ]
-            })
+                'categories': [category_from_row(c) for c in categories]
+            }, catalog_last_modified(ctx))
         
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            user = validate_user(event)
+            body = ctx.body
+            user = ctx.user
             
             if not user or user['role'] != 'administrator':
                 return cors_response(403, {'error': 'Access denied'})
@@ -68,7 +169,7 @@ def handle_categories(method: str, event: dict) -> dict:
                 (name, icon)
             )
             new_category = cur.fetchone()
-            conn.commit()
+            commit_catalog_change(conn, cur, article_ids=[])
             
             return cors_response(201, {
                 'category': {
@@ -80,96 +181,300 @@ def handle_categories(method: str, event: dict) -> dict:
             })
         
         elif method == 'DELETE':
-            user = validate_user(event)
+            user = ctx.user
             
             if not user or user['role'] != 'administrator':
                 return cors_response(403, {'error': 'Access denied'})
             
-            query = event.get('queryStringParameters', {})
+            query = ctx.query
             category_id = query.get('id')
             
             if not category_id:
                 return cors_response(400, {'error': 'ID is required'})
             
-            cur.execute("DELETE FROM article_categories WHERE category_id = %s", (int(category_id),))
-            cur.execute("UPDATE articles SET category_id = NULL WHERE category_id = %s", (int(category_id),))
+            cur.execute(
+                "DELETE FROM article_categories WHERE category_id = %s RETURNING article_id", (int(category_id),)
+            )
+            affected_ids = {r[0] for r in cur.fetchall()}
+            cur.execute(
+                "UPDATE articles SET category_id = NULL WHERE category_id = %s RETURNING id", (int(category_id),)
+            )
+            affected_ids.update(r[0] for r in cur.fetchall())
             cur.execute("DELETE FROM categories WHERE id = %s", (int(category_id),))
-            conn.commit()
+            commit_catalog_change(conn, cur, article_ids=sorted(affected_ids))
             
             return cors_response(200, {'success': True})
         
     finally:
         cur.close()
-        conn.close()
     
     return cors_response(405, {'error': 'Method not allowed'})
 
 
-def handle_articles(method: str, event: dict) -> dict:
+def category_from_row(c) -> dict:
+    """Категория из строки (id, name, icon, created_at)"""
+    return {'id': c[0], 'name': c[1], 'icon': c[2], 'created_at': c[3].isoformat() if c[3] else None}
+
+
+# Статья целиком собирается в JSON на стороне Postgres: content (JSONB) попадает в ответ
+# как есть, без разбора в Python и повторной сериализации. Категории агрегируются тем же
+# запросом (без N+1); первой идёт основная (articles.category_id), остальные — по порядку привязки.
+ARTICLE_JSON = """
+    json_build_object(
+        'id', a.id,
+        'title', a.title,
+        'description', a.description,
+        'content', a.content,
+        'category_id', a.category_id,
+        'category_name', cats.categories->0->>'name',
+        'category_icon', cats.categories->0->>'icon',
+        'category_ids', cats.category_ids,
+        'categories', cats.categories,
+        'author_id', a.author_id,
+        'author_name', u.username,
+        'author_role', u.role,
+        'created_at', a.created_at,
+        'updated_at', a.updated_at,
+        'preview_image', a.preview_image,
+        'is_hidden', a.is_hidden,
+        'excerpt', a.excerpt,
+        'word_count', a.word_count,
+        'reading_minutes', a.reading_minutes,
+        'toc', a.toc,
+        'images', a.images
+    )::text
+"""
+
+ARTICLE_CATEGORIES_JOIN = """
+    LEFT JOIN LATERAL (
+        SELECT
+            COALESCE(
+                json_agg(json_build_object('id', c.id, 'name', c.name, 'icon', c.icon)
+                         ORDER BY (c.id = a.category_id) DESC, ac.created_at, c.id),
+                '[]'::json
+            ) AS categories,
+            COALESCE(
+                json_agg(c.id ORDER BY (c.id = a.category_id) DESC, ac.created_at, c.id),
+                '[]'::json
+            ) AS category_ids
+        FROM article_categories ac
+        JOIN categories c ON ac.category_id = c.id
+        WHERE ac.article_id = a.id
+    ) cats ON true
+"""
+
+
+def json_list_body(key: str, items: list) -> str:
+    """Тело ответа {key: [...]} из уже сериализованных элементов"""
+    return f'{{"{key}":[{",".join(items)}]}}'
+
+
+# Типы блоков редактора (GuideEditor) и поля, которые у них бывают
+BLOCK_TYPES = (
+    'paragraph', 'heading2', 'heading3', 'step', 'warning', 'tip',
+    'image', 'divider', 'list', 'button_link', 'sub_steps'
+)
+BLOCK_STRING_FIELDS = ('id', 'text', 'src', 'caption', 'label', 'href', 'icon')
+MAX_BLOCKS = 2000
+
+
+def validate_blocks(content):
+    """Проверяет блочный контент (список или его JSON-строка). Возвращает (blocks, error)"""
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except ValueError:
+            return None, 'Контент должен быть списком блоков'
+    if not isinstance(content, list) or not content:
+        return None, 'Контент должен быть непустым списком блоков'
+    if len(content) > MAX_BLOCKS:
+        return None, f'Слишком много блоков (максимум {MAX_BLOCKS})'
+
+    blocks = []
+    for i, block in enumerate(content):
+        if not isinstance(block, dict) or block.get('type') not in BLOCK_TYPES:
+            return None, f'Блок {i + 1}: неизвестный тип'
+        for field in BLOCK_STRING_FIELDS:
+            if field in block and block[field] is not None and not isinstance(block[field], str):
+                return None, f'Блок {i + 1}: поле {field} должно быть строкой'
+        if 'items' in block and not (
+            isinstance(block['items'], list) and all(isinstance(item, str) for item in block['items'])
+        ):
+            return None, f'Блок {i + 1}: items должен быть списком строк'
+        if 'ordered' in block and not isinstance(block['ordered'], bool):
+            return None, f'Блок {i + 1}: ordered должен быть true/false'
+        if 'stepNum' in block and block['stepNum'] is not None and (
+            isinstance(block['stepNum'], bool) or not isinstance(block['stepNum'], int)
+        ):
+            return None, f'Блок {i + 1}: stepNum должен быть числом'
+        # uploading — состояние редактора, в статье ему не место
+        blocks.append({k: v for k, v in block.items() if k != 'uploading'})
+    return blocks, None
+
+
+# Поля, вычисляемые из контента один раз при сохранении (см. derive_article_fields)
+DERIVED_COLUMNS = ('excerpt', 'word_count', 'reading_minutes', 'toc', 'images')
+EXCERPT_LENGTH = 280
+WORDS_PER_MINUTE = 180
+TEXT_BLOCK_TYPES = ('paragraph', 'heading2', 'heading3', 'step', 'tip', 'warning')
+HTML_TAG_RE = re.compile(r'<[^>]*>')
+MARKDOWN_RE = re.compile(r'[*`]')
+WORD_RE = re.compile(r'\w+')
+
+
+def plain_text(value: str) -> str:
+    """Текст без HTML-тегов и markdown-разметки блоков"""
+    return ' '.join(MARKDOWN_RE.sub('', HTML_TAG_RE.sub(' ', value or '')).split())
+
+
+def make_excerpt(text: str) -> str:
+    """Начало текста до EXCERPT_LENGTH символов, обрезанное по границе слова"""
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    cut = text[:EXCERPT_LENGTH].rsplit(' ', 1)[0]
+    return cut.rstrip(' ,.;:—-') + '…'
+
+
+def derive_article_fields(content) -> dict:
+    """Выдержка, число слов, время чтения, оглавление и список картинок по контенту статьи"""
+    if isinstance(content, str):
+        # Старая HTML-статья: только текст и картинки из <img>
+        text = plain_text(content)
+        words = len(WORD_RE.findall(text))
+        return {
+            'excerpt': make_excerpt(text),
+            'word_count': words,
+            'reading_minutes': max(1, math.ceil(words / WORDS_PER_MINUTE)) if words else 0,
+            'toc': [],
+            'images': [{'src': src, 'caption': ''} for src in re.findall(r'<img[^>]+src="([^"]+)"', content)]
+        }
+
+    parts, paragraphs, toc, images = [], [], [], []
+    for block in content or []:
+        block_type = block.get('type')
+        if block_type in TEXT_BLOCK_TYPES:
+            text = plain_text(block.get('text'))
+            parts.append(text)
+            if block_type == 'paragraph' and text:
+                paragraphs.append(text)
+            if block_type in ('heading2', 'heading3') and text:
+                toc.append({'id': block.get('id'), 'text': text, 'level': 2 if block_type == 'heading2' else 3})
+        elif block_type in ('list', 'sub_steps'):
+            parts.extend(plain_text(item) for item in block.get('items') or [])
+        elif block_type == 'image' and block.get('src'):
+            caption = plain_text(block.get('caption'))
+            parts.append(caption)
+            images.append({'src': block['src'], 'caption': caption})
+
+    words = len(WORD_RE.findall(' '.join(parts)))
+    return {
+        'excerpt': make_excerpt(' '.join(paragraphs) or ' '.join(p for p in parts if p)),
+        'word_count': words,
+        'reading_minutes': max(1, math.ceil(words / WORDS_PER_MINUTE)) if words else 0,
+        'toc': toc,
+        'images': images
+    }
+
+
+def derived_field_values(content) -> list:
+    """Значения DERIVED_COLUMNS в порядке колонок (JSONB-поля обёрнуты в Json)"""
+    derived = derive_article_fields(content)
+    return [
+        Json(derived[column], dumps=dumps_json) if column in ('toc', 'images') else derived[column]
+        for column in DERIVED_COLUMNS
+    ]
+
+
+def backfill_derived_fields(conn, only_missing: bool = True, batch_size: int = 100) -> int:
+    """Пересчитывает производные поля существующих статей пачками по id"""
+    cur = conn.cursor()
+    updated = 0
+    last_id = 0
+    try:
+        while True:
+            cur.execute(
+                f"""SELECT id, content FROM articles
+                    WHERE id > %s {'AND derived_at IS NULL' if only_missing else ''}
+                    ORDER BY id LIMIT %s""",
+                (last_id, batch_size)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            psycopg2.extras.execute_batch(
+                cur,
+                f"""UPDATE articles SET {', '.join(f'{column} = %s' for column in DERIVED_COLUMNS)},
+                           derived_at = CURRENT_TIMESTAMP
+                    WHERE id = %s""",
+                [(*derived_field_values(content), article_id) for article_id, content in rows]
+            )
+            conn.commit()
+            updated += len(rows)
+            last_id = rows[-1][0]
+            print(f"[backfill_derived] updated={updated} last_id={last_id}")
+        if updated:
+            # Производные поля видны в списках — закэшированные ответы надо сбросить
+            commit_catalog_change(conn, cur)
+    finally:
+        cur.close()
+    return updated
+
+
+def link_article_categories(cur, pairs: list):
+    """Привязки статей к категориям одним запросом: pairs — [(article_id, category_id)]"""
+    psycopg2.extras.execute_values(
+        cur, "INSERT INTO article_categories (article_id, category_id) VALUES %s", pairs
+    )
+
+
+def handle_articles(method: str, ctx: RequestContext) -> dict:
     """Управление статьями"""
     
-    conn = get_db_connection()
+    conn = ctx.conn
     cur = conn.cursor()
     
     try:
         if method == 'GET':
             # Публичный запрос — только видимые. Авторизованный — все.
-            user = validate_user(event)
-            if user and user['role'] in ('editor', 'moderator', 'administrator'):
-                where_clause = ""
-            else:
-                where_clause = "WHERE a.is_hidden = false"
+            is_staff = is_staff_user(ctx.user)
+            query = ctx.query
+
+            if query.get('view') == 'summary':
+                return list_article_summaries(cur, query, is_staff, catalog_last_modified(ctx))
+
+            if query.get('ids'):
+                try:
+                    ids = parse_id_list(query['ids'])
+                except ValueError:
+                    return cors_response(400, {'error': 'Invalid ids'})
+                rows = fetch_articles_by_ids(cur, ids, is_staff)
+                return cors_response(
+                    200,
+                    json_list_body('articles', [a[2] for a in rows]),
+                    catalog_last_modified(ctx)
+                )
+
+            where_clause = "" if is_staff else "WHERE a.is_hidden = false"
 
             cur.execute(f"""
-                SELECT a.id, a.title, a.description, a.content, a.category_id, 
-                       a.author_id, u.username as author_name, u.role as author_role,
-                       a.created_at, a.updated_at, a.preview_image, a.is_hidden
+                SELECT a.id, a.updated_at, {ARTICLE_JSON}
                 FROM articles a
                 LEFT JOIN users u ON a.author_id = u.id
+                {ARTICLE_CATEGORIES_JOIN}
                 {where_clause}
-                ORDER BY a.updated_at DESC
+                ORDER BY a.updated_at DESC, a.id DESC
             """)
-            articles = cur.fetchall()
-            
-            result_articles = []
-            for a in articles:
-                article_id = a[0]
-                
-                cur.execute("""
-                    SELECT c.id, c.name, c.icon
-                    FROM article_categories ac
-                    JOIN categories c ON ac.category_id = c.id
-                    WHERE ac.article_id = %s
-                """, (article_id,))
-                categories_data = cur.fetchall()
-                
-                category_name = categories_data[0][1] if categories_data else None
-                category_icon = categories_data[0][2] if categories_data else None
-                
-                result_articles.append({
-                    'id': a[0],
-                    'title': a[1],
-                    'description': a[2],
-                    'content': a[3],
-                    'category_id': a[4],
-                    'category_name': category_name,
-                    'category_icon': category_icon,
-                    'category_ids': [c[0] for c in categories_data],
-                    'categories': [{'id': c[0], 'name': c[1], 'icon': c[2]} for c in categories_data],
-                    'author_id': a[5],
-                    'author_name': a[6],
-                    'author_role': a[7],
-                    'created_at': a[8].isoformat() if a[8] else None,
-                    'updated_at': a[9].isoformat() if a[9] else None,
-                    'preview_image': a[10],
-                    'is_hidden': a[11]
-                })
+            rows = cur.fetchall()
             
-            return cors_response(200, {'articles': result_articles})
+            return cors_response(
+                200,
+                json_list_body('articles', [a[2] for a in rows]),
+                catalog_last_modified(ctx)
+            )
         
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            user = validate_user(event)
+            body = ctx.body
+            user = ctx.user
             print(f"[create_article] user={user}")
             
             if not user:
@@ -177,36 +482,39 @@ def handle_articles(method: str, event: dict) -> dict:
             
             title = body.get('title', '').strip()
             description = body.get('description', '').strip()
-            content = body.get('content', '').strip()
+            content = body.get('content')
             category_ids = body.get('category_ids', [])
             preview_image = body.get('preview_image')
             is_hidden = body.get('is_hidden', False)
-            print(f"[create_article] title={title!r}, category_ids={category_ids}, content_len={len(content)}")
+            print(f"[create_article] title={title!r}, category_ids={category_ids}")
             
             if not title or not content:
                 return cors_response(400, {'error': 'Заголовок и контент обязательны'})
             
+            blocks, error = validate_blocks(content)
+            if error:
+                return cors_response(400, {'error': error})
+            
             if not category_ids:
                 return cors_response(400, {'error': 'Выберите хотя бы одну категорию'})
             
             first_category_id = category_ids[0] if category_ids else None
             
             cur.execute(
-                """INSERT INTO articles (title, description, content, category_id, author_id, preview_image, is_hidden) 
-                   VALUES (%s, %s, %s, %s, %s, %s, %s) 
-                   RETURNING id, title, description, content, category_id, author_id, created_at, updated_at""",
-                (title, description, content, first_category_id, user['id'], preview_image, is_hidden)
+                f"""INSERT INTO articles (title, description, content, category_id, author_id, preview_image, is_hidden,
+                                         {', '.join(DERIVED_COLUMNS)}, derived_at) 
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, {', '.join(['%s'] * len(DERIVED_COLUMNS))}, CURRENT_TIMESTAMP) 
+                   RETURNING id, title, description, content, category_id, author_id, created_at, updated_at, content_hash""",
+                (title, description, Json(blocks, dumps=dumps_json), first_category_id, user['id'], preview_image, is_hidden,
+                 *derived_field_values(blocks))
             )
             new_article = cur.fetchone()
             article_id = new_article[0]
+            store_article_html(cur, article_id, new_article[8], blocks)
             
-            for cat_id in category_ids:
-                cur.execute(
-                    "INSERT INTO article_categories (article_id, category_id) VALUES (%s, %s)",
-                    (article_id, cat_id)
-                )
+            link_article_categories(cur, [(article_id, cat_id) for cat_id in dict.fromkeys(category_ids)])
             
-            conn.commit()
+            commit_catalog_change(conn, cur, article_ids=[article_id])
             
             return cors_response(201, {
                 'article': {
@@ -223,8 +531,8 @@ def handle_articles(method: str, event: dict) -> dict:
             })
         
         elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            user = validate_user(event)
+            body = ctx.body
+            user = ctx.user
             
             if not user:
                 return cors_response(403, {'error': 'Authentication required'})
@@ -255,8 +563,14 @@ def handle_articles(method: str, event: dict) -> dict:
                 params.append(body['description'])
             
             if 'content' in body:
+                blocks, error = validate_blocks(body['content'])
+                if error:
+                    return cors_response(400, {'error': error})
                 updates.append("content = %s")
-                params.append(body['content'])
+                params.append(Json(blocks, dumps=dumps_json))
+                updates.extend(f"{column} = %s" for column in DERIVED_COLUMNS)
+                params.extend(derived_field_values(blocks))
+                updates.append("derived_at = CURRENT_TIMESTAMP")
             
             if 'category_id' in body:
                 updates.append("category_id = %s")
@@ -278,55 +592,691 @@ def handle_articles(method: str, event: dict) -> dict:
                     
                     cur.execute("DELETE FROM article_categories WHERE article_id = %s", (article_id,))
                     
-                    for cat_id in category_ids:
-                        cur.execute(
-                            "INSERT INTO article_categories (article_id, category_id) VALUES (%s, %s)",
-                            (article_id, cat_id)
-                        )
+                    link_article_categories(cur, [(article_id, cat_id) for cat_id in dict.fromkeys(category_ids)])
             
             if updates:
                 updates.append("updated_at = CURRENT_TIMESTAMP")
                 params.append(article_id)
                 
-                query = f"UPDATE articles SET {', '.join(updates)} WHERE id = %s"
+                query = f"UPDATE articles SET {', '.join(updates)} WHERE id = %s RETURNING content_hash"
                 cur.execute(query, params)
-                conn.commit()
+                if 'content' in body:
+                    store_article_html(cur, article_id, cur.fetchone()[0], blocks)
+                commit_catalog_change(conn, cur, article_ids=[int(article_id)])
             
             return cors_response(200, {'success': True})
         
         elif method == 'DELETE':
-            user = validate_user(event)
+            user = ctx.user
             
             if not user or user['role'] not in ['moderator', 'administrator']:
                 return cors_response(403, {'error': 'Access denied'})
             
-            query = event.get('queryStringParameters', {})
+            query = ctx.query
             article_id = query.get('id')
             
             if not article_id:
                 return cors_response(400, {'error': 'ID is required'})
             
-            cur.execute("DELETE FROM articles WHERE id = %s", (article_id,))
-            conn.commit()
+            delete_articles(cur, [int(article_id)])
+            commit_catalog_change(conn, cur, article_ids=[int(article_id)])
             
             return cors_response(200, {'success': True})
         
     finally:
         cur.close()
-        conn.close()
     
     return cors_response(405, {'error': 'Method not allowed'})
 
 
-def handle_users(method: str, event: dict) -> dict:
+# Пакетные операции над статьями: всё в одной транзакции, однотипные операции — одним
+# запросом (связи с категориями — одним execute_values). Каждая группа идёт под своим
+# SAVEPOINT: ошибка в ней помечает её элементы, а остальные группы применяются.
+BULK_OPERATIONS = ('hide', 'unhide', 'set_categories', 'delete')
+MAX_BULK_OPERATIONS = 200
+
+
+def handle_articles_bulk(method: str, ctx: RequestContext) -> dict:
+    """Скрыть/показать, сменить категории или удалить несколько статей разом (модераторы+)"""
+    if method != 'POST':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    if not user or user['role'] not in ('moderator', 'administrator'):
+        return cors_response(403, {'error': 'Access denied'})
+
+    operations = ctx.body.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return cors_response(400, {'error': 'operations должен быть непустым списком'})
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return cors_response(400, {'error': f'Не больше {MAX_BULK_OPERATIONS} операций за раз'})
+
+    results = []
+    groups = {op: {} for op in BULK_OPERATIONS}
+    for item in operations:
+        item = item if isinstance(item, dict) else {}
+        op, article_id = item.get('op'), item.get('id')
+        result = {'id': article_id, 'op': op}
+        results.append(result)
+        if op not in BULK_OPERATIONS:
+            result.update(status='invalid', error='Неизвестная операция')
+        elif isinstance(article_id, bool) or not isinstance(article_id, int):
+            result.update(status='invalid', error='id должен быть числом')
+        elif any(article_id in group for group in groups.values()):
+            result.update(status='invalid', error='Статья уже есть в этом запросе')
+        elif op == 'set_categories' and not (
+            isinstance(item.get('category_ids'), list) and item['category_ids']
+            and all(isinstance(c, int) and not isinstance(c, bool) for c in item['category_ids'])
+        ):
+            result.update(status='invalid', error='category_ids должен быть непустым списком id')
+        else:
+            groups[op][article_id] = list(dict.fromkeys(item.get('category_ids') or []))
+
+    conn = ctx.conn
+    cur = conn.cursor()
+    try:
+        ids = [article_id for group in groups.values() for article_id in group]
+        cur.execute("SELECT id FROM articles WHERE id = ANY(%s)", (ids,))
+        existing = {r[0] for r in cur.fetchall()}
+        category_ids = {c for cats in groups['set_categories'].values() for c in cats}
+        cur.execute("SELECT id FROM categories WHERE id = ANY(%s)", (list(category_ids),))
+        known_categories = {r[0] for r in cur.fetchall()}
+
+        status = {}
+        for op, group in groups.items():
+            for article_id in list(group):
+                if article_id not in existing:
+                    status[article_id] = ('not_found', 'Статья не найдена')
+                    del group[article_id]
+                elif op == 'set_categories' and not set(group[article_id]) <= known_categories:
+                    status[article_id] = ('invalid', 'Неизвестная категория')
+                    del group[article_id]
+
+        for op, group in groups.items():
+            if not group:
+                continue
+            cur.execute("SAVEPOINT bulk_group")
+            try:
+                apply_bulk_operation(cur, op, group)
+                cur.execute("RELEASE SAVEPOINT bulk_group")
+                status.update((article_id, ('ok', None)) for article_id in group)
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT bulk_group")
+                print(f"[articles_bulk] {op} failed: {e}")
+                status.update((article_id, ('error', 'Ошибка базы данных')) for article_id in group)
+
+        applied = sorted(article_id for article_id, (state, _) in status.items() if state == 'ok')
+        if applied:
+            commit_catalog_change(conn, cur, article_ids=applied)
+        else:
+            conn.rollback()
+    finally:
+        cur.close()
+
+    for result in results:
+        if 'status' not in result:
+            state, error = status[result['id']]
+            result['status'] = state
+            if error:
+                result['error'] = error
+    print(f"[articles_bulk] user={user['username']} operations={len(results)} applied={len(applied)}")
+    return cors_response(200, {'results': results, 'applied': len(applied)})
+
+
+def apply_bulk_operation(cur, op: str, group: dict):
+    """Одна группа однотипных операций: group — {article_id: category_ids}"""
+    ids = list(group)
+    if op in ('hide', 'unhide'):
+        cur.execute(
+            "UPDATE articles SET is_hidden = %s, updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)",
+            (op == 'hide', ids)
+        )
+    elif op == 'set_categories':
+        cur.execute("DELETE FROM article_categories WHERE article_id = ANY(%s)", (ids,))
+        link_article_categories(cur, [
+            (article_id, category_id) for article_id, cats in group.items() for category_id in cats
+        ])
+        # Основная категория — первая в списке, как в handle_articles PUT
+        psycopg2.extras.execute_values(
+            cur,
+            """UPDATE articles AS a SET category_id = v.category_id, updated_at = CURRENT_TIMESTAMP
+               FROM (VALUES %s) AS v (id, category_id) WHERE a.id = v.id""",
+            [(article_id, cats[0]) for article_id, cats in group.items()]
+        )
+    elif op == 'delete':
+        delete_articles(cur, ids)
+
+
+def delete_articles(cur, ids: list):
+    """Удаление статей вместе с черновиками правок и связями с категориями — одинаково для
+    одиночного и пакетного DELETE. Черновики держат на статью внешний ключ, а править
+    удалённую статью всё равно нельзя, поэтому они удаляются у всех пользователей"""
+    cur.execute("DELETE FROM article_drafts WHERE article_id = ANY(%s)", (ids,))
+    cur.execute("DELETE FROM article_categories WHERE article_id = ANY(%s)", (ids,))
+    cur.execute("DELETE FROM articles WHERE id = ANY(%s)", (ids,))
+
+
+MAX_BATCH_IDS = 100
+
+
+def is_staff_user(user) -> bool:
+    """Редакторы и выше видят скрытые статьи"""
+    return bool(user and user['role'] in ('editor', 'moderator', 'administrator'))
+
+
+def parse_id_list(raw: str) -> list:
+    """Разбирает '1,2,3' в список id без повторов (порядок сохраняется)"""
+    ids = []
+    for part in raw.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        article_id = int(part)
+        if article_id not in ids:
+            ids.append(article_id)
+    if not ids or len(ids) > MAX_BATCH_IDS:
+        raise ValueError('Invalid ids')
+    return ids
+
+
+def fetch_articles_by_ids(cur, ids: list, is_staff: bool) -> list:
+    """Строки (id, updated_at, JSON статьи) по списку id одним запросом по первичному ключу"""
+    visibility = "" if is_staff else "AND a.is_hidden = false"
+    cur.execute(f"""
+        SELECT a.id, a.updated_at, {ARTICLE_JSON}
+        FROM articles a
+        LEFT JOIN users u ON a.author_id = u.id
+        {ARTICLE_CATEGORIES_JOIN}
+        WHERE a.id = ANY(%s) {visibility}
+    """, (ids,))
+    by_id = {row[0]: row for row in cur.fetchall()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def handle_article(method: str, ctx: RequestContext) -> dict:
+    """Одна статья по id (с теми же правилами видимости, что и список)"""
+    if method != 'GET':
+        return cors_response(405, {'error': 'Method not allowed'})
+
+    query = ctx.query
+    try:
+        article_id = int(query.get('id', ''))
+    except ValueError:
+        return cors_response(400, {'error': 'ID is required'})
+
+    is_staff = is_staff_user(ctx.user)
+
+    if query.get('format') == 'html':
+        return article_html_response(ctx, article_id, is_staff)
+
+    conn = ctx.conn
+    cur = conn.cursor()
+    try:
+        rows = fetch_articles_by_ids(cur, [article_id], is_staff)
+    finally:
+        cur.close()
+
+    if not rows:
+        return cors_response(404, {'error': 'Article not found'})
+    # JSON статьи меняется и без её updated_at (категории, имя и роль автора) — дата берётся из версии каталога
+    return cors_response(200, f'{{"article":{rows[0][2]}}}', catalog_last_modified(ctx))
+
+
+# Серверный рендер блоков — тот же HTML, что renderBlocksToHtml в GuideEditor.tsx
+GB_STYLE = """<style>
+.gb{font-family:sans-serif;line-height:1.7;color:#e2e8f0;}
+.gb-h2{display:flex;align-items:center;gap:10px;margin:28px 0 12px;padding-bottom:8px;border-bottom:1px solid #1e293b;}
+.gb-h2-bar{width:4px;height:28px;background:#f97316;border-radius:2px;flex-shrink:0;}
+.gb-h2 span{color:#fff;font-size:1.4rem;font-weight:700;}
+.gb-h3{display:flex;align-items:center;gap:8px;margin:20px 0 8px;}
+.gb-h3-bar{width:3px;height:20px;background:#f97316;opacity:.6;border-radius:2px;flex-shrink:0;}
+.gb-h3 span{color:#e2e8f0;font-size:1.1rem;font-weight:600;}
+.gb-p{color:#cbd5e1;margin:0 0 12px;font-size:0.95rem;}
+.gb-step{display:flex;gap:14px;background:#0f172a;border:1px solid #1e293b;border-radius:10px;padding:14px 18px;margin:10px 0;}
+.gb-step-num{min-width:34px;height:34px;border-radius:8px;display:flex;align-items:center;justify-content:center;font-weight:800;color:#fff;font-size:0.95rem;flex-shrink:0;margin-top:2px;}
+.gb-step-text{color:#cbd5e1;font-size:0.93rem;line-height:1.65;}
+.gb-warn{background:#431407;border:1px solid #c2410c;border-radius:10px;padding:14px 18px;margin:16px 0;}
+.gb-warn-title{color:#fb923c;font-weight:700;font-size:0.95rem;margin:0 0 8px;}
+.gb-warn-text{color:#fed7aa;font-size:0.92rem;margin:0;}
+.gb-tip{background:#042f2e;border:1px solid #0f766e;border-radius:10px;padding:14px 18px;margin:16px 0;}
+.gb-tip-title{color:#2dd4bf;font-weight:700;font-size:0.95rem;margin:0 0 8px;}
+.gb-tip-text{color:#99f6e4;font-size:0.92rem;margin:0;}
+.gb-img{width:100%;max-width:720px;height:auto;border-radius:10px;border:1px solid #334155;margin:10px 0;display:block;}
+.gb-img-cap{text-align:center;color:#64748b;font-size:0.78rem;margin:-4px 0 14px;}
+.gb-hr{border:none;border-top:1px solid #334155;margin:24px 0;}
+.gb-ul,.gb-ol{margin:10px 0;padding-left:24px;color:#cbd5e1;font-size:0.93rem;}
+.gb-ul li,.gb-ol li{margin-bottom:6px;}
+.gb-btn{display:inline-block;padding:10px 22px;background:#f97316;color:#ffffff !important;border-radius:8px;font-weight:600;font-size:0.9rem;text-decoration:none !important;margin:8px 0;}
+.gb-btn:hover{background:#ea6c0a;color:#ffffff !important;}
+.gb-sub-wrap{margin:6px 0 6px 16px;display:flex;flex-direction:column;gap:6px;}
+.gb-sub{display:flex;align-items:flex-start;gap:10px;color:#94a3b8;font-size:0.9rem;}
+.gb-sub-arrow{color:#f97316;font-weight:700;flex-shrink:0;margin-top:1px;}
+@media(max-width:600px){.gb-step{padding:10px 12px;}.gb-h2 span{font-size:1.1rem;}.gb-img{max-width:100%;}}
+</style>"""
+# Меняется вместе с разметкой или стилями: старый HTML в article_html перестаёт находиться
+HTML_RENDERER_VERSION = 3
+CODE_STYLE = 'background:#1e293b;border:1px solid #334155;padding:1px 6px;border-radius:4px;font-size:0.85em;color:#e2e8f0;font-family:monospace;'
+
+
+def escape_html(s: str) -> str:
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_attr(s: str) -> str:
+    """Значение для атрибута в двойных кавычках"""
+    return escape_html(s).replace('"', '&quot;')
+
+
+def safe_href(url: str) -> str:
+    """Ссылка кнопки: javascript: и прочие схемы кроме http(s)/mailto заменяются на #"""
+    scheme = re.match(r'\s*([a-zA-Z][a-zA-Z0-9+.-]*):', url)
+    if scheme and scheme.group(1).lower() not in ('http', 'https', 'mailto'):
+        return '#'
+    return url
+
+
+# URL варианта картинки из бакета: .../<xx>/<sha256>/<thumb|card|full>.<ext> (см. store_image)
+IMAGE_VARIANT_URL = re.compile(r'(/[0-9a-f]{2}/[0-9a-f]{64}/)(thumb|card|full)\.(jpg|png|webp)$')
+IMAGE_SIZES = '(max-width: 760px) 100vw, 720px'
+
+
+def image_variant_url(url: str, name: str) -> str:
+    """URL нужного варианта; чужие и старые URL (без вариантов) возвращаются как есть"""
+    return IMAGE_VARIANT_URL.sub(rf'\g<1>{name}.\g<3>', url)
+
+
+def format_inline(s: str) -> str:
+    """Экранирование + **жирный**, *курсив*, `код` и переводы строк"""
+    s = escape_html(s)
+    s = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', s)
+    s = re.sub(r'\*(.+?)\*', r'<em>\1</em>', s)
+    s = re.sub(r'`(.+?)`', rf'<code style="{CODE_STYLE}">\1</code>', s)
+    return s.replace('\n', '<br/>')
+
+
+def render_blocks_html(content) -> str:
+    """HTML статьи из блоков; старый HTML-контент (строка) отдаётся как есть"""
+    if isinstance(content, str):
+        return content
+
+    parts = [GB_STYLE + '\n<div class="gb">']
+    for b in content or []:
+        block_type = b.get('type')
+        text = b.get('text') or ''
+        if block_type == 'paragraph' and text:
+            parts.append(f'<p class="gb-p">{format_inline(text)}</p>')
+        elif block_type == 'heading2' and text:
+            parts.append(f'<div class="gb-h2"><div class="gb-h2-bar"></div><span>{escape_html(text)}</span></div>')
+        elif block_type == 'heading3' and text:
+            parts.append(f'<div class="gb-h3"><div class="gb-h3-bar"></div><span>{escape_html(text)}</span></div>')
+        elif block_type == 'step':
+            num = b.get('stepNum') if b.get('stepNum') is not None else 1
+            parts.append(
+                f'<div class="gb-step"><div class="gb-step-num" style="background:#f97316">{num}</div>'
+                f'<div class="gb-step-text">{format_inline(text)}</div></div>'
+            )
+        elif block_type == 'warning':
+            parts.append(
+                f'<div class="gb-warn"><div class="gb-warn-title">⚠️ {escape_html(b.get("icon") or "Важно!")}</div>'
+                f'<p class="gb-warn-text">{format_inline(text)}</p></div>'
+            )
+        elif block_type == 'tip':
+            parts.append(
+                f'<div class="gb-tip"><div class="gb-tip-title">💡 {escape_html(b.get("icon") or "Подсказка")}</div>'
+                f'<p class="gb-tip-text">{format_inline(text)}</p></div>'
+            )
+        elif block_type == 'image' and b.get('src'):
+            caption = b.get('caption') or ''
+            src = b['src']
+            responsive = ''
+            if IMAGE_VARIANT_URL.search(src):
+                srcset = f"{image_variant_url(src, 'card')} 800w, {image_variant_url(src, 'full')} 1920w"
+                responsive = f' srcset="{escape_attr(srcset)}" sizes="{IMAGE_SIZES}"'
+            parts.append(
+                f'<img class="gb-img" src="{escape_attr(image_variant_url(src, "card"))}"{responsive} '
+                f'alt="{escape_attr(caption)}" />'
+            )
+            if caption:
+                parts.append(f'<p class="gb-img-cap">{escape_html(caption)}</p>')
+        elif block_type == 'divider':
+            parts.append('<hr class="gb-hr" />')
+        elif block_type == 'list' and b.get('items'):
+            tag, cls = ('ol', 'gb-ol') if b.get('ordered') else ('ul', 'gb-ul')
+            items = ''.join(f'<li>{format_inline(i)}</li>' for i in b['items'] if i.strip())
+            parts.append(f'<{tag} class="{cls}">{items}</{tag}>')
+        elif block_type == 'button_link' and b.get('label'):
+            parts.append(
+                f'<a href="{escape_attr(safe_href(b.get("href") or "#"))}" target="_blank" rel="noopener noreferrer" class="gb-btn" '
+                f'style="color:#ffffff !important;text-decoration:none;">{escape_html(b["label"])}</a>'
+            )
+        elif block_type == 'sub_steps' and b.get('items'):
+            rendered = ''.join(
+                f'<div class="gb-sub"><span class="gb-sub-arrow">—</span><span>{format_inline(i)}</span></div>'
+                for i in b['items'] if i.strip()
+            )
+            parts.append(f'<div class="gb-sub-wrap">{rendered}</div>')
+    parts.append('</div>')
+    return '\n'.join(parts)
+
+
+def store_article_html(cur, article_id: int, content_hash: str, content):
+    """Кладёт отрендеренный HTML в article_html и убирает версии для старого контента или рендера"""
+    cur.execute(
+        """INSERT INTO article_html (article_id, content_hash, renderer, html) VALUES (%s, %s, %s, %s)
+           ON CONFLICT (article_id, content_hash, renderer) DO NOTHING""",
+        (article_id, content_hash, HTML_RENDERER_VERSION, render_blocks_html(content))
+    )
+    cur.execute(
+        "DELETE FROM article_html WHERE article_id = %s AND (content_hash <> %s OR renderer <> %s)",
+        (article_id, content_hash, HTML_RENDERER_VERSION)
+    )
+
+
+def article_html_response(ctx: RequestContext, article_id: int, is_staff: bool) -> dict:
+    """Статья готовой HTML-страницей: одна выборка из article_html, рендер только при промахе"""
+    visibility = "" if is_staff else "AND a.is_hidden = false"
+    conn = ctx.conn
+    cur = conn.cursor()
+    try:
+        # content читается только если HTML для текущего хэша ещё не отрендерен
+        cur.execute(f"""
+            SELECT a.title, a.description, a.updated_at, a.content_hash, h.html,
+                   CASE WHEN h.html IS NULL THEN a.content END
+            FROM articles a
+            LEFT JOIN article_html h
+                ON h.article_id = a.id AND h.content_hash = a.content_hash AND h.renderer = %s
+            WHERE a.id = %s {visibility}
+        """, (HTML_RENDERER_VERSION, article_id))
+        row = cur.fetchone()
+        if not row:
+            return cors_response(404, {'error': 'Article not found'})
+
+        title, description, updated_at, content_hash, html, content = row
+        if html is None:
+            html = render_blocks_html(content)
+            cur.execute(
+                """INSERT INTO article_html (article_id, content_hash, renderer, html) VALUES (%s, %s, %s, %s)
+                   ON CONFLICT (article_id, content_hash, renderer) DO NOTHING""",
+                (article_id, content_hash, HTML_RENDERER_VERSION, html)
+            )
+            conn.commit()
+    finally:
+        cur.close()
+
+    page = (
+        '<!DOCTYPE html>\n<html lang="ru">\n<head>\n<meta charset="utf-8" />\n'
+        f'<title>{escape_html(title)}</title>\n'
+        f'<meta name="description" content="{escape_attr(description or "")}" />\n'
+        f'</head>\n<body>\n<h1>{escape_html(title)}</h1>\n{html}\n</body>\n</html>'
+    )
+    headers = {'Content-Type': 'text/html; charset=utf-8', **last_modified_headers([updated_at])}
+    return cors_response(200, page, headers)
+
+
+SUMMARY_PAGE_SIZE = 20
+SUMMARY_MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(updated_at: datetime, article_id: int) -> str:
+    """Курсор keyset-пагинации по (updated_at, id)"""
+    raw = f"{updated_at.isoformat()}|{article_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Разбирает курсор обратно в (updated_at, id). ValueError — если курсор испорчен"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        updated_at, article_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(updated_at), int(article_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def list_article_summaries(cur, query: dict, is_staff: bool, headers: dict = None) -> dict:
+    """Лёгкий список статей без content с keyset-пагинацией и фильтром по категории"""
+    try:
+        limit = min(max(int(query.get('limit', SUMMARY_PAGE_SIZE)), 1), SUMMARY_MAX_PAGE_SIZE)
+        category_id = int(query['category_id']) if query.get('category_id') else None
+        after = decode_cursor(query['cursor']) if query.get('cursor') else None
+    except ValueError:
+        return cors_response(400, {'error': 'Invalid pagination parameters'})
+
+    conditions = []
+    params = []
+    if not is_staff:
+        conditions.append("a.is_hidden = false")
+    if category_id is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM article_categories f WHERE f.article_id = a.id AND f.category_id = %s)"
+        )
+        params.append(category_id)
+    if after:
+        # Сравнение кортежей идёт по индексу (updated_at DESC, id DESC) — страница N стоит как первая
+        conditions.append("(a.updated_at, a.id) < (%s, %s)")
+        params.extend(after)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cur.execute(f"""
+        SELECT {SUMMARY_COLUMNS}
+        FROM articles a
+        {ARTICLE_CATEGORIES_JOIN}
+        {where_clause}
+        ORDER BY a.updated_at DESC, a.id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][4], rows[-1][0]) if has_more else None
+
+    return cors_response(200, {
+        'articles': [summary_from_row(r) for r in rows],
+        'next_cursor': next_cursor
+    }, headers)
+
+
+SUMMARY_COLUMNS = """
+    a.id, a.title, a.description, a.preview_image, a.updated_at, a.is_hidden, cats.categories,
+    a.excerpt, a.word_count, a.reading_minutes
+"""
+
+
+def summary_from_row(r) -> dict:
+    """Элемент лёгкого списка статей из строки SUMMARY_COLUMNS"""
+    return {
+        'id': r[0],
+        'title': r[1],
+        'description': r[2],
+        'preview_image': r[3],
+        'updated_at': r[4].isoformat() if r[4] else None,
+        'is_hidden': r[5],
+        'categories': r[6] or [],
+        'excerpt': r[7],
+        'word_count': r[8],
+        'reading_minutes': r[9]
+    }
+
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_OFFSET = 1000
+SEARCH_HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=30, MinWords=12, FragmentDelimiter=" … "'
+
+
+def sql_escape_html(expr: str) -> str:
+    """SQL-выражение с экранированным HTML: подсветка ts_headline отдаётся как разметка,
+    и единственными тегами в ней должны быть <mark>, а не текст из статьи"""
+    return f"replace(replace(replace({expr}, '&', '&amp;'), '<', '&lt;'), '>', '&gt;')"
+
+
+def handle_search(method: str, ctx: RequestContext) -> dict:
+    """Полнотекстовый поиск по заголовку, описанию и тексту блоков (GIN по search_vector)"""
+    if method != 'GET':
+        return cors_response(405, {'error': 'Method not allowed'})
+
+    query = ctx.query
+    q = (query.get('q') or '').strip()
+    if not q:
+        return cors_response(400, {'error': 'Query is required'})
+
+    try:
+        limit = min(max(int(query.get('limit', SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+        offset = min(max(int(query.get('offset', 0)), 0), SEARCH_MAX_OFFSET)
+    except ValueError:
+        return cors_response(400, {'error': 'Invalid pagination parameters'})
+
+    visibility = "" if is_staff_user(ctx.user) else "AND a.is_hidden = false"
+
+    cur = ctx.conn.cursor()
+    try:
+        # Ранжируем по индексу, а дорогой ts_headline считаем только для строк страницы
+        cur.execute(f"""
+            WITH hits AS (
+                SELECT a.id, ts_rank_cd(a.search_vector, q) AS rank, q
+                FROM articles a, websearch_to_tsquery('russian', %s) q
+                WHERE a.search_vector @@ q {visibility}
+                ORDER BY rank DESC, a.id DESC
+                LIMIT %s OFFSET %s
+            )
+            SELECT a.id, a.title, a.description, a.preview_image, a.updated_at, h.rank,
+                   ts_headline('russian', {sql_escape_html('a.title')}, h.q,
+                               'StartSel=<mark>, StopSel=</mark>, HighlightAll=true'),
+                   ts_headline('russian', {sql_escape_html("a.description || ' ' || article_content_text(a.content)")},
+                               h.q, %s),
+                   cats.categories
+            FROM hits h
+            JOIN articles a ON a.id = h.id
+            {ARTICLE_CATEGORIES_JOIN}
+            ORDER BY h.rank DESC, a.id DESC
+        """, (q, limit + 1, offset, SEARCH_HEADLINE_OPTIONS))
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return cors_response(200, {
+        'results': [
+            {
+                'id': r[0],
+                'title': r[1],
+                'description': r[2],
+                'preview_image': r[3],
+                'updated_at': r[4].isoformat() if r[4] else None,
+                'rank': round(r[5], 4),
+                'title_highlighted': r[6],
+                'snippet': r[7],
+                'categories': r[8] or []
+            }
+            for r in rows
+        ],
+        'next_offset': offset + limit if has_more and offset + limit <= SEARCH_MAX_OFFSET else None
+    }, catalog_last_modified(ctx))
+
+
+CHANGES_PAGE_SIZE = 100
+CHANGES_MAX_PAGE_SIZE = 500
+
+
+def encode_change_cursor(txid: int, seq: int) -> str:
+    """Курсор ленты изменений: позиция (txid, change_seq) последней выданной записи"""
+    return f"{txid}.{seq}"
+
+
+def decode_change_cursor(cursor: str):
+    """Разбирает курсор ленты. ValueError — если курсор испорчен"""
+    txid, seq = cursor.split('.', 1)
+    return int(txid), int(seq)
+
+
+def handle_changes(method: str, ctx: RequestContext) -> dict:
+    """Лента изменений каталога после курсора: изменённые статьи и категории плюс удалённые id"""
+    if method != 'GET':
+        return cors_response(405, {'error': 'Method not allowed'})
+
+    query = ctx.query
+    try:
+        limit = min(max(int(query.get('limit', CHANGES_PAGE_SIZE)), 1), CHANGES_MAX_PAGE_SIZE)
+        since = decode_change_cursor(query['since']) if query.get('since') else (0, 0)
+    except ValueError:
+        return cors_response(400, {'error': 'Invalid cursor'})
+
+    is_staff = is_staff_user(ctx.user)
+    conn = ctx.conn
+    cur = conn.cursor()
+    try:
+        # Только завершённые транзакции: всё, что младше xmin, уже не изменится задним числом
+        cur.execute("""
+            WITH horizon AS (SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin)
+            SELECT kind, entity_id, change_txid, change_seq, (SELECT xmin FROM horizon)
+            FROM (
+                SELECT 'article' AS kind, id AS entity_id, change_txid, change_seq FROM articles
+                UNION ALL
+                SELECT 'category', id, change_txid, change_seq FROM categories
+                UNION ALL
+                SELECT 'deleted_' || entity, entity_id, change_txid, change_seq FROM catalog_tombstones
+            ) changes
+            WHERE (change_txid, change_seq) > (%s, %s)
+              AND change_txid < (SELECT xmin FROM horizon)
+            ORDER BY change_txid, change_seq
+            LIMIT %s
+        """, (*since, limit + 1))
+        rows = cur.fetchall()
+        if not rows:
+            cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+            horizon = cur.fetchone()[0]
+        else:
+            horizon = rows[0][4]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if has_more:
+            cursor = encode_change_cursor(rows[-1][2], rows[-1][3])
+        else:
+            # Всё до горизонта выдано: следующий запрос начнётся с ещё незавершённых транзакций
+            cursor = encode_change_cursor(*max(since, (horizon, 0)))
+
+        ids = {'article': [], 'category': [], 'deleted_article': [], 'deleted_category': []}
+        for kind, entity_id, *_ in rows:
+            ids[kind].append(entity_id)
+
+        articles = fetch_articles_by_ids(cur, ids['article'], is_staff) if ids['article'] else []
+        # Скрытая статья для публичного клиента — то же, что удалённая
+        visible_ids = {row[0] for row in articles}
+        deleted_articles = ids['deleted_article'] + [i for i in ids['article'] if i not in visible_ids]
+
+        categories = []
+        if ids['category']:
+            cur.execute(
+                "SELECT id, name, icon, created_at FROM categories WHERE id = ANY(%s) ORDER BY id",
+                (ids['category'],)
+            )
+            categories = [category_from_row(c) for c in cur.fetchall()]
+    finally:
+        cur.close()
+
+    tail = dumps_json({
+        'categories': categories,
+        'deleted': {'articles': deleted_articles, 'categories': ids['deleted_category']},
+        'cursor': cursor,
+        'has_more': has_more
+    })
+    body = f'{{"articles":[{",".join(row[2] for row in articles)}],{tail[1:]}'
+    return cors_response(200, body, {'Cache-Control': 'no-store'})
+
+
+def handle_users(method: str, ctx: RequestContext) -> dict:
     """Управление пользователями (только для супер-админа)"""
     
-    user = validate_user(event)
+    user = ctx.user
     
     if not user or user['steam_id'] != '76561198995407853':
         return cors_response(403, {'error': 'Access denied'})
     
-    conn = get_db_connection()
+    conn = ctx.conn
     cur = conn.cursor()
     
     try:
@@ -354,7 +1304,7 @@ def handle_users(method: str, event: dict) -> dict:
             })
         
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
+            body = ctx.body
             steam_id = body.get('steam_id')
             username = body.get('username')
             role = body.get('role', 'editor')
@@ -388,7 +1338,7 @@ def handle_users(method: str, event: dict) -> dict:
             })
         
         elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
+            body = ctx.body
             user_id = body.get('id')
             new_role = body.get('role')
             
@@ -402,12 +1352,13 @@ def handle_users(method: str, event: dict) -> dict:
                 "UPDATE users SET role = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
                 (new_role, user_id)
             )
-            conn.commit()
+            commit_catalog_change(conn, cur)
+            invalidate_cached_user(int(user_id))
             
             return cors_response(200, {'success': True})
         
         elif method == 'DELETE':
-            query = event.get('queryStringParameters', {})
+            query = ctx.query
             user_id = query.get('id')
             
             if not user_id:
@@ -421,30 +1372,44 @@ def handle_users(method: str, event: dict) -> dict:
             
             cur.execute("UPDATE articles SET author_id = NULL WHERE author_id = %s", (user_id,))
             cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
-            conn.commit()
+            commit_catalog_change(conn, cur)
+            invalidate_cached_user(int(user_id))
             
             return cors_response(200, {'success': True})
         
     finally:
         cur.close()
-        conn.close()
     
     return cors_response(405, {'error': 'Method not allowed'})
 
 
+# Хранилище по умолчанию — бакет проекта; S3_ENDPOINT_URL/S3_PUBLIC_URL позволяют
+# направить функцию и команды в локальный S3 (MinIO, moto server)
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+
+
+_s3_client = None
+
+
 def get_s3():
-    """S3 клиент встроенного хранилища проекта"""
-    import boto3
-    return boto3.client('s3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-    )
+    """S3 клиент встроенного хранилища проекта (один на экземпляр функции, потокобезопасен)"""
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return _s3_client
 
 
 def s3_url(key: str) -> str:
     """Публичный CDN URL файла"""
-    bucket = 'files'
+    public_url = os.environ.get('S3_PUBLIC_URL')
+    if public_url:
+        return f"{public_url.rstrip('/')}/{key}"
     access_key = os.environ['AWS_ACCESS_KEY_ID']
     return f"https://cdn.poehali.dev/projects/{access_key}/bucket/{key}"
 
@@ -457,102 +1422,1003 @@ def get_content_type(filename: str) -> str:
     return 'image/png'
 
 
-def handle_upload_image(method: str, event: dict) -> dict:
-    """Загрузка превью-картинок для статей (редакторы+)"""
-    if method != 'POST':
-        return cors_response(405, {'error': 'Method not allowed'})
-    user = validate_user(event)
-    print(f"[upload_image] user={user}")
-    if not user or user['role'] not in ('editor', 'moderator', 'administrator'):
-        return cors_response(403, {'error': 'Access denied'})
+# Варианты загружаемых картинок: ширина ограничивается сверху, меньшие картинки не растягиваются.
+# Каждый вариант пишется в WebP и в запасном формате (JPEG, а при прозрачности — PNG),
+# перекодирование заодно убирает EXIF и прочие метаданные.
+IMAGE_VARIANTS = (('thumb', 320), ('card', 800), ('full', 1920))
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
 
-    import base64, uuid
-    body = json.loads(event.get('body', '{}'))
-    image_data = body.get('image', '')
-    filename = body.get('filename', 'image.png')
-    print(f"[upload_image] filename={filename}, image_len={len(image_data)}")
-    if ',' in image_data:
-        image_data = image_data.split(',')[1]
+
+def encode_image(img, image_format: str) -> bytes:
+    """Картинка Pillow в байты нужного формата без метаданных"""
+    out = io.BytesIO()
+    if image_format == 'WEBP':
+        img.save(out, 'WEBP', quality=WEBP_QUALITY, method=4)
+    elif image_format == 'JPEG':
+        img.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        img.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+def build_image_variants(image_bytes: bytes):
+    """Варианты картинки: [(name, width, height, [(ext, data, content_type), ...])].
+    None — если Pillow не установлен или картинку не получилось разобрать (тогда хранится оригинал)"""
+    if Image is None:
+        return None
     try:
-        image_bytes = base64.b64decode(image_data)
+        img = Image.open(io.BytesIO(image_bytes))
+        if getattr(img, 'is_animated', False):
+            return None
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if has_alpha else 'RGB')
     except Exception as e:
-        print(f"[upload_image] base64 decode error: {e}")
-        return cors_response(400, {'error': f'Ошибка декодирования изображения: {str(e)}'})
+        print(f"[image_variants] cannot decode image: {e}")
+        return None
+
+    fallback = ('png', 'PNG', 'image/png') if has_alpha else ('jpg', 'JPEG', 'image/jpeg')
+    variants = []
+    for name, max_width in IMAGE_VARIANTS:
+        width = min(img.width, max_width)
+        height = max(1, round(img.height * width / img.width))
+        resized = img if width == img.width else img.resize((width, height), Image.LANCZOS)
+        variants.append((name, width, height, [
+            ('webp', encode_image(resized, 'WEBP'), 'image/webp'),
+            (fallback[0], encode_image(resized, fallback[1]), fallback[2])
+        ]))
+    return variants
+
+
+def store_image(s3, base_key: str, image_bytes: bytes, filename: str) -> dict:
+    """Кладёт картинку в бакет вариантами <base_key>/<variant>.<ext> (или оригиналом, если варианты
+    не собрать). Возвращает key/url основного файла, размер, габариты и карту вариантов"""
+    variants = build_image_variants(image_bytes)
+    if variants is None:
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'png'
+        key = f"{base_key}.{ext}"
+        s3.put_object(Bucket=S3_BUCKET, Key=key, Body=image_bytes, ContentType=get_content_type(filename))
+        return {'key': key, 'url': s3_url(key), 'size': len(image_bytes), 'width': None, 'height': None, 'variants': {}}
+
+    # Габариты всех вариантов — в метаданных основного файла: по одному HEAD можно восстановить
+    # результат без перекодирования. Основной файл пишется последним, так что его наличие
+    # означает, что все варианты уже в бакете.
+    sizes = ';'.join(f'{name}={width}x{height}' for name, width, height, _ in variants)
+    stored = {}
+    result = {}
+    for name, width, height, files in variants:
+        entry = {'width': width, 'height': height, 'keys': []}
+        for ext, data, content_type in files:
+            key = f"{base_key}/{name}.{ext}"
+            extra = {'Metadata': {'variants': sizes}} if name == 'full' and ext != 'webp' else {}
+            s3.put_object(Bucket=S3_BUCKET, Key=key, Body=data, ContentType=content_type,
+                          CacheControl='public, max-age=31536000, immutable', **extra)
+            entry['webp' if ext == 'webp' else 'fallback'] = s3_url(key)
+            entry['keys'].append(key)
+            if ext != 'webp':
+                stored[name] = (key, len(data))
+        result[name] = entry
+    # Основной файл — запасной формат варианта full: его понимает любой клиент
+    key, size = stored['full']
+    return {
+        'key': key, 'url': s3_url(key), 'size': size,
+        'width': result['full']['width'], 'height': result['full']['height'],
+        'variants': result
+    }
+
+
+def find_stored_image(s3, base_key: str, filename: str):
+    """Результат store_image для уже лежащей в бакете картинки (по HEAD основного файла, без записи).
+    None — объектов нет (или они записаны до появления метаданных с габаритами)"""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'png'
+    for key in (f"{base_key}/full.jpg", f"{base_key}/full.png", f"{base_key}.{ext}"):
+        try:
+            head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+        except Exception:
+            continue
+        if not key.startswith(f"{base_key}/"):
+            return {'key': key, 'url': s3_url(key), 'size': head['ContentLength'], 'width': None, 'height': None, 'variants': {}}
+
+        sizes = (head.get('Metadata') or {}).get('variants')
+        if not sizes:
+            return None
+        fallback = key.rsplit('.', 1)[-1]
+        variants = {}
+        for part in sizes.split(';'):
+            name, _, dims = part.partition('=')
+            width, _, height = dims.partition('x')
+            keys = [f"{base_key}/{name}.webp", f"{base_key}/{name}.{fallback}"]
+            variants[name] = {
+                'width': int(width), 'height': int(height), 'keys': keys,
+                'webp': s3_url(keys[0]), 'fallback': s3_url(keys[1])
+            }
+        return {
+            'key': key, 'url': s3_url(key), 'size': head['ContentLength'],
+            'width': variants['full']['width'], 'height': variants['full']['height'],
+            'variants': variants
+        }
+    return None
+
+
+def image_variant_keys(variants) -> list:
+    """Все ключи объектов вариантов из карты variants"""
+    return [key for entry in (variants or {}).values() for key in entry.get('keys', [])]
+
+
+# Картинки адресуются по SHA-256 содержимого: одинаковые байты — один ключ и одна строка
+# hosted_images, повторная загрузка обходится поиском по индексу без записи в S3
+HOSTED_IMAGE_COLUMNS = "key, url, filename, size_bytes, created_at, width, height, variants"
+
+
+def hosted_image_from_row(r) -> dict:
+    """Картинка хостинга из строки HOSTED_IMAGE_COLUMNS"""
+    return {
+        'key': r[0], 'url': r[1], 'filename': r[2], 'size': r[3],
+        'uploaded_at': r[4].isoformat() if r[4] else None,
+        'width': r[5], 'height': r[6], 'variants': r[7] or {}
+    }
+
+
+def content_key(prefix: str, digest: str) -> str:
+    """Базовый ключ картинки по хэшу содержимого"""
+    return f"{prefix}/{digest[:2]}/{digest}"
+
+
+def find_hosted_image(cur, digest: str):
+    """Картинка хостинга с таким хэшем содержимого или None"""
+    cur.execute(f"SELECT {HOSTED_IMAGE_COLUMNS} FROM hosted_images WHERE content_sha256 = %s", (digest,))
+    row = cur.fetchone()
+    return hosted_image_from_row(row) if row else None
+
+
+def host_image(cur, image_bytes: bytes, filename: str, user_id: int, s3=None):
+    """Кладёт картинку в хостинг, если таких байтов там ещё нет. Возвращает (image, created)"""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    existing = find_hosted_image(cur, digest)
+    if existing:
+        return existing, False
+
+    stored = store_image(s3 or get_s3(), content_key('hosting', digest), image_bytes, filename)
+    return register_hosted_image(cur, digest, stored, filename, user_id)
+
+
+def register_hosted_image(cur, digest: str, stored: dict, filename: str, user_id: int):
+    """Строка hosted_images для уже лежащих в бакете объектов. Возвращает (image, created)"""
+    cur.execute(
+        f"""INSERT INTO hosted_images (key, url, filename, size_bytes, uploaded_by, width, height, variants, content_sha256)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING {HOSTED_IMAGE_COLUMNS}""",
+        (stored['key'], stored['url'], filename, stored['size'], user_id,
+         stored['width'], stored['height'], Json(stored['variants']), digest)
+    )
+    row = cur.fetchone()
+    if row is None:
+        # Те же байты параллельно загрузил кто-то ещё — объекты те же, берём его строку
+        return find_hosted_image(cur, digest), False
+    return hosted_image_from_row(row), True
+
+
+def image_url_pairs(old: dict, keeper: dict) -> list:
+    """Какие URL дубликата на какие URL оставляемой картинки заменить"""
+    pairs = [(old['url'], keeper['url'])]
+    for name, entry in (old['variants'] or {}).items():
+        target = (keeper['variants'] or {}).get(name, {})
+        for fmt in ('webp', 'fallback'):
+            if entry.get(fmt):
+                pairs.append((entry[fmt], target.get(fmt) or keeper['url']))
+    return [(a, b) for a, b in pairs if a != b]
+
+
+def rewrite_image_references(cur, replacements: dict) -> list:
+    """Заменяет URL картинок {старый: новый} в статьях (превью, блоки, производный список картинок)
+    и черновиках: по одной выборке затронутых строк и одному UPDATE на таблицу.
+    Возвращает id изменённых статей"""
+    if not replacements:
+        return []
+    # Длинные URL заменяются раньше: URL может быть началом другого (…/a.png и …/a.png?v=2)
+    pairs = sorted(replacements.items(), key=lambda pair: len(pair[0]), reverse=True)
+    params = {'olds': [old for old, _ in pairs]}
+
+    def rewrite(text):
+        if text is None:
+            return None
+        for old, new in pairs:
+            text = text.replace(old, new)
+        return text
+
+    cur.execute("""
+        SELECT id, preview_image, content::text, images::text FROM articles a
+        WHERE preview_image = ANY(%(olds)s)
+           OR EXISTS (SELECT 1 FROM unnest(%(olds)s::text[]) o WHERE strpos(a.content::text, o) > 0)
+        FOR UPDATE
+    """, params)
+    rows = [
+        (article_id, replacements.get(preview, preview), rewrite(content), rewrite(images))
+        for article_id, preview, content, images in cur.fetchall()
+    ]
+    if rows:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE articles AS a SET
+                preview_image = v.preview_image, content = v.content::jsonb, images = v.images::jsonb
+            FROM (VALUES %s) AS v (id, preview_image, content, images)
+            WHERE a.id = v.id
+        """, rows)
+
+    cur.execute("""
+        SELECT id, preview_image, content::text FROM article_drafts d
+        WHERE preview_image = ANY(%(olds)s)
+           OR EXISTS (SELECT 1 FROM unnest(%(olds)s::text[]) o WHERE strpos(d.content::text, o) > 0)
+        FOR UPDATE
+    """, params)
+    drafts = [
+        (draft_id, replacements.get(preview, preview), rewrite(content))
+        for draft_id, preview, content in cur.fetchall()
+    ]
+    if drafts:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE article_drafts AS d SET
+                preview_image = v.preview_image, content = v.content::jsonb, version = d.version + 1
+            FROM (VALUES %s) AS v (id, preview_image, content)
+            WHERE d.id = v.id
+        """, drafts)
+    return [row[0] for row in rows]
+
+
+def object_sha256(s3, key: str) -> str:
+    """SHA-256 объекта в бакете (читается потоком)"""
+    digest = hashlib.sha256()
+    body = s3.get_object(Bucket=S3_BUCKET, Key=key)['Body']
+    for chunk in body.iter_chunks(1024 * 1024):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def delete_s3_keys(s3, keys) -> int:
+    """Удаляет объекты пачками по 1000 (предел DeleteObjects). Возвращает число удалённых"""
+    keys = sorted(set(keys))
+    deleted = 0
+    for i in range(0, len(keys), 1000):
+        batch = keys[i:i + 1000]
+        response = s3.delete_objects(Bucket=S3_BUCKET, Delete={
+            'Objects': [{'Key': k} for k in batch], 'Quiet': True
+        })
+        errors = response.get('Errors', [])
+        for error in errors[:5]:
+            print(f"[delete_s3_keys] {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+        deleted += len(batch) - len(errors)
+    return deleted
+
+
+def dedup_hosted_images(conn, dry_run: bool = False, s3=None) -> dict:
+    """Разовая чистка: считает хэши старых картинок хостинга, схлопывает дубликаты в самую раннюю
+    запись, переписывает ссылки в статьях и черновиках и удаляет лишние объекты"""
+    s3 = s3 or get_s3()
+    cur = conn.cursor()
+    groups = {}
+    stale_keys = []
+    affected = set()
+    removed = 0
+    try:
+        cur.execute(f"SELECT id, content_sha256, {HOSTED_IMAGE_COLUMNS} FROM hosted_images ORDER BY id")
+        for row in cur.fetchall():
+            image_id, digest, image = row[0], row[1], hosted_image_from_row(row[2:])
+            if digest is None:
+                try:
+                    digest = object_sha256(s3, image['key'])
+                except Exception as e:
+                    print(f"[dedup_images] cannot read {image['key']}: {e}")
+                    continue
+            # Первой в группе идёт строка, у которой хэш уже записан (она держит уникальный индекс)
+            group = groups.setdefault(digest, [])
+            group.insert(0 if row[1] is not None else len(group), (image_id, row[1] is not None, image))
+
+        for digest, group in groups.items():
+            (keeper_id, has_digest, keeper), duplicates = group[0], group[1:]
+            if dry_run:
+                removed += len(duplicates)
+                continue
+            keeper_keys = {keeper['key'], *image_variant_keys(keeper['variants'])}
+            replacements = {}
+            for image_id, _, image in duplicates:
+                replacements.update(image_url_pairs(image, keeper))
+                cur.execute("DELETE FROM hosted_images WHERE id = %s", (image_id,))
+                stale_keys.extend(
+                    k for k in (image['key'], *image_variant_keys(image['variants'])) if k not in keeper_keys
+                )
+                removed += 1
+            affected.update(rewrite_image_references(cur, replacements))
+            if not has_digest:
+                cur.execute("UPDATE hosted_images SET content_sha256 = %s WHERE id = %s", (digest, keeper_id))
+            conn.commit()
+
+        if affected:
+            commit_catalog_change(conn, cur, article_ids=sorted(affected))
+    finally:
+        cur.close()
+
+    # Объекты удаляются только после фиксации ссылок на оставшиеся копии
+    deleted_objects = delete_s3_keys(s3, stale_keys) if stale_keys else 0
+    print(f"[dedup_images] groups={len(groups)} removed={removed} articles={len(affected)} objects={deleted_objects} dry_run={dry_run}")
+    return {'removed': removed, 'articles': sorted(affected), 'deleted_objects': deleted_objects, 'dry_run': dry_run}
+
+
+# Прямая загрузка в бакет: функция выдаёт подписанную форму POST (тип и размер зашиты в политику),
+# браузер кладёт файл в uploads/, затем upload_confirm читает его из бакета, считает хэш
+# и раскладывает варианты (store_image) по ключу хэша. Через запрос к API байты не идут —
+# нет base64 в JSON и лимита на размер тела вызова.
+UPLOAD_TARGETS = {'hosting': 10 * 1024 * 1024, 'wiki': 5 * 1024 * 1024}
+UPLOAD_CONTENT_TYPES = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif', 'image/webp': 'webp'}
+UPLOAD_URL_TTL = 300
+UPLOAD_STAGING_PREFIX = 'uploads'
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def handle_upload_url(method: str, ctx: RequestContext) -> dict:
+    """Подписанная форма для загрузки картинки прямо в бакет (редакторы+)"""
+    if method != 'POST':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    if not user or user['role'] not in ('editor', 'moderator', 'administrator'):
+        return cors_response(403, {'error': 'Access denied'})
+
+    body = ctx.body
+    target = body.get('target', 'hosting')
+    content_type = body.get('content_type', '')
+    max_size = UPLOAD_TARGETS.get(target)
+    if max_size is None:
+        return cors_response(400, {'error': 'Invalid target'})
+    if content_type not in UPLOAD_CONTENT_TYPES:
+        return cors_response(400, {'error': 'Неподдерживаемый тип файла'})
+    try:
+        size = int(body.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+    if size <= 0:
+        return cors_response(400, {'error': 'Size is required'})
+    if size > max_size:
+        return cors_response(400, {'error': f'Файл слишком большой. Максимум {max_size // (1024 * 1024)} МБ'})
+
+    # Если клиент прислал хэш и такая картинка уже есть — загружать нечего
+    digest = str(body.get('sha256', '')).lower()
+    if SHA256_RE.match(digest):
+        cur = ctx.conn.cursor()
+        try:
+            existing = find_hosted_image(cur, digest)
+        finally:
+            cur.close()
+        if existing:
+            return cors_response(200, {'duplicate': True, 'image': existing})
+
+    import uuid
+    key = f"{UPLOAD_STAGING_PREFIX}/{target}/{uuid.uuid4().hex}.{UPLOAD_CONTENT_TYPES[content_type]}"
+    form = get_s3().generate_presigned_post(
+        Bucket=S3_BUCKET, Key=key,
+        Fields={'Content-Type': content_type},
+        Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_size]],
+        ExpiresIn=UPLOAD_URL_TTL
+    )
+    return cors_response(200, {'key': key, 'url': form['url'], 'fields': form['fields'], 'expires_in': UPLOAD_URL_TTL})
+
+
+def handle_upload_confirm(method: str, ctx: RequestContext) -> dict:
+    """Регистрирует загруженный напрямую файл: варианты на ключе по хэшу и запись в hosted_images"""
+    if method != 'POST':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    if not user or user['role'] not in ('editor', 'moderator', 'administrator'):
+        return cors_response(403, {'error': 'Access denied'})
+
+    body = ctx.body
+    key = body.get('key', '')
+    filename = body.get('filename') or key.rsplit('/', 1)[-1]
+    parts = key.split('/')
+    if len(parts) != 3 or parts[0] != UPLOAD_STAGING_PREFIX or parts[1] not in UPLOAD_TARGETS:
+        return cors_response(400, {'error': 'Invalid key'})
+    target = parts[1]
+
+    s3 = get_s3()
+    try:
+        head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+    except Exception:
+        return cors_response(404, {'error': 'Файл не найден — загрузите его заново'})
+    content_type = head.get('ContentType', '')
+    if content_type not in UPLOAD_CONTENT_TYPES or head['ContentLength'] > UPLOAD_TARGETS[target]:
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        return cors_response(400, {'error': 'Неподдерживаемый файл'})
+
+    # Байты всё равно нужны для хэша — из них же собираются варианты (WebP, без EXIF), как при обычной загрузке
+    image_bytes = s3.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read()
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    conn = ctx.conn
+    cur = conn.cursor()
+    try:
+        image = find_hosted_image(cur, digest)
+        if image is None:
+            base_key = content_key(target, digest)
+            stored_name = f"{digest}.{UPLOAD_CONTENT_TYPES[content_type]}"
+            stored = find_stored_image(s3, base_key, stored_name) or store_image(s3, base_key, image_bytes, stored_name)
+            if target == 'hosting':
+                image, _ = register_hosted_image(cur, digest, stored, filename, user['id'])
+                conn.commit()
+            else:
+                image = {**stored, 'filename': filename}
+    finally:
+        cur.close()
+
+    s3.delete_object(Bucket=S3_BUCKET, Key=key)
+    print(f"[upload_confirm] {key} -> {image['url']} by {user['username']}")
+    return cors_response(200, image)
+
+
+def handle_upload_image(method: str, ctx: RequestContext) -> dict:
+    """Загрузка превью-картинок для статей (редакторы+)"""
+    if method != 'POST':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    print(f"[upload_image] user={user}")
+    if not user or user['role'] not in ('editor', 'moderator', 'administrator'):
+        return cors_response(403, {'error': 'Access denied'})
+
+    import base64
+    body = ctx.body
+    image_data = body.get('image', '')
+    filename = body.get('filename', 'image.png')
+    print(f"[upload_image] filename={filename}, image_len={len(image_data)}")
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    try:
+        image_bytes = base64.b64decode(image_data)
+    except Exception as e:
+        print(f"[upload_image] base64 decode error: {e}")
+        return cors_response(400, {'error': f'Ошибка декодирования изображения: {str(e)}'})
 
     MAX_SIZE = 5 * 1024 * 1024
     if len(image_bytes) > MAX_SIZE:
         return cors_response(400, {'error': 'Файл слишком большой. Максимум 5 МБ'})
 
-    ext = filename.rsplit('.', 1)[-1] if '.' in filename else 'png'
-    key = f"wiki/{datetime.now().strftime('%Y%m%d')}/{uuid.uuid4().hex}.{ext}"
-    print(f"[upload_image] uploading key={key}")
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    cur = ctx.conn.cursor()
+    try:
+        hosted = find_hosted_image(cur, digest)
+    finally:
+        cur.close()
+    if hosted:
+        print(f"[upload_image] duplicate of {hosted['key']}")
+        return cors_response(200, {key: hosted[key] for key in ('url', 'width', 'height', 'variants')})
+
+    # Ключ по хэшу: если такие байты уже загружались, объекты на месте — хватает HEAD, без перекодирования и PUT
+    base_key = content_key('wiki', digest)
     try:
         s3 = get_s3()
-        s3.put_object(Bucket='files', Key=key, Body=image_bytes, ContentType=get_content_type(filename))
-        url = s3_url(key)
-        print(f"[upload_image] success url={url}")
-        return cors_response(200, {'url': url})
+        stored = find_stored_image(s3, base_key, filename)
+        if stored:
+            print(f"[upload_image] already stored key={stored['key']}")
+        else:
+            print(f"[upload_image] uploading key={base_key}")
+            stored = store_image(s3, base_key, image_bytes, filename)
+            print(f"[upload_image] success url={stored['url']}")
+        return cors_response(200, {
+            'url': stored['url'],
+            'width': stored['width'],
+            'height': stored['height'],
+            'variants': stored['variants']
+        })
     except Exception as e:
         print(f"[upload_image] S3 error: {e}")
         return cors_response(500, {'error': f'Ошибка загрузки в хранилище: {str(e)}'})
 
 
-def handle_hosting_images(method: str, event: dict) -> dict:
-    """Хостинг картинок: GET — список, POST — загрузить, DELETE — удалить, POST?import=1 — импорт из img.devilrust (супер-админ)"""
-    user = validate_user(event)
+# Импорт внешних картинок статей (превью и блоки image) в хостинг.
+# Прогресс хранится в image_import_jobs/items: каждый вызов обрабатывает пачки, пока хватает
+# IMPORT_TIME_BUDGET, а следующий вызов продолжает тот же незавершённый job.
+# Сеть (скачивание, запись в бакет) — в пуле потоков, вся работа с БД — в основном потоке.
+# Дедлайн проверяется перед каждым этапом: размер пачки подбирается по замеренному времени
+# сохранения одной картинки (варианты Pillow — самое долгое), а что не успевает — ждёт следующего вызова.
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', '8'))
+IMPORT_BATCH_SIZE = IMPORT_WORKERS * 4
+IMPORT_TIME_BUDGET = float(os.environ.get('IMPORT_TIME_BUDGET', '20'))
+IMPORT_DOWNLOAD_TIMEOUT = 8
+IMPORT_STORE_SECONDS = 0.5
+IMPORT_REWRITE_RESERVE = 2.0
+IMPORT_MAX_ATTEMPTS = 3
+IMPORT_MAX_BYTES = 10 * 1024 * 1024
+
+
+def download_image(url: str, timeout: float) -> bytes:
+    """Скачивает картинку по внешнему URL (не больше IMPORT_MAX_BYTES)"""
+    import urllib.request
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        data = resp.read(IMPORT_MAX_BYTES + 1)
+    if len(data) > IMPORT_MAX_BYTES:
+        raise ValueError('image is too large')
+    return data
+
+
+def start_image_import(cur, user_id: int) -> int:
+    """Незавершённый job импорта или новый со списком всех внешних картинок статей"""
+    cur.execute("SELECT id FROM image_import_jobs WHERE status = 'running' ORDER BY id DESC LIMIT 1")
+    row = cur.fetchone()
+    if row:
+        return row[0]
+
+    cur.execute("INSERT INTO image_import_jobs (started_by) VALUES (%s) RETURNING id", (user_id,))
+    job_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO image_import_items (job_id, source_url)
+        SELECT DISTINCT %s, url FROM (
+            SELECT preview_image AS url FROM articles
+            UNION
+            SELECT b->>'src' FROM articles, jsonb_array_elements(
+                CASE WHEN jsonb_typeof(content) = 'array' THEN content ELSE '[]'::jsonb END
+            ) b
+            WHERE b->>'type' = 'image'
+        ) urls
+        WHERE url ~* '^https?://' AND url NOT LIKE %s AND url NOT LIKE '%%/hosting/%%'
+    """, (job_id, s3_url('') + '%'))
+    return job_id
+
+
+def host_images(cur, files: list, user_id: int, s3=None, workers: int = 4) -> tuple:
+    """Пачка картинок в хостинг, files — [(digest, data, filename)]. Новые байты пишутся в бакет
+    параллельно, строки hosted_images вставляются одним запросом.
+    Возвращает ({digest: image}, {digest: error}, множество digest новых строк)"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    cur.execute(
+        f"SELECT content_sha256, {HOSTED_IMAGE_COLUMNS} FROM hosted_images WHERE content_sha256 = ANY(%s)",
+        (list({digest for digest, _, _ in files}),)
+    )
+    hosted = {r[0]: hosted_image_from_row(r[1:]) for r in cur.fetchall()}
+    pending = {}
+    for digest, data, filename in files:
+        if digest not in hosted and digest not in pending:
+            pending[digest] = (data, filename)
+    if not pending:
+        return hosted, {}, set()
+
+    s3 = s3 or get_s3()
+
+    def store(item):
+        digest, (data, filename) = item
+        try:
+            return digest, store_image(s3, content_key('hosting', digest), data, filename), None
+        except Exception as e:
+            return digest, None, str(e)[:500]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+        stored = list(pool.map(store, pending.items()))
+
+    errors = {digest: error for digest, _, error in stored if error}
+    rows = [
+        (result['key'], result['url'], pending[digest][1], result['size'], user_id,
+         result['width'], result['height'], Json(result['variants']), digest)
+        for digest, result, error in stored if not error
+    ]
+    created = set()
+    if rows:
+        inserted = psycopg2.extras.execute_values(
+            cur,
+            f"""INSERT INTO hosted_images (key, url, filename, size_bytes, uploaded_by, width, height, variants, content_sha256)
+                VALUES %s ON CONFLICT DO NOTHING RETURNING content_sha256, {HOSTED_IMAGE_COLUMNS}""",
+            rows, fetch=True
+        )
+        for r in inserted:
+            hosted[r[0]] = hosted_image_from_row(r[1:])
+            created.add(r[0])
+        # Строки, проигравшие гонку за уникальный хэш, уже есть в таблице
+        missing = [row[8] for row in rows if row[8] not in hosted]
+        if missing:
+            cur.execute(
+                f"SELECT content_sha256, {HOSTED_IMAGE_COLUMNS} FROM hosted_images WHERE content_sha256 = ANY(%s)",
+                (missing,)
+            )
+            hosted.update((r[0], hosted_image_from_row(r[1:])) for r in cur.fetchall())
+    return hosted, errors, created
+
+
+def import_image_batch(cur, items: list, user_id: int, s3, deadline: float, store_seconds: float) -> tuple:
+    """Одна пачка импорта. Возвращает ({source_url: hosted_url}, {source_url: error},
+    отложенные из-за дедлайна source_url, замеренные секунды на сохранение одной новой картинки или None)"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch(url):
+        try:
+            data = download_image(url, max(1.0, min(IMPORT_DOWNLOAD_TIMEOUT, deadline - time.monotonic())))
+            return url, data, hashlib.sha256(data).hexdigest(), None
+        except Exception as e:
+            return url, None, None, str(e)[:500]
+
+    with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+        fetched = list(pool.map(fetch, items))
+    errors = {url: error for url, _, _, error in fetched if error}
+    downloaded = [(url, data, digest) for url, data, digest, error in fetched if not error]
+
+    # Сохраняем столько, сколько успеем до дедлайна с запасом на запись ссылок
+    fits = int((deadline - IMPORT_REWRITE_RESERVE - time.monotonic()) / store_seconds)
+    downloaded, postponed = downloaded[:max(0, fits)], [url for url, _, _ in downloaded[max(0, fits):]]
+    if not downloaded:
+        return {}, errors, postponed, None
+
+    started = time.monotonic()
+    hosted, store_errors, created = host_images(
+        cur,
+        [(digest, data, url.split('?')[0].split('/')[-1] or 'image.png') for url, data, digest in downloaded],
+        user_id, s3, IMPORT_WORKERS
+    )
+    measured = (time.monotonic() - started) / len(created) if created else None
+    done = {}
+    for url, _, digest in downloaded:
+        if digest in hosted:
+            done[url] = hosted[digest]['url']
+        else:
+            errors[url] = store_errors.get(digest, 'not stored')
+    return done, errors, postponed, measured
+
+
+def record_import_items(cur, job_id: int, done: dict, errors: dict):
+    """Итог пачки в image_import_items одним UPDATE: done — с адресом в хостинге, failed — с ошибкой (attempts + 1)"""
+    if done or errors:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE image_import_items AS i SET
+                status = v.status, hosted_url = v.hosted_url, error = v.error, attempts = i.attempts + 1
+            FROM (VALUES %s) AS v (job_id, source_url, status, hosted_url, error)
+            WHERE i.job_id = v.job_id AND i.source_url = v.source_url
+        """, [
+            *((job_id, url, 'done', hosted_url, None) for url, hosted_url in done.items()),
+            *((job_id, url, 'failed', None, error) for url, error in errors.items())
+        ])
+    cur.execute("UPDATE image_import_jobs SET updated_at = CURRENT_TIMESTAMP WHERE id = %s", (job_id,))
+
+
+def run_image_import(conn, user_id: int, time_budget: float = IMPORT_TIME_BUDGET, s3=None) -> dict:
+    """Продолжает (или начинает) импорт внешних картинок, пока не кончится time_budget секунд"""
+    deadline = time.monotonic() + time_budget
+    s3 = s3 or get_s3()
+    store_seconds = IMPORT_STORE_SECONDS
+    affected = set()
+    cur = conn.cursor()
+    try:
+        job_id = start_image_import(cur, user_id)
+        conn.commit()
+
+        while True:
+            # Пачка не больше, чем успеем скачать, сохранить и переписать до дедлайна
+            remaining = deadline - time.monotonic() - IMPORT_DOWNLOAD_TIMEOUT - IMPORT_REWRITE_RESERVE
+            batch_size = min(IMPORT_BATCH_SIZE, int(remaining / store_seconds))
+            if batch_size < 1:
+                break
+            cur.execute("""
+                SELECT source_url FROM image_import_items
+                WHERE job_id = %s AND status <> 'done' AND attempts < %s
+                ORDER BY source_url
+                LIMIT %s
+            """, (job_id, IMPORT_MAX_ATTEMPTS, batch_size))
+            items = [r[0] for r in cur.fetchall()]
+            if not items:
+                cur.execute(
+                    "UPDATE image_import_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (job_id,)
+                )
+                conn.commit()
+                break
+
+            done, errors, postponed, measured = import_image_batch(cur, items, user_id, s3, deadline, store_seconds)
+            if measured:
+                store_seconds = max(measured, 0.05)
+            if done and time.monotonic() >= deadline:
+                # Картинки уже в хостинге, а ссылки переписать не успеваем: сохранённые пункты остаются
+                # необработанными, следующий вызов найдёт их в hosted_images без повторного сохранения.
+                # Ошибки пачки записываются как обычно, отложенные ждут следующего вызова
+                record_import_items(cur, job_id, {}, errors)
+                conn.commit()
+                print(f"[image_import] job={job_id} deadline reached before rewrite, stored={len(done)} failed={len(errors)} postponed={len(postponed)}")
+                break
+            # Все URL пачки переписываются разом: одна выборка и один UPDATE на таблицу
+            affected.update(rewrite_image_references(cur, done))
+            record_import_items(cur, job_id, done, errors)
+            conn.commit()
+            print(f"[image_import] job={job_id} batch={len(items)} done={len(done)} failed={len(errors)} postponed={len(postponed)}")
+            if postponed:
+                break
+
+        if affected:
+            commit_catalog_change(conn, cur, article_ids=sorted(affected))
+
+        cur.execute("""
+            SELECT j.status,
+                   COUNT(*) FILTER (WHERE i.status = 'done'),
+                   COUNT(*) FILTER (WHERE i.status = 'failed' AND i.attempts >= %s),
+                   COUNT(*) FILTER (WHERE i.status <> 'done' AND i.attempts < %s)
+            FROM image_import_jobs j
+            LEFT JOIN image_import_items i ON i.job_id = j.id
+            WHERE j.id = %s
+            GROUP BY j.status
+        """, (IMPORT_MAX_ATTEMPTS, IMPORT_MAX_ATTEMPTS, job_id))
+        status, imported, failed, remaining = cur.fetchone()
+    finally:
+        cur.close()
+    return {'job_id': job_id, 'status': status, 'imported': imported, 'failed': failed, 'remaining': remaining}
+
+
+# Сборка мусора в бакете: объекты картинок, на которые не ссылается ни статья, ни черновик,
+# ни строка hosted_images. Свежие объекты (моложе GC_GRACE_HOURS) не трогаем — это могут быть
+# только что загруженные картинки ещё не сохранённой статьи.
+GC_PREFIXES = ('wiki/', 'hosting/', f'{UPLOAD_STAGING_PREFIX}/')
+GC_GRACE_HOURS = float(os.environ.get('GC_GRACE_HOURS', '48'))
+GC_REPORT_SAMPLE = 50
+VARIANT_KEY_RE = re.compile(r'^(.+)/(?:' + '|'.join(name for name, _ in IMAGE_VARIANTS) + r')\.\w+$')
+
+
+def image_group(key: str) -> str:
+    """Общая часть ключей одной картинки: варианты <base>/<variant>.<ext> живут и умирают вместе"""
+    match = VARIANT_KEY_RE.match(key)
+    return match.group(1) if match else key
+
+
+def referenced_image_groups(conn) -> set:
+    """Группы ключей, на которые ссылаются статьи, черновики и hosted_images"""
+    base = s3_url('')
+    url_re = re.compile(re.escape(base) + r'[^"\s<>()\'\\]+')
+    groups = set()
+
+    def add_urls(text):
+        for url in url_re.findall(text or ''):
+            groups.add(image_group(url[len(base):].split('?')[0]))
+
+    # Превью и весь текст контента (блоки image, ссылки, старый HTML) — именованным курсором
+    for name, query in (
+        ('gc_articles', "SELECT preview_image, content::text FROM articles"),
+        ('gc_drafts', "SELECT preview_image, content::text FROM article_drafts"),
+    ):
+        cur = conn.cursor(name=name)
+        cur.itersize = EXPORT_ITERSIZE
+        try:
+            cur.execute(query)
+            for preview_image, content in cur:
+                add_urls(preview_image)
+                add_urls(content)
+        finally:
+            cur.close()
+
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT key, variants FROM hosted_images")
+        for key, variants in cur.fetchall():
+            groups.add(image_group(key))
+            groups.update(image_group(k) for k in image_variant_keys(variants))
+    finally:
+        cur.close()
+        conn.rollback()
+    return groups
+
+
+def collect_image_garbage(conn, dry_run: bool = True, grace_hours: float = GC_GRACE_HOURS, s3=None) -> dict:
+    """Удаляет (или при dry_run только перечисляет) объекты картинок без ссылок старше grace_hours"""
+    from datetime import timedelta
+    s3 = s3 or get_s3()
+    # Ссылки собираются до листинга: всё, что загружено позже, окажется моложе grace-периода
+    referenced = referenced_image_groups(conn)
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+
+    scanned, orphans, orphan_bytes = 0, [], 0
+    paginator = s3.get_paginator('list_objects_v2')
+    for prefix in GC_PREFIXES:
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                scanned += 1
+                if obj['LastModified'] >= cutoff or image_group(obj['Key']) in referenced:
+                    continue
+                orphans.append(obj['Key'])
+                orphan_bytes += obj['Size']
+
+    deleted = 0 if dry_run or not orphans else delete_s3_keys(s3, orphans)
+    print(f"[gc_images] scanned={scanned} orphans={len(orphans)} bytes={orphan_bytes} deleted={deleted} dry_run={dry_run}")
+    return {
+        'scanned': scanned,
+        'referenced_groups': len(referenced),
+        'orphans': len(orphans),
+        'orphan_bytes': orphan_bytes,
+        'deleted': deleted,
+        'dry_run': dry_run,
+        'sample': orphans[:GC_REPORT_SAMPLE]
+    }
+
+
+def handle_gc_images(method: str, ctx: RequestContext) -> dict:
+    """Сборка мусора в бакете (только администраторы); по умолчанию — только отчёт"""
+    if method != 'POST':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    if not user or user['role'] != 'administrator':
+        return cors_response(403, {'error': 'Access denied'})
+    body = ctx.body
+    try:
+        grace_hours = float(body.get('grace_hours', GC_GRACE_HOURS))
+    except (TypeError, ValueError):
+        return cors_response(400, {'error': 'Invalid grace_hours'})
+    if grace_hours < 1:
+        return cors_response(400, {'error': 'grace_hours должен быть не меньше 1'})
+    return cors_response(200, collect_image_garbage(ctx.conn, dry_run=body.get('dry_run', True) is not False,
+                                                    grace_hours=grace_hours))
+
+
+HOSTING_MAX_SIZE = 10 * 1024 * 1024
+HOSTING_BATCH_MAX_FILES = 20
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '4'))
+
+
+def upload_hosted_batch(cur, images, user: dict) -> dict:
+    """Пакетная загрузка в хостинг: [{image, filename}] -> результат по каждому файлу"""
+    import base64
+    if not isinstance(images, list) or not images:
+        return cors_response(400, {'error': 'images должен быть непустым списком'})
+    if len(images) > HOSTING_BATCH_MAX_FILES:
+        return cors_response(400, {'error': f'Не больше {HOSTING_BATCH_MAX_FILES} файлов за раз'})
+
+    results = []
+    files = []
+    for item in images:
+        item = item if isinstance(item, dict) else {}
+        filename = str(item.get('filename') or 'image.png')
+        image_data = str(item.get('image') or '')
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        try:
+            data = base64.b64decode(image_data, validate=True)
+        except Exception:
+            data = b''
+        if not data:
+            results.append({'filename': filename, 'error': 'Ошибка декодирования изображения'})
+        elif len(data) > HOSTING_MAX_SIZE:
+            results.append({'filename': filename, 'error': 'Файл слишком большой. Максимум 10 МБ'})
+        else:
+            digest = hashlib.sha256(data).hexdigest()
+            files.append((digest, data, filename))
+            results.append({'filename': filename, 'digest': digest})
+
+    hosted, errors, created = host_images(cur, files, user['id'], workers=UPLOAD_WORKERS) if files else ({}, {}, set())
+    cur.connection.commit()
+
+    for result in results:
+        digest = result.pop('digest', None)
+        if digest is None:
+            continue
+        if digest in hosted:
+            result.update(hosted[digest], filename=result['filename'], duplicate=digest not in created)
+        else:
+            result['error'] = errors.get(digest, 'Ошибка загрузки в хранилище')
+    failed = sum(1 for r in results if 'error' in r)
+    print(f"[hosting_batch] user={user['username']} files={len(results)} new={len(created)} failed={failed}")
+    return cors_response(200, {'results': results, 'uploaded': len(results) - failed, 'failed': failed})
+
+
+HOSTING_PAGE_SIZE = 50
+HOSTING_MAX_PAGE_SIZE = 200
+HOSTING_STATS_DAYS = 30
+HOSTING_STATS_MAX_DAYS = 366
+
+
+def list_hosted_images(cur, query: dict) -> dict:
+    """Страница картинок хостинга (новые сверху) с keyset-пагинацией по (created_at, id)
+    и фильтрами по загрузившему и началу имени файла"""
+    try:
+        limit = min(max(int(query.get('limit', HOSTING_PAGE_SIZE)), 1), HOSTING_MAX_PAGE_SIZE)
+        uploaded_by = int(query['uploaded_by']) if query.get('uploaded_by') else None
+        after = decode_cursor(query['cursor']) if query.get('cursor') else None
+    except ValueError:
+        return cors_response(400, {'error': 'Invalid pagination parameters'})
+    prefix = (query.get('filename') or '').strip().lower()
+
+    conditions = []
+    params = []
+    if uploaded_by is not None:
+        conditions.append("uploaded_by = %s")
+        params.append(uploaded_by)
+    if prefix:
+        # Префиксный LIKE по lower(filename) text_pattern_ops; спецсимволы LIKE экранируются
+        conditions.append("lower(filename) LIKE %s")
+        params.append(re.sub(r'([\\%_])', r'\\\1', prefix) + '%')
+    if after:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(after)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cur.execute(f"""
+        SELECT id, {HOSTED_IMAGE_COLUMNS}, uploaded_by
+        FROM hosted_images
+        {where_clause}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return cors_response(200, {
+        'images': [{**hosted_image_from_row(r[1:9]), 'uploaded_by': r[9]} for r in rows],
+        'next_cursor': encode_cursor(rows[-1][5], rows[-1][0]) if has_more else None
+    })
+
+
+def hosted_image_stats(cur, query: dict) -> dict:
+    """Число картинок и объём по загрузившим и дням за последние days дней"""
+    try:
+        days = min(max(int(query.get('days', HOSTING_STATS_DAYS)), 1), HOSTING_STATS_MAX_DAYS)
+    except ValueError:
+        return cors_response(400, {'error': 'Invalid days'})
+
+    # Агрегат читает только индекс (created_at) INCLUDE (uploaded_by, size_bytes)
+    cur.execute("""
+        SELECT s.uploaded_by, u.username, s.day, s.images, s.bytes
+        FROM (
+            SELECT uploaded_by, created_at::date AS day, COUNT(*) AS images, SUM(size_bytes) AS bytes
+            FROM hosted_images
+            WHERE created_at >= CURRENT_DATE - %s
+            GROUP BY uploaded_by, created_at::date
+        ) s
+        LEFT JOIN users u ON u.id = s.uploaded_by
+        ORDER BY s.day DESC, s.images DESC
+    """, (days - 1,))
+    rows = cur.fetchall()
+    return cors_response(200, {
+        'days': days,
+        'total': {'images': sum(r[3] for r in rows), 'bytes': sum(int(r[4] or 0) for r in rows)},
+        'stats': [
+            {'uploaded_by': r[0], 'username': r[1], 'day': r[2].isoformat(), 'images': r[3], 'bytes': int(r[4] or 0)}
+            for r in rows
+        ]
+    })
+
+
+def image_references(cur, urls: list):
+    """Кто ссылается на любой из URL картинки: (id статей, число черновиков)"""
+    cur.execute("""
+        SELECT id FROM articles
+        WHERE preview_image = ANY(%(urls)s)
+           OR EXISTS (SELECT 1 FROM unnest(%(urls)s::text[]) u
+                      WHERE strpos(content::text, u) > 0 OR strpos(images::text, u) > 0)
+        ORDER BY id
+    """, {'urls': urls})
+    articles = [r[0] for r in cur.fetchall()]
+    cur.execute("""
+        SELECT COUNT(*) FROM article_drafts
+        WHERE preview_image = ANY(%(urls)s)
+           OR EXISTS (SELECT 1 FROM unnest(%(urls)s::text[]) u WHERE strpos(content::text, u) > 0)
+    """, {'urls': urls})
+    return articles, cur.fetchone()[0]
+
+
+def handle_hosting_images(method: str, ctx: RequestContext) -> dict:
+    """Хостинг картинок: GET — страница списка (view=stats — статистика), POST — загрузить, DELETE — удалить, POST?import=1 — импорт из img.devilrust (супер-админ)"""
+    user = ctx.user
     if not user or user['role'] not in ('editor', 'moderator', 'administrator'):
         return cors_response(403, {'error': 'Access denied'})
 
     SUPER_ADMIN = '76561198995407853'
     isSuperAdmin = user.get('steam_id') == SUPER_ADMIN
 
-    conn = get_db_connection()
+    conn = ctx.conn
     cur = conn.cursor()
 
     try:
         if method == 'GET':
-            cur.execute("SELECT key, url, filename, size_bytes, created_at FROM hosted_images ORDER BY created_at DESC")
-            rows = cur.fetchall()
-            return cors_response(200, {'images': [
-                {'key': r[0], 'url': r[1], 'filename': r[2], 'size': r[3], 'uploaded_at': r[4].isoformat()}
-                for r in rows
-            ]})
+            if ctx.query.get('view') == 'stats':
+                return hosted_image_stats(cur, ctx.query)
+            return list_hosted_images(cur, ctx.query)
 
         elif method == 'POST':
-            import base64, uuid
-            body = json.loads(event.get('body', '{}'))
+            import base64
+            body = ctx.body
 
-            # Импорт существующих картинок из img.devilrust (только супер-админ)
+            # Импорт внешних картинок статей в хостинг (только супер-админ); status=running — вызвать ещё раз
             if body.get('import_existing') and isSuperAdmin:
-                import urllib.request
-                s3 = get_s3()
-                bucket = 'files'
-                imported, failed = 0, 0
-                cur.execute("SELECT id, preview_image FROM articles WHERE preview_image IS NOT NULL AND preview_image != ''")
-                articles = cur.fetchall()
-                for article_id, img_url in articles:
-                    if not img_url or 'hosting/' in img_url:
-                        continue
-                    try:
-                        req = urllib.request.Request(img_url, headers={'User-Agent': 'Mozilla/5.0'})
-                        with urllib.request.urlopen(req, timeout=15) as resp:
-                            img_bytes = resp.read()
-                            ct = resp.headers.get('Content-Type', 'image/png')
-                        ext = img_url.split('?')[0].split('.')[-1].lower()[:4] or 'png'
-                        key = f"hosting/imported/{uuid.uuid4().hex}.{ext}"
-                        s3.put_object(Bucket=bucket, Key=key, Body=img_bytes, ContentType=ct)
-                        new_url = s3_url(key)
-                        cur.execute("UPDATE articles SET preview_image = %s WHERE id = %s", (new_url, article_id))
-                        cur.execute(
-                            "INSERT INTO hosted_images (key, url, filename, size_bytes, uploaded_by) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (key) DO NOTHING",
-                            (key, new_url, key.split('/')[-1], len(img_bytes), user['id'])
-                        )
-                        conn.commit()
-                        imported += 1
-                    except Exception as e:
-                        print(f"Import failed for article {article_id}: {e}")
-                        failed += 1
-                return cors_response(200, {'imported': imported, 'failed': failed})
+                return cors_response(200, run_image_import(conn, user['id']))
+
+            if 'images' in body:
+                return upload_hosted_batch(cur, body['images'], user)
 
             # Обычная загрузка
             image_data = body.get('image', '')
@@ -561,31 +2427,34 @@ def handle_hosting_images(method: str, event: dict) -> dict:
                 image_data = image_data.split(',')[1]
             image_bytes = base64.b64decode(image_data)
 
-            MAX_SIZE = 10 * 1024 * 1024
-            if len(image_bytes) > MAX_SIZE:
+            if len(image_bytes) > HOSTING_MAX_SIZE:
                 return cors_response(400, {'error': 'Файл слишком большой. Максимум 10 МБ'})
 
-            ext = filename.rsplit('.', 1)[-1] if '.' in filename else 'png'
-            key = f"hosting/{datetime.now().strftime('%Y%m%d')}/{uuid.uuid4().hex}.{ext}"
-            s3 = get_s3()
-            s3.put_object(Bucket='files', Key=key, Body=image_bytes, ContentType=get_content_type(filename))
-            url = s3_url(key)
-            cur.execute(
-                "INSERT INTO hosted_images (key, url, filename, size_bytes, uploaded_by) VALUES (%s, %s, %s, %s, %s)",
-                (key, url, filename, len(image_bytes), user['id'])
-            )
+            image, created = host_image(cur, image_bytes, filename, user['id'])
             conn.commit()
-            print(f"Hosted upload by {user['username']}: {url}")
-            return cors_response(200, {'url': url, 'key': key})
+            print(f"Hosted upload by {user['username']}: {image['url']}{'' if created else ' (duplicate)'}")
+            return cors_response(200, {**image, 'duplicate': not created})
 
         elif method == 'DELETE':
-            body = json.loads(event.get('body', '{}'))
+            body = ctx.body
             key = body.get('key', '')
             if not key or not key.startswith('hosting/'):
                 return cors_response(400, {'error': 'Invalid key'})
-            s3 = get_s3()
-            s3.delete_object(Bucket='files', Key=key)
+            cur.execute("SELECT url, variants FROM hosted_images WHERE key = %s FOR UPDATE", (key,))
+            row = cur.fetchone()
+            keys = sorted({key, *image_variant_keys(row[1] if row else None)})
+            # Загрузки из редактора дедуплицируются в объекты хостинга, поэтому картинка может стоять в статьях
+            urls = sorted({s3_url(k) for k in keys} | ({row[0]} if row and row[0] else set()))
+            articles, drafts = image_references(cur, urls)
+            if articles or drafts:
+                conn.rollback()
+                return cors_response(409, {
+                    'error': 'Картинка используется в статьях или черновиках — сначала уберите её оттуда',
+                    'articles': articles, 'drafts': drafts
+                })
             cur.execute("DELETE FROM hosted_images WHERE key = %s", (key,))
+            s3 = get_s3()
+            s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': [{'Key': k} for k in keys], 'Quiet': True})
             conn.commit()
             return cors_response(200, {'deleted': key})
 
@@ -593,72 +2462,232 @@ def handle_hosting_images(method: str, event: dict) -> dict:
 
     finally:
         cur.close()
-        conn.close()
 
 
-def handle_draft(method: str, event: dict) -> dict:
+# Автосохранение черновика: один upsert по (user_id, article_id), версия растёт только при
+# реальном изменении. If-Match с версией защищает от перезаписи более свежего черновика
+# из другой вкладки, а content_patch позволяет прислать только изменённые блоки.
+DRAFT_COLUMNS = "article_id, title, description, content, preview_image, category_ids, is_hidden, updated_at, version"
+DRAFT_FIELDS = ('title', 'description', 'preview_image', 'category_ids', 'is_hidden')
+DRAFT_CHANGED = """(d.title, d.description, d.content, d.preview_image, d.category_ids, d.is_hidden)
+    IS DISTINCT FROM ({title}, {description}, {content}::jsonb, {preview_image}, {category_ids}::jsonb, {is_hidden})"""
+
+
+def draft_from_row(r) -> dict:
+    """Черновик из строки DRAFT_COLUMNS"""
+    return {
+        'article_id': r[0],
+        'title': r[1],
+        'description': r[2],
+        'content': r[3],
+        'preview_image': r[4],
+        'category_ids': r[5],
+        'is_hidden': r[6],
+        'updated_at': r[7].isoformat() if r[7] else None,
+        'version': r[8],
+    }
+
+
+def draft_validator_prefix(user_id: int, article_id) -> str:
+    """Общая часть валидатора черновика: пользователь и статья (new — для новой)"""
+    return f"d{user_id}-{article_id if article_id is not None else 'new'}"
+
+
+def draft_etag(user_id: int, article_id, version: int) -> dict:
+    """ETag черновика. Номер версии сам по себе у всех черновиков одинаковый (1, 2, …),
+    поэтому в валидатор входят пользователь и статья"""
+    return {'ETag': f'W/"{draft_validator_prefix(user_id, article_id)}-{version}"'}
+
+
+def parse_if_match(event: dict, prefix: str):
+    """Версия из If-Match: ETag этого черновика или просто номер версии.
+    None — заголовка нет или '*'. ValueError — заголовок испорчен или от другого черновика"""
+    raw = get_header(event, 'If-Match').strip()
+    if not raw or raw == '*':
+        return None
+    value = strip_etag_encoding(raw.removeprefix('W/')).strip('"')
+    if value.startswith('d'):
+        owner, _, value = value.rpartition('-')
+        if owner != prefix:
+            raise ValueError('If-Match from another draft')
+    return int(value)
+
+
+def draft_content_value(content):
+    """Контент черновика для JSONB: список блоков (в том числе из JSON-строки) или строка старого HTML"""
+    if isinstance(content, str):
+        try:
+            parsed = json.loads(content)
+        except ValueError:
+            return content
+        return parsed if isinstance(parsed, list) else content
+    return content if isinstance(content, list) else ''
+
+
+def apply_block_patch(blocks, patch) -> list:
+    """Применяет {upsert: [блоки с id], delete: [id], order: [id]} к списку блоков черновика"""
+    if not isinstance(blocks, list) or not isinstance(patch, dict):
+        raise ValueError('Патч применим только к блочному черновику')
+    upsert = patch.get('upsert') or []
+    delete = patch.get('delete') or []
+    order = patch.get('order')
+    if not isinstance(upsert, list) or not all(isinstance(b, dict) and isinstance(b.get('id'), str) for b in upsert):
+        raise ValueError('Каждый блок патча должен иметь id')
+    if not isinstance(delete, list) or (order is not None and not isinstance(order, list)):
+        raise ValueError('delete и order должны быть списками id')
+    if not all(isinstance(block_id, str) for block_id in [*delete, *(order or [])]):
+        raise ValueError('id в delete и order должны быть строками')
+
+    changed = {block['id']: block for block in upsert}
+    deleted = set(delete)
+    result = []
+    for block in blocks:
+        block_id = block.get('id') if isinstance(block, dict) else None
+        if block_id in deleted:
+            continue
+        result.append(changed.pop(block_id, block) if block_id is not None else block)
+    # Новые блоки — в конец, их место задаёт order
+    result.extend(changed.values())
+    if order is not None:
+        position = {block_id: i for i, block_id in enumerate(order)}
+        result.sort(key=lambda b: position.get(b.get('id') if isinstance(b, dict) else None, len(position)))
+    return result
+
+
+def handle_draft(method: str, ctx: RequestContext) -> dict:
     """Черновик статьи, привязанный к пользователю (для восстановления после сбоя браузера)"""
-    user = validate_user(event)
+    user = ctx.user
     if not user:
         return cors_response(403, {'error': 'Authentication required'})
 
-    query = event.get('queryStringParameters') or {}
+    query = ctx.query
     raw_article_id = query.get('article_id')
     article_id = int(raw_article_id) if raw_article_id and raw_article_id != 'new' else None
 
-    conn = get_db_connection()
+    conn = ctx.conn
     cur = conn.cursor()
 
     try:
         if method == 'GET':
             if article_id is None:
                 cur.execute(
-                    """SELECT id, article_id, title, description, content, preview_image, category_ids, is_hidden, updated_at
-                       FROM article_drafts WHERE user_id = %s AND article_id IS NULL""",
+                    f"SELECT {DRAFT_COLUMNS} FROM article_drafts WHERE user_id = %s AND article_id IS NULL",
                     (user['id'],)
                 )
             else:
                 cur.execute(
-                    """SELECT id, article_id, title, description, content, preview_image, category_ids, is_hidden, updated_at
-                       FROM article_drafts WHERE user_id = %s AND article_id = %s""",
+                    f"SELECT {DRAFT_COLUMNS} FROM article_drafts WHERE user_id = %s AND article_id = %s",
                     (user['id'], article_id)
                 )
             row = cur.fetchone()
             if not row:
                 return cors_response(200, {'draft': None})
-            return cors_response(200, {'draft': {
-                'article_id': row[1],
-                'title': row[2],
-                'description': row[3],
-                'content': row[4],
-                'preview_image': row[5],
-                'category_ids': row[6],
-                'is_hidden': row[7],
-                'updated_at': row[8].isoformat() if row[8] else None,
-            }})
+            return cors_response(200, {'draft': draft_from_row(row)}, draft_etag(user['id'], article_id, row[8]))
 
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
+            body = ctx.body
             draft_article_id = body.get('article_id')
-            title = body.get('title', '')
-            description = body.get('description', '')
-            content = body.get('content', '')
-            preview_image = body.get('preview_image')
-            category_ids = json.dumps(body.get('category_ids', []))
-            is_hidden = body.get('is_hidden', False)
+            try:
+                expected = parse_if_match(ctx.event, draft_validator_prefix(user['id'], draft_article_id))
+            except ValueError:
+                return cors_response(400, {'error': 'Invalid If-Match'})
 
             if draft_article_id is None:
-                cur.execute("DELETE FROM article_drafts WHERE user_id = %s AND article_id IS NULL", (user['id'],))
+                key_condition, key_params = "d.article_id IS NULL", (user['id'],)
             else:
-                cur.execute("DELETE FROM article_drafts WHERE user_id = %s AND article_id = %s", (user['id'], draft_article_id))
+                key_condition, key_params = "d.article_id = %s", (user['id'], draft_article_id)
 
-            cur.execute(
-                """INSERT INTO article_drafts (user_id, article_id, title, description, content, preview_image, category_ids, is_hidden)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                (user['id'], draft_article_id, title, description, content, preview_image, category_ids, is_hidden)
-            )
-            conn.commit()
-            return cors_response(200, {'success': True})
+            if 'content_patch' in body:
+                # Патч считается от конкретной версии — без неё непонятно, к чему его применять
+                if expected is None:
+                    return cors_response(428, {'error': 'Для content_patch нужен If-Match с версией черновика'})
+                cur.execute(f"""
+                    SELECT d.content, d.version, d.title, d.description, d.preview_image, d.category_ids, d.is_hidden
+                    FROM article_drafts d WHERE d.user_id = %s AND {key_condition}
+                    FOR UPDATE
+                """, key_params)
+                row = cur.fetchone()
+                if not row or row[1] != expected:
+                    conn.rollback()
+                    return cors_response(412, {'error': 'Черновик изменён в другом месте', 'version': row[1] if row else None})
+                try:
+                    content = apply_block_patch(row[0], body['content_patch'])
+                except ValueError as e:
+                    conn.rollback()
+                    return cors_response(400, {'error': str(e)})
+                # Патч присылает только изменённые блоки: поля, которых нет в теле, остаются как были
+                defaults = dict(zip(DRAFT_FIELDS, row[2:]))
+            else:
+                content = draft_content_value(body.get('content', ''))
+                defaults = {'title': '', 'description': '', 'preview_image': None, 'category_ids': [], 'is_hidden': False}
+            fields = {name: body.get(name, default) for name, default in defaults.items()}
+
+            params = {
+                'user_id': user['id'],
+                'article_id': draft_article_id,
+                'title': fields['title'],
+                'description': fields['description'],
+                'content': Json(content, dumps=dumps_json),
+                'preview_image': fields['preview_image'],
+                'category_ids': Json(fields['category_ids']),
+                'is_hidden': fields['is_hidden'],
+                'expected': expected,
+            }
+
+            if expected is None:
+                # Без If-Match — обычный upsert; неизменившийся черновик не переписывается
+                conflict_target = "(user_id) WHERE article_id IS NULL" if draft_article_id is None else "(user_id, article_id)"
+                cur.execute(f"""
+                    INSERT INTO article_drafts AS d
+                        (user_id, article_id, title, description, content, preview_image, category_ids, is_hidden)
+                    VALUES (%(user_id)s, %(article_id)s, %(title)s, %(description)s, %(content)s,
+                            %(preview_image)s, %(category_ids)s, %(is_hidden)s)
+                    ON CONFLICT {conflict_target} DO UPDATE SET
+                        title = EXCLUDED.title,
+                        description = EXCLUDED.description,
+                        content = EXCLUDED.content,
+                        preview_image = EXCLUDED.preview_image,
+                        category_ids = EXCLUDED.category_ids,
+                        is_hidden = EXCLUDED.is_hidden,
+                        updated_at = CURRENT_TIMESTAMP,
+                        version = d.version + 1
+                    WHERE {DRAFT_CHANGED.format(**{f: f'EXCLUDED.{f}' for f in
+                        ('title', 'description', 'content', 'preview_image', 'category_ids', 'is_hidden')})}
+                    RETURNING version
+                """, params)
+            else:
+                cur.execute(f"""
+                    UPDATE article_drafts AS d SET
+                        title = %(title)s,
+                        description = %(description)s,
+                        content = %(content)s,
+                        preview_image = %(preview_image)s,
+                        category_ids = %(category_ids)s,
+                        is_hidden = %(is_hidden)s,
+                        updated_at = CURRENT_TIMESTAMP,
+                        version = d.version + 1
+                    WHERE d.user_id = %(user_id)s
+                      AND {key_condition.replace('%s', '%(article_id)s')}
+                      AND d.version = %(expected)s
+                      AND {DRAFT_CHANGED.format(**{f: f'%({f})s' for f in
+                          ('title', 'description', 'content', 'preview_image', 'category_ids', 'is_hidden')})}
+                    RETURNING version
+                """, params)
+            row = cur.fetchone()
+            if row:
+                conn.commit()
+                return cors_response(200, {'success': True, 'version': row[0]}, draft_etag(user['id'], draft_article_id, row[0]))
+
+            # Ничего не записано: либо черновик не изменился, либо версия устарела
+            cur.execute(f"SELECT d.version FROM article_drafts d WHERE d.user_id = %s AND {key_condition}", key_params)
+            current = cur.fetchone()
+            conn.rollback()
+            if current and (expected is None or current[0] == expected):
+                return cors_response(
+                    200, {'success': True, 'version': current[0], 'unchanged': True},
+                    draft_etag(user['id'], draft_article_id, current[0])
+                )
+            return cors_response(412, {'error': 'Черновик изменён в другом месте', 'version': current[0] if current else None})
 
         elif method == 'DELETE':
             if article_id is None:
@@ -671,80 +2700,823 @@ def handle_draft(method: str, event: dict) -> dict:
         return cors_response(405, {'error': 'Method not allowed'})
     finally:
         cur.close()
-        conn.close()
 
 
-def handle_me(method: str, event: dict) -> dict:
+# Статический снимок каталога в бакете: публичное чтение без вызова функции.
+# Файлы пишутся под префикс snapshots/v<N>/, где N — версия каталога из того же снимка БД:
+# одной версии соответствует одно состояние данных, поэтому файл под ключом никогда не меняется.
+# manifest.json (одна запись PUT — атомарно) указывает, какие ключи сейчас актуальны.
+# Неизменившиеся файлы (тот же sha256) переходят в новый манифест со старыми ключами.
+# Публикации идут строго по одной (advisory lock), иначе две параллельные прочитают
+# один манифест и вторая запись потеряет файлы первой.
+SNAPSHOT_PREFIX = os.environ.get('SNAPSHOT_PREFIX', 'snapshots')
+SNAPSHOT_PAGE_SIZE = int(os.environ.get('SNAPSHOT_PAGE_SIZE', '50'))
+SNAPSHOT_AUTO_PUBLISH = os.environ.get('SNAPSHOT_AUTO_PUBLISH') == '1'
+SNAPSHOT_FETCH_SIZE = 100
+SNAPSHOT_FILE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SNAPSHOT_MANIFEST_CACHE_CONTROL = 'no-cache'
+SNAPSHOT_LOCK_KEY = 0x736E6170
+
+
+def snapshot_manifest_key() -> str:
+    """Ключ манифеста снимка"""
+    return f"{SNAPSHOT_PREFIX}/manifest.json"
+
+
+def load_snapshot_manifest(s3) -> dict:
+    """Текущий манифест снимка (пустой, если снимок ещё не публиковался)"""
+    try:
+        obj = s3.get_object(Bucket=S3_BUCKET, Key=snapshot_manifest_key())
+    except s3.exceptions.NoSuchKey:
+        return {'version': 0, 'files': {}}
+    return json.loads(obj['Body'].read())
+
+
+def snapshot_files(cur, article_ids=None):
+    """Файлы снимка (имя, тело): категории, страницы списка и публичные статьи.
+    article_ids — только эти статьи; None — все"""
+    cur.execute("SELECT id, name, icon, created_at FROM categories ORDER BY name")
+    yield 'categories.json', dumps_json({'categories': [category_from_row(c) for c in cur.fetchall()]})
+
+    # Страницы списка пересобираются целиком: любая правка сдвигает порядок по updated_at
+    cur.execute(f"""
+        SELECT {SUMMARY_COLUMNS}
+        FROM articles a
+        {ARTICLE_CATEGORIES_JOIN}
+        WHERE a.is_hidden = false
+        ORDER BY a.updated_at DESC, a.id DESC
+    """)
+    summaries = [summary_from_row(r) for r in cur.fetchall()]
+    pages = max(1, math.ceil(len(summaries) / SNAPSHOT_PAGE_SIZE))
+    for page in range(pages):
+        yield f'summary/{page + 1}.json', dumps_json({
+            'articles': summaries[page * SNAPSHOT_PAGE_SIZE:(page + 1) * SNAPSHOT_PAGE_SIZE],
+            'page': page + 1,
+            'pages': pages,
+            'total': len(summaries)
+        })
+
+    if article_ids is not None and not article_ids:
+        return
+    condition = "AND a.id = ANY(%s)" if article_ids is not None else ""
+    cur.execute(f"""
+        SELECT a.id, {ARTICLE_JSON}
+        FROM articles a
+        LEFT JOIN users u ON a.author_id = u.id
+        {ARTICLE_CATEGORIES_JOIN}
+        WHERE a.is_hidden = false {condition}
+        ORDER BY a.id
+    """, (list(article_ids),) if article_ids is not None else None)
+    while True:
+        rows = cur.fetchmany(SNAPSHOT_FETCH_SIZE)
+        if not rows:
+            break
+        for article_id, article_json in rows:
+            yield f'articles/{article_id}.json', f'{{"article":{article_json}}}'
+
+
+def publish_snapshot(conn, article_ids=None, s3=None) -> dict:
+    """Публикует снимок каталога в бакет и переключает манифест. Возвращает манифест.
+    article_ids — пересобрать только эти статьи (остальные файлы статей берутся из прошлого манифеста)"""
+    s3 = s3 or get_s3()
+    cur = conn.cursor()
+    try:
+        # Сессионная блокировка берётся до снимка БД: следующий публикатор увидит данные не старее
+        cur.execute("SELECT pg_advisory_lock(%s)", (SNAPSHOT_LOCK_KEY,))
+        conn.rollback()
+        try:
+            return publish_snapshot_locked(conn, cur, article_ids, s3)
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (SNAPSHOT_LOCK_KEY,))
+            conn.rollback()
+    finally:
+        cur.close()
+
+
+def publish_snapshot_locked(conn, cur, article_ids, s3) -> dict:
+    """Публикация снимка под SNAPSHOT_LOCK_KEY"""
+    # Все файлы снимка и версия каталога читаются из одного снимка БД
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    cur.execute("SELECT version FROM catalog_version WHERE id = 1")
+    row = cur.fetchone()
+    version = row[0] if row else 0
+
+    previous = load_snapshot_manifest(s3)
+    previous_files = previous.get('files', {})
+
+    files = {}
+    if article_ids is not None:
+        touched = {f'articles/{article_id}.json' for article_id in article_ids}
+        files.update(
+            (name, entry) for name, entry in previous_files.items()
+            if name.startswith('articles/') and name not in touched
+        )
+
+    uploaded = 0
+    for name, body in snapshot_files(cur, article_ids):
+        data = body.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        entry = previous_files.get(name)
+        if not entry or entry.get('sha256') != digest:
+            key = f"{SNAPSHOT_PREFIX}/v{version}/{name}"
+            s3.put_object(
+                Bucket=S3_BUCKET, Key=key, Body=data,
+                ContentType='application/json; charset=utf-8',
+                CacheControl=SNAPSHOT_FILE_CACHE_CONTROL
+            )
+            entry = {'key': key, 'url': s3_url(key), 'sha256': digest, 'size': len(data)}
+            uploaded += 1
+        files[name] = entry
+    conn.rollback()
+
+    if files == previous_files:
+        print(f"[snapshot] unchanged version={previous.get('version', 0)}")
+        return previous
+
+    manifest = {
+        'version': version,
+        'published_at': datetime.now(timezone.utc).isoformat(),
+        'files': files
+    }
+    s3.put_object(
+        Bucket=S3_BUCKET, Key=snapshot_manifest_key(), Body=dumps_json(manifest).encode(),
+        ContentType='application/json; charset=utf-8',
+        CacheControl=SNAPSHOT_MANIFEST_CACHE_CONTROL
+    )
+    print(f"[snapshot] published version={version} uploaded={uploaded} files={len(files)}")
+    return manifest
+
+
+def handle_snapshot(method: str, ctx: RequestContext) -> dict:
+    """Полная публикация статического снимка каталога (только администраторы)"""
+    if method != 'POST':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    if not user or user['role'] != 'administrator':
+        return cors_response(403, {'error': 'Access denied'})
+    manifest = publish_snapshot(ctx.conn)
+    return cors_response(200, {
+        'version': manifest['version'],
+        'files': len(manifest['files']),
+        'manifest_url': s3_url(snapshot_manifest_key())
+    })
+
+
+# Выгрузка всей вики в NDJSON: первая строка — категории, дальше по строке на статью.
+# Статьи читаются именованным (серверным) курсором порциями по EXPORT_ITERSIZE,
+# поэтому память не растёт с размером вики.
+EXPORT_ITERSIZE = int(os.environ.get('EXPORT_ITERSIZE', '200'))
+EXPORT_PREFIX = 'exports'
+S3_MULTIPART_CHUNK = 8 * 1024 * 1024
+
+
+def export_ndjson(conn, write, include_hidden: bool = True) -> int:
+    """Пишет вики в NDJSON через write(bytes). Возвращает число статей"""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, name, icon, created_at FROM categories ORDER BY id")
+        write((dumps_json({'categories': [category_from_row(c) for c in cur.fetchall()]}) + '\n').encode())
+    finally:
+        cur.close()
+
+    exported = 0
+    cur = conn.cursor(name='wiki_export')
+    cur.itersize = EXPORT_ITERSIZE
+    try:
+        cur.execute(f"""
+            SELECT {ARTICLE_JSON}
+            FROM articles a
+            LEFT JOIN users u ON a.author_id = u.id
+            {ARTICLE_CATEGORIES_JOIN}
+            {"" if include_hidden else "WHERE a.is_hidden = false"}
+            ORDER BY a.id
+        """)
+        for (article_json,) in cur:
+            write(f'{{"article":{article_json}}}\n'.encode())
+            exported += 1
+    finally:
+        cur.close()
+        conn.rollback()
+    return exported
+
+
+class S3MultipartWriter:
+    """Файлоподобный приёмник: буферизует записи и отправляет их частями multipart upload"""
+
+    def __init__(self, s3, key: str, content_type: str):
+        self.s3 = s3
+        self.key = key
+        self.buffer = bytearray()
+        self.parts = []
+        self.size = 0
+        self.upload_id = s3.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, ContentType=content_type
+        )['UploadId']
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.size += len(data)
+        if len(self.buffer) >= S3_MULTIPART_CHUNK:
+            self._upload_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer)
+        )
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self.buffer.clear()
+
+    def close(self):
+        """Отправляет остаток и собирает объект"""
+        if self.buffer or not self.parts:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        self.s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id)
+
+
+def export_to_s3(conn, key: str = None, include_hidden: bool = True, s3=None) -> dict:
+    """Выгрузка вики в бакет (NDJSON, сжатый gzip на лету)"""
+    key = key or f"{EXPORT_PREFIX}/wiki-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.ndjson.gz"
+    writer = S3MultipartWriter(s3 or get_s3(), key, 'application/gzip')
+    try:
+        with gzip.GzipFile(fileobj=writer, mode='wb') as gz:
+            exported = export_ndjson(conn, gz.write, include_hidden)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    print(f"[export] key={key} articles={exported} bytes={writer.size}")
+    return {'key': key, 'url': s3_url(key), 'articles': exported, 'size': writer.size}
+
+
+def handle_export(method: str, ctx: RequestContext) -> dict:
+    """Полная выгрузка вики в бакет (только администраторы)"""
+    if method != 'POST':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    if not user or user['role'] != 'administrator':
+        return cors_response(403, {'error': 'Access denied'})
+    include_hidden = ctx.query.get('include_hidden', '1') != '0'
+    return cors_response(200, export_to_s3(ctx.conn, include_hidden=include_hidden))
+
+
+# Версия каталога (категории, статьи, их авторы) хранится в catalog_version и растёт
+# с каждой записью. Экземпляр сверяет её с БД не чаще раза в CATALOG_VERSION_TTL секунд,
+# поэтому между сверками публичные чтения отдаются из памяти без обращения к Postgres.
+CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', '5'))
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '128'))
+# Лента изменений (changes) сюда не входит: её ответ зависит от горизонта незавершённых транзакций,
+# а не только от версии каталога, и под той же версией мог бы навсегда застрять неполным
+CACHED_ACTIONS = ('categories', 'articles', 'article', 'search')
+
+_catalog_version = {'value': None, 'updated_at': None, 'checked_at': 0.0}
+_response_cache = OrderedDict()
+_response_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def current_catalog_version(ctx: RequestContext) -> int:
+    """Версия каталога: из памяти, если сверялись недавно, иначе из БД"""
+    if time.monotonic() - _catalog_version['checked_at'] >= CATALOG_VERSION_TTL:
+        cur = ctx.conn.cursor()
+        try:
+            cur.execute("SELECT version, updated_at FROM catalog_version WHERE id = 1")
+            row = cur.fetchone()
+        finally:
+            cur.close()
+        _catalog_version.update(
+            value=row[0] if row else 0, updated_at=row[1] if row else None, checked_at=time.monotonic()
+        )
+    return _catalog_version['value']
+
+
+def catalog_last_modified(ctx: RequestContext) -> dict:
+    """Last-Modified списков — время последней записи в каталог.
+    Даты самих строк не годятся: удаление или скрытие статьи их не сдвигает"""
+    current_catalog_version(ctx)
+    return last_modified_headers([_catalog_version['updated_at']])
+
+
+def commit_catalog_change(conn, cur, article_ids=None):
+    """Повышает версию каталога в текущей транзакции и фиксирует её.
+    article_ids — какие статьи затронуты (для снимка в бакете); None — возможно, любые"""
+    cur.execute(
+        "UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1 RETURNING version, updated_at"
+    )
+    row = cur.fetchone()
+    conn.commit()
+    # Локальная версия обновляется только после commit: незафиксированный номер может
+    # достаться чужой записи, и закэшированное под ним тело оказалось бы устаревшим.
+    if row:
+        _catalog_version.update(value=row[0], updated_at=row[1], checked_at=time.monotonic())
+    if SNAPSHOT_AUTO_PUBLISH:
+        try:
+            publish_snapshot(conn, article_ids)
+        except Exception as e:
+            # Запись в БД уже зафиксирована — снимок догонит следующая публикация
+            print(f"[snapshot] publish failed: {e}")
+
+
+def cached_read(method: str, action: str, ctx: RequestContext) -> dict:
+    """GET каталога из кэша готовых тел ответа, привязанного к версии каталога"""
+    visibility = 'staff' if is_staff_user(ctx.user) else 'public'
+    key = (visibility, tuple(sorted(ctx.query.items())))
+    # Версию читаем до выборки: если запись успеет проскочить, тело лишь окажется новее ключа
+    version = current_catalog_version(ctx)
+
+    entry = _response_cache.get(key)
+    if entry is not None and entry[0] == version:
+        _response_cache.move_to_end(key)
+        _response_cache_stats['hits'] += 1
+        return conditional_response(ctx, cors_response(200, entry[1], entry[2]))
+
+    _response_cache_stats['misses'] += 1
+    response = dispatch(method, action, ctx)
+    if response['statusCode'] != 200:
+        return response
+
+    # Валидаторы считаются один раз при заполнении кэша и хранятся вместе с телом
+    validators = {'ETag': body_etag(response['body'])}
+    for name in ('Last-Modified', 'Content-Type'):
+        if name in response['headers']:
+            validators[name] = response['headers'][name]
+    response['headers'].update(validators)
+
+    _response_cache[key] = (version, response['body'], validators)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+        _response_cache_stats['evictions'] += 1
+    return conditional_response(ctx, response)
+
+
+# Публичные чтения кэшируются браузером и CDN, авторизованные — никогда
+PUBLIC_CACHE_CONTROL = os.environ.get('PUBLIC_CACHE_CONTROL', 'public, max-age=60, stale-while-revalidate=300')
+
+
+def http_date(dt: datetime) -> str:
+    """Дата в формате HTTP (TIMESTAMP из БД считается UTC)"""
+    dt = dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+    return email.utils.format_datetime(dt, usegmt=True)
+
+
+def last_modified_headers(timestamps) -> dict:
+    """Заголовок Last-Modified по самой свежей дате (пусто, если дат нет)"""
+    latest = max((t for t in timestamps if t), default=None)
+    return {'Last-Modified': http_date(latest)} if latest else {}
+
+
+def body_etag(body: str) -> str:
+    """Сильный ETag — хэш сериализованного тела"""
+    return '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def get_header(event: dict, name: str) -> str:
+    """Заголовок запроса без учёта регистра имени"""
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return ''
+
+
+def is_not_modified(event: dict, headers: dict) -> bool:
+    """Проверка If-None-Match / If-Modified-Since (If-None-Match главнее)"""
+    if_none_match = get_header(event, 'If-None-Match')
+    if if_none_match:
+        etag = headers.get('ETag', '')
+        candidates = [strip_etag_encoding(t.strip().removeprefix('W/')) for t in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates
+
+    if_modified_since = get_header(event, 'If-Modified-Since')
+    last_modified = headers.get('Last-Modified')
+    if if_modified_since and last_modified:
+        try:
+            return email.utils.parsedate_to_datetime(last_modified) <= email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(ctx: RequestContext, response: dict) -> dict:
+    """Проставляет Cache-Control и отвечает пустым 304, если у клиента актуальная копия"""
+    headers = response['headers']
+    if get_auth_token(ctx.event):
+        headers['Cache-Control'] = 'private, no-store'
+    else:
+        headers['Cache-Control'] = PUBLIC_CACHE_CONTROL
+    # Ответ зависит от токена (CDN не должен отдавать публичную копию редактору) и от сжатия
+    headers['Vary'] = 'Authorization, X-Authorization, Accept-Encoding'
+
+    if is_not_modified(ctx.event, headers):
+        # 304 несёт тот же ETag, что получил бы 200 в этой кодировке (с суффиксом сжатия)
+        encoding = response_encoding(ctx.event, response['body'].encode('utf-8'))
+        if encoding and headers.get('ETag'):
+            headers['ETag'] = encoded_etag(headers['ETag'], encoding)
+        response['statusCode'] = 304
+        response['body'] = ''
+    return response
+
+
+def response_cache_stats() -> dict:
+    """Снимок счётчиков кэша ответов"""
+    lookups = _response_cache_stats['hits'] + _response_cache_stats['misses']
+    return {
+        **_response_cache_stats,
+        'size': len(_response_cache),
+        'catalog_version': _catalog_version['value'],
+        'hit_rate': round(_response_cache_stats['hits'] / lookups, 3) if lookups else None
+    }
+
+
+def handle_cache_stats(method: str, ctx: RequestContext) -> dict:
+    """Счётчики in-process кэшей этого экземпляра функции (только администраторы)"""
+    if method != 'GET':
+        return cors_response(405, {'error': 'Method not allowed'})
+    user = ctx.user
+    if not user or user['role'] != 'administrator':
+        return cors_response(403, {'error': 'Access denied'})
+    return cors_response(200, {'user_cache': user_cache_stats(), 'response_cache': response_cache_stats()})
+
+
+def handle_me(method: str, ctx: RequestContext) -> dict:
     """Возвращает актуальные данные текущего пользователя (роль и т.д.) из БД"""
     if method != 'GET':
         return cors_response(405, {'error': 'Method not allowed'})
-    user = validate_user(event)
+    user = ctx.user
     if not user:
         return cors_response(401, {'error': 'Unauthorized'})
     return cors_response(200, {'user': user})
 
 
-def validate_user(event: dict) -> dict:
-    """Проверяет авторизацию пользователя по токену"""
-    
-    headers = event.get('headers', {})
+def get_auth_token(event: dict) -> str:
+    """Достаёт токен из заголовка авторизации (пустая строка, если его нет)"""
+    headers = event.get('headers') or {}
     auth_header = headers.get('X-Authorization', headers.get('authorization', ''))
+    return auth_header.replace('Bearer ', '').strip()
+
+
+def validate_user(ctx: RequestContext) -> dict:
+    """Проверяет авторизацию пользователя по токену (на подключении контекста запроса)"""
     
-    if not auth_header:
-        return None
-    
-    token = auth_header.replace('Bearer ', '').strip()
+    token = get_auth_token(ctx.event)
     
     if not token:
         return None
     
+    parts = token.split(':')
+    if len(parts) < 2 or not parts[1].isdigit():
+        return None
+    
+    # Версию читаем до выборки: запись, проскочившая между ними, лишь устареет раньше срока
+    version = current_catalog_version(ctx)
+    cached = get_cached_user(token, version)
+    if cached is not None:
+        return cached
+    
+    steam_id = parts[0]
+    user_id = int(parts[1])
+    
+    cur = ctx.conn.cursor()
     try:
-        parts = token.split(':')
-        if len(parts) >= 2:
-            steam_id = parts[0]
-            user_id = parts[1]
-            
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute(
-                "SELECT id, steam_id, username, avatar_url, role FROM users WHERE steam_id = %s AND id = %s",
-                (steam_id, user_id)
-            )
-            user_data = cur.fetchone()
-            
-            cur.close()
-            conn.close()
-            
-            if user_data:
-                return {
-                    'id': user_data[0],
-                    'steam_id': user_data[1],
-                    'username': user_data[2],
-                    'avatar_url': user_data[3],
-                    'role': user_data[4]
-                }
-    except:
-        pass
+        cur.execute(
+            "SELECT id, steam_id, username, avatar_url, role FROM users WHERE steam_id = %s AND id = %s",
+            (steam_id, user_id)
+        )
+        user_data = cur.fetchone()
+    except psycopg2.Error as e:
+        print(f"[validate_user] lookup failed: {e}")
+        ctx.conn.rollback()
+        return None
+    finally:
+        cur.close()
+    
+    if user_data:
+        user = {
+            'id': user_data[0],
+            'steam_id': user_data[1],
+            'username': user_data[2],
+            'avatar_url': user_data[3],
+            'role': user_data[4]
+        }
+        cache_user(token, user, version)
+        return user
     
     return None
 
 
+# LRU+TTL кэш пользователей по токену: админка не перечитывает users на каждый вызов.
+# Запись привязана к версии каталога: смена роли и удаление пользователя повышают её,
+# поэтому все тёплые экземпляры перечитывают пользователя не позже чем через CATALOG_VERSION_TTL.
+# Локальное вытеснение в handle_users делает это на текущем экземпляре сразу.
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '256'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+USER_CACHE_LOG_EVERY = 500
+
+_user_cache = OrderedDict()
+_user_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+def get_cached_user(token: str, version: int):
+    """Пользователь из кэша или None (просроченная или записанная при другой версии каталога запись вытесняется)"""
+    entry = _user_cache.get(token)
+    if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+        _user_cache.move_to_end(token)
+        _user_cache_stats['hits'] += 1
+        result = entry[2]
+    else:
+        if entry is not None:
+            del _user_cache[token]
+            _user_cache_stats['evictions'] += 1
+        _user_cache_stats['misses'] += 1
+        result = None
+
+    lookups = _user_cache_stats['hits'] + _user_cache_stats['misses']
+    if lookups % USER_CACHE_LOG_EVERY == 0:
+        print(f"[user_cache] {user_cache_stats()}")
+    return result
+
+
+def cache_user(token: str, user: dict, version: int):
+    """Кладёт пользователя в кэш, вытесняя самые давние записи сверх USER_CACHE_SIZE"""
+    _user_cache[token] = (time.monotonic() + USER_CACHE_TTL, version, user)
+    _user_cache.move_to_end(token)
+    while len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+        _user_cache_stats['evictions'] += 1
+
+
+def invalidate_cached_user(user_id: int):
+    """Вытесняет все токены пользователя (после смены роли или удаления)"""
+    stale = [token for token, (_, _, user) in _user_cache.items() if user['id'] == user_id]
+    for token in stale:
+        del _user_cache[token]
+    _user_cache_stats['invalidations'] += len(stale)
+
+
+def user_cache_stats() -> dict:
+    """Снимок счётчиков кэша пользователей"""
+    lookups = _user_cache_stats['hits'] + _user_cache_stats['misses']
+    return {
+        **_user_cache_stats,
+        'size': len(_user_cache),
+        'hit_rate': round(_user_cache_stats['hits'] / lookups, 3) if lookups else None
+    }
+
+
+# Пул подключений живёт на уровне модуля и переживает тёплые вызовы handler
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+# Простаивавшее дольше стольких секунд подключение проверяется SELECT 1 перед выдачей
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+_db_pool = None
+_db_last_used = {}
+
+
+def get_db_pool():
+    """Пул подключений процесса (создаётся при первом обращении)"""
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = psycopg2.pool.ThreadedConnectionPool(0, DB_POOL_SIZE, os.environ['DATABASE_URL'])
+        _db_last_used.clear()
+    return _db_pool
+
+
+def is_connection_alive(conn) -> bool:
+    """Проверка живости подключения при выдаче из пула"""
+    if conn.closed:
+        return False
+    last_used = _db_last_used.get(conn)
+    if last_used is None or time.monotonic() - last_used < DB_POOL_PING_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        print(f"[db_pool] dropping dead connection: {e}")
+        return False
+
+
 def get_db_connection():
-    """Создает подключение к БД"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Берёт подключение из пула; оборванные подключения заменяются новыми"""
+    pool = get_db_pool()
+    for _ in range(DB_POOL_SIZE + 1):
+        conn = pool.getconn()
+        if is_connection_alive(conn):
+            return conn
+        _db_last_used.pop(conn, None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError('No live database connection')
+
+
+def release_db_connection(conn):
+    """Возвращает подключение в пул (незавершённая транзакция откатывается пулом)"""
+    if conn.closed:
+        _db_last_used.pop(conn, None)
+    else:
+        _db_last_used[conn] = time.monotonic()
+    get_db_pool().putconn(conn, close=bool(conn.closed))
+
+
+# Сжатие ответов: тела меньше порога не сжимаются, brotli — только если модуль установлен
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_CACHE_SIZE = 64
+
+_compressed_bodies = OrderedDict()
+
+
+def accepted_encodings(event: dict) -> set:
+    """Кодировки из Accept-Encoding с ненулевым q"""
+    accepted = set()
+    for part in get_header(event, 'Accept-Encoding').split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
 
 
-def cors_response(status_code: int, body):
+def strip_etag_encoding(etag: str) -> str:
+    """Убирает суффикс кодировки, добавленный к ETag при сжатии"""
+    for encoding in ('gzip', 'br'):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def compress_body(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def response_encoding(event: dict, data: bytes):
+    """Кодировка, в которой уйдёт тело: br, gzip или None (мало байт или клиент не умеет)"""
+    if len(data) < COMPRESS_MIN_BYTES:
+        return None
+    accepted = accepted_encodings(event)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag сжатого представления: другой набор байт — другой ETag (is_not_modified снимает суффикс)"""
+    return etag[:-1] + f'-{encoding}"'
+
+
+def compress_response(event: dict, response: dict) -> dict:
+    """Сжимает тело ответа (br/gzip) по Accept-Encoding и отдаёт его в base64"""
+    body = response.get('body')
+    if not body or response.get('isBase64Encoded'):
+        return response
+    data = body.encode('utf-8')
+    encoding = response_encoding(event, data)
+    if encoding is None:
+        return response
+
+    headers = response['headers']
+    etag = headers.get('ETag')
+    # Готовые сжатые тела кэшируются по ETag: тёплый экземпляр не сжимает каталог повторно.
+    # Ключом годится только ETag-хэш тела (body_etag из cached_read): любой другой валидатор
+    # (версия черновика и т.п.) может совпасть у разных тел, и клиент получил бы чужой ответ.
+    memo_key = (etag, encoding) if etag and etag == body_etag(body) else None
+    compressed = _compressed_bodies.get(memo_key) if memo_key else None
+    if compressed is None:
+        compressed = base64.b64encode(compress_body(data, encoding)).decode('ascii')
+        if memo_key:
+            _compressed_bodies[memo_key] = compressed
+            while len(_compressed_bodies) > COMPRESS_CACHE_SIZE:
+                _compressed_bodies.popitem(last=False)
+    else:
+        _compressed_bodies.move_to_end(memo_key)
+
+    headers['Content-Encoding'] = encoding
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'Accept-Encoding' not in vary:
+        headers['Vary'] = f"{vary}, Accept-Encoding"
+    if etag:
+        headers['ETag'] = encoded_etag(etag, encoding)
+    response['body'] = compressed
+    response['isBase64Encoded'] = True
+    return response
+
+
+def dumps_json(obj) -> str:
+    """Сериализация в JSON: orjson, если установлен, иначе стандартный json (тот же компактный вид)"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def cors_response(status_code: int, body, headers: dict = None):
     """Создает ответ с CORS заголовками"""
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, If-None-Match, If-Modified-Since, If-Match',
+        'Access-Control-Expose-Headers': 'ETag, Last-Modified'
+    }
+    if headers:
+        response_headers.update(headers)
     return {
         'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization'
-        },
-        'body': json.dumps(body) if isinstance(body, dict) else body,
+        'headers': response_headers,
+        'body': dumps_json(body) if isinstance(body, dict) else body,
         'isBase64Encoded': False
-    }
\ No newline at end of file
+    }
+
+
+def main(argv=None):
+    """Служебные команды: python index.py <команда> (нужен DATABASE_URL)"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Служебные команды Wiki API')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backfill = commands.add_parser('backfill-derived', help='пересчитать производные поля статей')
+    backfill.add_argument('--all', action='store_true', help='пересчитать все статьи, а не только необработанные')
+    commands.add_parser('publish-snapshot', help='опубликовать статический снимок каталога в бакет')
+    export = commands.add_parser('export', help='выгрузить вики в NDJSON')
+    export.add_argument('--output', default='-', help='файл для выгрузки (по умолчанию stdout)')
+    export.add_argument('--gzip', action='store_true', help='сжать выгрузку gzip')
+    export.add_argument('--s3', action='store_true', help='загрузить выгрузку в бакет (gzip) вместо файла')
+    export.add_argument('--public-only', action='store_true', help='без скрытых статей')
+    commands.add_parser('import-images', help='импортировать внешние картинки статей в хостинг до конца')
+    gc = commands.add_parser('gc-images', help='удалить из бакета картинки, на которые ничто не ссылается')
+    gc.add_argument('--delete', action='store_true', help='удалить (без флага — только отчёт)')
+    gc.add_argument('--grace-hours', type=float, default=GC_GRACE_HOURS, help='не трогать объекты моложе N часов')
+    dedup = commands.add_parser('dedup-images', help='схлопнуть одинаковые картинки хостинга')
+    dedup.add_argument('--dry-run', action='store_true', help='только посчитать дубликаты')
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection()
+    try:
+        if args.command == 'backfill-derived':
+            updated = backfill_derived_fields(conn, only_missing=not args.all)
+            print(f"Пересчитано статей: {updated}")
+        elif args.command == 'publish-snapshot':
+            manifest = publish_snapshot(conn)
+            print(f"Снимок v{manifest['version']}: файлов {len(manifest['files'])}, манифест {s3_url(snapshot_manifest_key())}")
+        elif args.command == 'import-images':
+            while True:
+                result = run_image_import(conn, None)
+                print(f"Импорт {result['job_id']}: готово {result['imported']}, ошибок {result['failed']}, осталось {result['remaining']}")
+                if result['status'] == 'done':
+                    break
+        elif args.command == 'gc-images':
+            report = collect_image_garbage(conn, dry_run=not args.delete, grace_hours=args.grace_hours)
+            for key in report['sample']:
+                print(key)
+            print(f"Объектов: {report['scanned']}, без ссылок: {report['orphans']} ({report['orphan_bytes']} байт), удалено: {report['deleted']}")
+        elif args.command == 'dedup-images':
+            result = dedup_hosted_images(conn, dry_run=args.dry_run)
+            print(f"Дубликатов: {result['removed']}, статей переписано: {len(result['articles'])}, объектов удалено: {result['deleted_objects']}")
+        elif args.command == 'export':
+            include_hidden = not args.public_only
+            if args.s3:
+                result = export_to_s3(conn, include_hidden=include_hidden)
+                print(f"Выгружено статей: {result['articles']}, {result['url']}", file=sys.stderr)
+                return
+            out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+            try:
+                if args.gzip:
+                    with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+                        exported = export_ndjson(conn, gz.write, include_hidden)
+                else:
+                    exported = export_ndjson(conn, out.write, include_hidden)
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+            print(f"Выгружено статей: {exported}", file=sys.stderr)
+    finally:
+        release_db_connection(conn)
+
+
+if __name__ == '__main__':
+    main()
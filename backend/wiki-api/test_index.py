@@ -0,0 +1,394 @@
+"""Юнит-тесты обработчиков wiki-api на заглушке подключения (без Postgres)"""
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+import index
+
+
+class FakeCursor:
+    """Курсор, который записывает запросы и отдаёт заранее заданные результаты по очереди"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+        self.rows = self.conn.results.pop(0) if self.conn.results else []
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def mogrify(self, template, args):
+        # execute_values склеивает строки VALUES через mogrify — запоминаем сами значения
+        self.conn.values.append(args)
+        return b'(' + b','.join(b'%s' for _ in args) + b')'
+
+    @property
+    def connection(self):
+        return self.conn
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    encoding = 'UTF8'
+
+    def __init__(self, results=None):
+        self.results = list(results or [])
+        self.executed = []
+        self.values = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def make_ctx(conn, query=None, body=None, headers=None, user=None):
+    ctx = index.RequestContext({
+        'queryStringParameters': query or {},
+        'body': index.dumps_json(body) if body is not None else None,
+        'headers': headers or {},
+    })
+    ctx._conn = conn
+    ctx._user, ctx._user_resolved = user, True
+    return ctx
+
+
+def fresh_catalog_version(version=1, updated_at=datetime(2026, 1, 2)):
+    """Версия каталога «только что сверена» — обработчики не идут за ней в БД"""
+    index._catalog_version.update(value=version, updated_at=updated_at, checked_at=time.monotonic())
+
+
+def test_articles_list_is_a_single_query():
+    fresh_catalog_version()
+    updated = datetime(2026, 1, 1)
+    conn = FakeConn([[
+        (1, updated, '{"id":1,"categories":[{"id":3}]}'),
+        (2, updated, '{"id":2,"categories":[]}'),
+    ]])
+    response = index.handle_articles('GET', make_ctx(conn))
+
+    assert response['statusCode'] == 200
+    assert response['body'] == '{"articles":[{"id":1,"categories":[{"id":3}]},{"id":2,"categories":[]}]}'
+    # Категории приходят тем же запросом, а не отдельным SELECT на каждую статью
+    assert len(conn.executed) == 1
+
+
+def test_list_last_modified_follows_catalog_version():
+    # Статья с более поздней датой удалена: строки старше, но список изменился
+    fresh_catalog_version(updated_at=datetime(2026, 3, 1, 12, 0))
+    conn = FakeConn([[(1, 'Гайды', 'BookOpen', datetime(2025, 1, 1))]])
+    response = index.handle_categories('GET', make_ctx(conn))
+
+    assert response['headers']['Last-Modified'] == 'Sun, 01 Mar 2026 12:00:00 GMT'
+
+
+def test_compressed_cache_ignores_non_body_etags():
+    event = {'headers': {'Accept-Encoding': 'gzip'}}
+    alice = index.cors_response(200, {'draft': {'title': 'ALICE' * 300}}, {'ETag': '"1"'})
+    bob = index.cors_response(200, {'draft': {'title': 'BOB' * 400}}, {'ETag': '"1"'})
+    index.compress_response(event, alice)
+    index.compress_response(event, bob)
+
+    assert b'BOB' in index.gzip.decompress(index.base64.b64decode(bob['body']))
+
+
+def test_rendered_html_ships_stylesheet_and_escapes_attributes():
+    html = index.render_blocks_html([
+        {'id': 'a', 'type': 'image', 'src': 'x.png" onerror="alert(1)', 'caption': ''},
+        {'id': 'b', 'type': 'button_link', 'label': 'Открыть', 'href': 'javascript:alert(1)'},
+    ])
+
+    assert '.gb-step{' in html and '...' not in html
+    assert 'src="x.png&quot; onerror=&quot;alert(1)"' in html
+    assert 'href="#"' in html
+
+
+def test_rendered_image_uses_card_variant_with_srcset():
+    base = 'https://cdn.example/wiki/ab/' + 'ab' * 32
+    html = index.render_blocks_html([
+        {'id': 'a', 'type': 'image', 'src': f'{base}/full.jpg', 'caption': ''},
+        {'id': 'b', 'type': 'image', 'src': 'https://example.com/full.jpg', 'caption': ''},
+    ])
+
+    assert f'src="{base}/card.jpg" srcset="{base}/card.jpg 800w, {base}/full.jpg 1920w"' in html
+    assert 'src="https://example.com/full.jpg" alt=""' in html
+
+
+def snapshot_queries(version, article_rows):
+    """Ответы БД на одну публикацию снимка: блокировка, версия, категории, список, статьи, разблокировка"""
+    return [[], [], [(version,)], [(1, 'Гайды', 'BookOpen', datetime(2026, 1, 1))], [], article_rows, []]
+
+
+def test_snapshot_publish_keys_follow_catalog_version():
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=index.S3_BUCKET)
+
+        conn = FakeConn(snapshot_queries(7, [(1, '{"id":1}'), (2, '{"id":2}')]))
+        first = index.publish_snapshot(conn, s3=s3)
+        assert first['version'] == 7
+        assert first['files']['articles/1.json']['key'] == 'snapshots/v7/articles/1.json'
+        # Публикация держит блокировку и отпускает её в конце
+        assert 'pg_advisory_lock' in conn.executed[0][0]
+        assert 'pg_advisory_unlock' in conn.executed[-1][0]
+
+        # Частичная публикация: статья 2 пересобрана под новой версией, статья 1 осталась из прошлого манифеста
+        conn = FakeConn(snapshot_queries(9, [(2, '{"id":2,"title":"new"}')]))
+        second = index.publish_snapshot(conn, article_ids=[2], s3=s3)
+        assert second['files']['articles/1.json']['key'] == 'snapshots/v7/articles/1.json'
+        assert second['files']['articles/2.json']['key'] == 'snapshots/v9/articles/2.json'
+
+        manifest = json.loads(s3.get_object(Bucket=index.S3_BUCKET, Key='snapshots/manifest.json')['Body'].read())
+        assert manifest == second
+        body = s3.get_object(Bucket=index.S3_BUCKET, Key='snapshots/v9/articles/2.json')['Body'].read()
+        assert json.loads(body) == {'article': {'id': 2, 'title': 'new'}}
+
+
+def png_bytes(size=(640, 480)):
+    image = pytest.importorskip('PIL.Image')
+    out = index.io.BytesIO()
+    image.new('RGB', size, (200, 80, 20)).save(out, 'PNG')
+    return out.getvalue()
+
+
+def test_repeat_wiki_upload_is_lookup_without_put(monkeypatch):
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    monkeypatch.setenv('S3_PUBLIC_URL', 'https://cdn.test')
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=index.S3_BUCKET)
+        monkeypatch.setattr(index, '_s3_client', s3)
+        puts = []
+        s3.meta.events.register('before-call.s3.PutObject', lambda **kw: puts.append(1))
+
+        editor = {'id': 1, 'username': 'ed', 'role': 'editor'}
+        body = {'image': index.base64.b64encode(png_bytes()).decode(), 'filename': 'shot.png'}
+        first = index.handle_upload_image('POST', make_ctx(FakeConn([[]]), body=body, user=editor))
+        uploaded = len(puts)
+        second = index.handle_upload_image('POST', make_ctx(FakeConn([[]]), body=body, user=editor))
+
+        assert uploaded == 6
+        assert len(puts) == uploaded
+        assert json.loads(second['body']) == json.loads(first['body'])
+
+
+def test_upload_confirm_builds_variants(monkeypatch):
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    monkeypatch.setenv('S3_PUBLIC_URL', 'https://cdn.test')
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=index.S3_BUCKET)
+        monkeypatch.setattr(index, '_s3_client', s3)
+        s3.put_object(Bucket=index.S3_BUCKET, Key='uploads/wiki/abc.png', Body=png_bytes((2400, 1200)), ContentType='image/png')
+
+        editor = {'id': 1, 'username': 'ed', 'role': 'editor'}
+        response = index.handle_upload_confirm('POST', make_ctx(FakeConn([[]]), body={'key': 'uploads/wiki/abc.png'}, user=editor))
+        image = json.loads(response['body'])
+
+        assert response['statusCode'] == 200
+        assert (image['width'], image['height']) == (1920, 960)
+        assert set(image['variants']) == {'thumb', 'card', 'full'}
+        assert image['variants']['thumb']['webp'].endswith('/thumb.webp')
+        assert 'Contents' not in s3.list_objects_v2(Bucket=index.S3_BUCKET, Prefix='uploads/')
+
+
+def test_hosting_delete_refuses_referenced_image(monkeypatch):
+    monkeypatch.setenv('S3_PUBLIC_URL', 'https://cdn.test')
+    variants = {'full': {'keys': ['hosting/ab/cd/full.webp', 'hosting/ab/cd/full.jpg']}}
+    conn = FakeConn([[('https://cdn.test/hosting/ab/cd/full.jpg', variants)], [(7,)], [(0,)]])
+    editor = {'id': 1, 'username': 'ed', 'role': 'editor'}
+
+    response = index.handle_hosting_images('DELETE', make_ctx(conn, body={'key': 'hosting/ab/cd/full.jpg'}, user=editor))
+
+    assert response['statusCode'] == 409
+    assert json.loads(response['body'])['articles'] == [7]
+    assert not any(sql.lstrip().startswith('DELETE') for sql, _ in conn.executed)
+    assert conn.commits == 0
+
+
+def test_image_rewrite_is_one_pass_per_table():
+    conn = FakeConn([
+        [(1, 'http://ext/a.png', '[{"src": "http://ext/a.png"}]', '["http://ext/a.png"]')],
+        [],
+        [(5, None, '[{"src": "http://ext/b.png?v=2"}]')],
+        [],
+    ])
+    replacements = {'http://ext/a.png': 'https://cdn/a', 'http://ext/b.png': 'https://cdn/b', 'http://ext/b.png?v=2': 'https://cdn/b2'}
+    affected = index.rewrite_image_references(FakeCursor(conn), replacements)
+
+    assert affected == [1]
+    assert len(conn.executed) == 4
+    assert conn.values == [
+        (1, 'https://cdn/a', '[{"src": "https://cdn/a"}]', '["https://cdn/a"]'),
+        (5, None, '[{"src": "https://cdn/b2"}]'),
+    ]
+
+
+def test_import_batch_postpones_storing_past_deadline(monkeypatch):
+    monkeypatch.setattr(index, 'download_image', lambda url, timeout: b'image bytes')
+    conn = FakeConn()
+    deadline = time.monotonic() + index.IMPORT_REWRITE_RESERVE / 2
+    done, errors, postponed, measured = index.import_image_batch(
+        FakeCursor(conn), ['http://ext/a.png', 'http://ext/b.png'], 1, None, deadline, index.IMPORT_STORE_SECONDS
+    )
+
+    assert (done, errors, measured) == ({}, {}, None)
+    assert postponed == ['http://ext/a.png', 'http://ext/b.png']
+    # До hosted_images дело не дошло — ни запросов, ни записи в бакет
+    assert conn.executed == []
+
+
+def test_import_deadline_before_rewrite_still_records_failures(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(index.time, 'monotonic', lambda: clock[0])
+
+    def batch(cur, items, user_id, s3, deadline, store_seconds):
+        clock[0] = deadline
+        return {'http://ext/a.png': 'https://cdn/a'}, {'http://ext/b.png': 'timeout'}, ['http://ext/c.png'], None
+
+    monkeypatch.setattr(index, 'import_image_batch', batch)
+    conn = FakeConn([
+        [(9,)],
+        [('http://ext/a.png',), ('http://ext/b.png',), ('http://ext/c.png',)],
+        [], [],
+        [('running', 0, 0, 3)],
+    ])
+
+    result = index.run_image_import(conn, 1, time_budget=30, s3=object())
+
+    assert result['remaining'] == 3
+    # Только ошибка пачки: сохранённая картинка и отложенная остаются в очереди
+    assert conn.values == [(9, 'http://ext/b.png', 'failed', None, 'timeout')]
+    assert b'job_id = v.job_id' in conn.executed[2][0]
+    assert conn.commits == 2
+
+
+AUTHOR = {'id': 1, 'username': 'author', 'role': 'editor'}
+
+
+def test_single_and_bulk_delete_drop_drafts_the_same_way(monkeypatch):
+    monkeypatch.setattr(index, 'SNAPSHOT_AUTO_PUBLISH', False)
+    moderator = {'id': 2, 'username': 'mod', 'role': 'moderator'}
+    single = FakeConn([[], [], [], [(2, datetime(2026, 1, 3))]])
+    index.handle_articles('DELETE', make_ctx(single, query={'id': '5'}, user=moderator))
+    bulk = FakeConn()
+    index.apply_bulk_operation(FakeCursor(bulk), 'delete', {5: None})
+
+    assert [sql for sql, _ in single.executed[:3]] == [sql for sql, _ in bulk.executed]
+    assert 'article_drafts' in single.executed[0][0]
+
+
+def test_draft_etag_is_per_user_and_article():
+    row = (7, 'T', '', [], None, [], False, datetime(2026, 1, 1), 1)
+    first = index.handle_draft('GET', make_ctx(FakeConn([[row]]), query={'article_id': '7'}, user=AUTHOR))
+    other = index.handle_draft('GET', make_ctx(FakeConn([[row]]), query={'article_id': '7'}, user={**AUTHOR, 'id': 2}))
+
+    assert first['headers']['ETag'] == 'W/"d1-7-1"'
+    assert other['headers']['ETag'] != first['headers']['ETag']
+
+
+def test_draft_save_with_stale_if_match_is_412():
+    conn = FakeConn([[], [(5,)]])
+    body = {'article_id': 7, 'title': 'T', 'content': []}
+    response = index.handle_draft('POST', make_ctx(conn, body=body, headers={'If-Match': 'W/"d1-7-3"'}, user=AUTHOR))
+
+    assert response['statusCode'] == 412
+    assert json.loads(response['body'])['version'] == 5
+    assert conn.commits == 0
+
+
+def test_draft_patch_keeps_fields_missing_from_body():
+    stored = ([{'id': 'a', 'type': 'paragraph', 'text': 'old'}], 3, 'Заголовок', 'Описание', 'cover.png', [2, 3], True)
+    conn = FakeConn([[stored], [(4,)]])
+    body = {'article_id': 7, 'content_patch': {'upsert': [{'id': 'a', 'type': 'paragraph', 'text': 'new'}]}}
+    response = index.handle_draft('POST', make_ctx(conn, body=body, headers={'If-Match': '"3"'}, user=AUTHOR))
+
+    assert response['statusCode'] == 200
+    assert response['headers']['ETag'] == 'W/"d1-7-4"'
+    params = conn.executed[1][1]
+    assert (params['title'], params['description'], params['preview_image'], params['is_hidden']) == \
+        ('Заголовок', 'Описание', 'cover.png', True)
+    assert params['category_ids'].adapted == [2, 3]
+    assert params['content'].adapted == [{'id': 'a', 'type': 'paragraph', 'text': 'new'}]
+
+
+@pytest.mark.parametrize('patch', [{'delete': [['a']]}, {'order': [{'id': 'a'}]}, {'delete': [1]}])
+def test_block_patch_rejects_non_string_ids(patch):
+    with pytest.raises(ValueError):
+        index.apply_block_patch([{'id': 'a', 'type': 'paragraph'}], patch)
+
+
+def test_draft_patch_on_stale_version_is_412():
+    stored = ([], 5, 'T', '', None, [], False)
+    conn = FakeConn([[stored]])
+    body = {'article_id': 7, 'content_patch': {'delete': ['a']}}
+    response = index.handle_draft('POST', make_ctx(conn, body=body, headers={'If-Match': '"3"'}, user=AUTHOR))
+
+    assert response['statusCode'] == 412
+    assert len(conn.executed) == 1
+
+
+
+def test_cached_user_expires_with_catalog_version():
+    headers = {'authorization': 'Bearer 7656:42'}
+    fresh_catalog_version(version=10)
+    conn = FakeConn([[(42, '7656', 'mod', None, 'moderator')]])
+    assert index.validate_user(make_ctx(conn, headers=headers))['role'] == 'moderator'
+    assert index.validate_user(make_ctx(conn, headers=headers))['role'] == 'moderator'
+    assert len(conn.executed) == 1
+
+    # Роль сменили на другом экземпляре: версия каталога выросла — кэш не годится
+    fresh_catalog_version(version=11)
+    conn = FakeConn([[(42, '7656', 'mod', None, 'no_access')]])
+    assert index.validate_user(make_ctx(conn, headers=headers))['role'] == 'no_access'
+
+
+def test_not_modified_keeps_the_compressed_etag():
+    body = index.dumps_json({'articles': [{'title': 'Статья'} for _ in range(200)]})
+    headers = {'Accept-Encoding': 'gzip'}
+
+    def respond(extra):
+        response = index.cors_response(200, body, {'ETag': index.body_etag(body)})
+        ctx = make_ctx(FakeConn(), headers={**headers, **extra})
+        return index.compress_response(ctx.event, index.conditional_response(ctx, response))
+
+    full = respond({})
+    revalidated = respond({'If-None-Match': full['headers']['ETag']})
+
+    assert full['headers']['ETag'].endswith('-gzip"')
+    assert revalidated['statusCode'] == 304
+    assert revalidated['headers']['ETag'] == full['headers']['ETag']
+    assert 'Accept-Encoding' in revalidated['headers']['Vary']
+    assert full['headers']['Vary'].count('Accept-Encoding') == 1
+
+
+def test_single_article_last_modified_follows_catalog_version():
+    fresh_catalog_version(updated_at=datetime(2026, 3, 1, 12, 0))
+    conn = FakeConn([[(5, datetime(2025, 1, 1), '{"id":5}')]])
+    response = index.handle_article('GET', make_ctx(conn, query={'id': '5'}))
+
+    assert response['headers']['Last-Modified'] == 'Sun, 01 Mar 2026 12:00:00 GMT'
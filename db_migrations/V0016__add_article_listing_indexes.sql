@@ -0,0 +1,10 @@
+-- Keyset-пагинация списка статей идёт по (updated_at, id): поле не должно быть NULL
+UPDATE articles SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+ALTER TABLE articles ALTER COLUMN updated_at SET NOT NULL;
+
+-- Индексы под ORDER BY updated_at DESC, id DESC: для редакторов (все статьи) и для публичного списка
+CREATE INDEX IF NOT EXISTS idx_articles_updated_id ON articles (updated_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_articles_visible_updated_id ON articles (updated_at DESC, id DESC) WHERE is_hidden = false;
+
+-- Фильтр по категории: поиск статей категории без обращения к таблице связей целиком
+CREATE INDEX IF NOT EXISTS idx_article_categories_category_article ON article_categories (category_id, article_id);
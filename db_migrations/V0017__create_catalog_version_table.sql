@@ -0,0 +1,11 @@
+-- Единственная строка со счётчиком версии каталога (категории и статьи).
+-- Каждая запись в каталог увеличивает version в своей транзакции, тёплые экземпляры
+-- функции по нему понимают, что закэшированные ответы устарели.
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 1)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,64 @@
+-- Текст статьи для полнотекстового поиска: текстовые поля блоков JSON,
+-- а для старых HTML-статей — содержимое без тегов
+CREATE OR REPLACE FUNCTION article_content_text(content TEXT) RETURNS TEXT AS $$
+DECLARE
+    blocks JSONB;
+BEGIN
+    IF content IS NULL OR content = '' THEN
+        RETURN '';
+    END IF;
+
+    BEGIN
+        blocks := content::jsonb;
+    EXCEPTION WHEN others THEN
+        blocks := NULL;
+    END;
+
+    IF blocks IS NULL OR jsonb_typeof(blocks) <> 'array' THEN
+        RETURN regexp_replace(content, '<[^>]*>', ' ', 'g');
+    END IF;
+
+    RETURN regexp_replace(COALESCE((
+        SELECT string_agg(part, ' ')
+        FROM jsonb_array_elements(blocks) AS b,
+        LATERAL (
+            SELECT b->>'text' AS part
+            WHERE b->>'type' IN ('paragraph', 'heading2', 'heading3', 'step', 'tip', 'warning')
+            UNION ALL
+            -- У tip/warning в icon лежит заголовок плашки ("Опасность!")
+            SELECT b->>'icon' WHERE b->>'type' IN ('tip', 'warning')
+            UNION ALL
+            SELECT jsonb_array_elements_text(b->'items')
+            WHERE b->>'type' IN ('list', 'sub_steps') AND jsonb_typeof(b->'items') = 'array'
+            UNION ALL
+            SELECT b->>'caption' WHERE b->>'type' = 'image'
+        ) parts
+        WHERE part IS NOT NULL AND part <> ''
+    ), ''), '[*`]', '', 'g');
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Поисковый вектор: заголовок (A), описание (B), текст блоков (C)
+ALTER TABLE articles ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION articles_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', COALESCE(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(NEW.description, '')), 'B') ||
+        setweight(to_tsvector('russian', article_content_text(NEW.content)), 'C');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS articles_search_vector_trg ON articles;
+CREATE TRIGGER articles_search_vector_trg
+    BEFORE INSERT OR UPDATE OF title, description, content ON articles
+    FOR EACH ROW EXECUTE FUNCTION articles_search_vector_update();
+
+UPDATE articles SET search_vector =
+    setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+    setweight(to_tsvector('russian', COALESCE(description, '')), 'B') ||
+    setweight(to_tsvector('russian', article_content_text(content)), 'C');
+
+CREATE INDEX IF NOT EXISTS idx_articles_search_vector ON articles USING GIN (search_vector);
@@ -0,0 +1,57 @@
+-- Контент статей хранится как JSONB: список блоков редактора.
+-- Старые HTML-статьи (не JSON-массив) сохраняются JSON-строкой с прежним HTML.
+CREATE OR REPLACE FUNCTION article_content_to_jsonb(content TEXT) RETURNS JSONB AS $$
+DECLARE
+    parsed JSONB;
+BEGIN
+    BEGIN
+        parsed := content::jsonb;
+    EXCEPTION WHEN others THEN
+        parsed := NULL;
+    END;
+
+    IF parsed IS NOT NULL AND jsonb_typeof(parsed) = 'array' THEN
+        RETURN parsed;
+    END IF;
+    RETURN to_jsonb(COALESCE(content, ''));
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Текст для поиска теперь берётся прямо из JSONB (триггер search_vector вызывает эту версию)
+CREATE OR REPLACE FUNCTION article_content_text(content JSONB) RETURNS TEXT AS $$
+BEGIN
+    IF content IS NULL THEN
+        RETURN '';
+    END IF;
+
+    IF jsonb_typeof(content) = 'string' THEN
+        RETURN regexp_replace(content #>> '{}', '<[^>]*>', ' ', 'g');
+    END IF;
+
+    IF jsonb_typeof(content) <> 'array' THEN
+        RETURN '';
+    END IF;
+
+    RETURN regexp_replace(COALESCE((
+        SELECT string_agg(part, ' ')
+        FROM jsonb_array_elements(content) AS b,
+        LATERAL (
+            SELECT b->>'text' AS part
+            WHERE b->>'type' IN ('paragraph', 'heading2', 'heading3', 'step', 'tip', 'warning')
+            UNION ALL
+            SELECT b->>'icon' WHERE b->>'type' IN ('tip', 'warning')
+            UNION ALL
+            SELECT jsonb_array_elements_text(b->'items')
+            WHERE b->>'type' IN ('list', 'sub_steps') AND jsonb_typeof(b->'items') = 'array'
+            UNION ALL
+            SELECT b->>'caption' WHERE b->>'type' = 'image'
+        ) parts
+        WHERE part IS NOT NULL AND part <> ''
+    ), ''), '[*`]', '', 'g');
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+ALTER TABLE articles ALTER COLUMN content TYPE JSONB USING article_content_to_jsonb(content);
+
+DROP FUNCTION IF EXISTS article_content_to_jsonb(TEXT);
+DROP FUNCTION IF EXISTS article_content_text(TEXT);
@@ -0,0 +1,10 @@
+-- Поля, вычисляемые из контента при сохранении статьи: выдержка для карточки,
+-- объём и время чтения, оглавление по заголовкам и список картинок.
+-- derived_at IS NULL — статья ещё не обработана (заполняется командой backfill-derived).
+ALTER TABLE articles
+    ADD COLUMN IF NOT EXISTS excerpt TEXT NOT NULL DEFAULT '',
+    ADD COLUMN IF NOT EXISTS word_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS reading_minutes INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS toc JSONB NOT NULL DEFAULT '[]'::jsonb,
+    ADD COLUMN IF NOT EXISTS images JSONB NOT NULL DEFAULT '[]'::jsonb,
+    ADD COLUMN IF NOT EXISTS derived_at TIMESTAMP NULL;
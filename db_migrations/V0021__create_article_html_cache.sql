@@ -0,0 +1,25 @@
+-- Хэш контента статьи поддерживается триггером: по нему ищется готовый HTML
+ALTER TABLE articles ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE OR REPLACE FUNCTION articles_content_hash_update() RETURNS trigger AS $$
+BEGIN
+    NEW.content_hash := encode(sha256(convert_to(NEW.content::text, 'UTF8')), 'hex');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS articles_content_hash_trg ON articles;
+CREATE TRIGGER articles_content_hash_trg
+    BEFORE INSERT OR UPDATE OF content ON articles
+    FOR EACH ROW EXECUTE FUNCTION articles_content_hash_update();
+
+UPDATE articles SET content_hash = encode(sha256(convert_to(content::text, 'UTF8')), 'hex');
+
+-- Отрендеренный на сервере HTML статьи: заполняется при сохранении или при первом чтении
+CREATE TABLE IF NOT EXISTS article_html (
+    article_id INTEGER NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
+    content_hash TEXT NOT NULL,
+    html TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (article_id, content_hash)
+);
@@ -0,0 +1,101 @@
+-- Лента изменений каталога (action=changes): каждая запись в статью или категорию
+-- получает номер из общей последовательности и id своей транзакции (txid).
+-- Клиент читает только строки завершённых транзакций (txid < xmin текущего снимка),
+-- поэтому медленная транзакция с меньшим номером не будет пропущена курсором.
+CREATE SEQUENCE IF NOT EXISTS catalog_change_seq;
+
+ALTER TABLE articles ADD COLUMN IF NOT EXISTS change_seq BIGINT;
+ALTER TABLE articles ADD COLUMN IF NOT EXISTS change_txid BIGINT;
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS change_seq BIGINT;
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS change_txid BIGINT;
+
+CREATE OR REPLACE FUNCTION catalog_change_stamp() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('catalog_change_seq');
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS articles_change_stamp_trg ON articles;
+CREATE TRIGGER articles_change_stamp_trg
+    BEFORE INSERT OR UPDATE ON articles
+    FOR EACH ROW EXECUTE FUNCTION catalog_change_stamp();
+
+DROP TRIGGER IF EXISTS categories_change_stamp_trg ON categories;
+CREATE TRIGGER categories_change_stamp_trg
+    BEFORE INSERT OR UPDATE ON categories
+    FOR EACH ROW EXECUTE FUNCTION catalog_change_stamp();
+
+UPDATE articles SET change_seq = nextval('catalog_change_seq'), change_txid = txid_current();
+UPDATE categories SET change_seq = nextval('catalog_change_seq'), change_txid = txid_current();
+
+ALTER TABLE articles ALTER COLUMN change_seq SET NOT NULL;
+ALTER TABLE articles ALTER COLUMN change_txid SET NOT NULL;
+ALTER TABLE categories ALTER COLUMN change_seq SET NOT NULL;
+ALTER TABLE categories ALTER COLUMN change_txid SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_articles_change ON articles (change_txid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_categories_change ON categories (change_txid, change_seq);
+
+-- Смена привязок к категориям и автора (имя, роль) меняет JSON статьи — отмечаем статью изменённой
+CREATE OR REPLACE FUNCTION article_categories_touch_article() RETURNS trigger AS $$
+BEGIN
+    UPDATE articles SET change_seq = change_seq
+    WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.article_id ELSE NEW.article_id END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS article_categories_touch_trg ON article_categories;
+CREATE TRIGGER article_categories_touch_trg
+    AFTER INSERT OR DELETE ON article_categories
+    FOR EACH ROW EXECUTE FUNCTION article_categories_touch_article();
+
+CREATE OR REPLACE FUNCTION users_touch_articles() RETURNS trigger AS $$
+BEGIN
+    UPDATE articles SET change_seq = change_seq WHERE author_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_touch_articles_trg ON users;
+CREATE TRIGGER users_touch_articles_trg
+    AFTER UPDATE OF username, role ON users
+    FOR EACH ROW
+    WHEN (OLD.username IS DISTINCT FROM NEW.username OR OLD.role IS DISTINCT FROM NEW.role)
+    EXECUTE FUNCTION users_touch_articles();
+
+-- Удалённые статьи и категории остаются в ленте надгробиями
+CREATE TABLE IF NOT EXISTS catalog_tombstones (
+    entity TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    change_seq BIGINT NOT NULL DEFAULT nextval('catalog_change_seq'),
+    change_txid BIGINT NOT NULL DEFAULT txid_current(),
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (entity, entity_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_tombstones_change ON catalog_tombstones (change_txid, change_seq);
+
+CREATE OR REPLACE FUNCTION catalog_record_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO catalog_tombstones (entity, entity_id)
+    VALUES (TG_ARGV[0], OLD.id)
+    ON CONFLICT (entity, entity_id) DO UPDATE
+        SET change_seq = nextval('catalog_change_seq'),
+            change_txid = txid_current(),
+            deleted_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS articles_tombstone_trg ON articles;
+CREATE TRIGGER articles_tombstone_trg
+    AFTER DELETE ON articles
+    FOR EACH ROW EXECUTE FUNCTION catalog_record_tombstone('article');
+
+DROP TRIGGER IF EXISTS categories_tombstone_trg ON categories;
+CREATE TRIGGER categories_tombstone_trg
+    AFTER DELETE ON categories
+    FOR EACH ROW EXECUTE FUNCTION catalog_record_tombstone('category');
@@ -0,0 +1,4 @@
+-- Габариты основного файла и карта вариантов (thumb/card/full: WebP + запасной формат)
+ALTER TABLE hosted_images ADD COLUMN IF NOT EXISTS width INTEGER;
+ALTER TABLE hosted_images ADD COLUMN IF NOT EXISTS height INTEGER;
+ALTER TABLE hosted_images ADD COLUMN IF NOT EXISTS variants JSONB NOT NULL DEFAULT '{}'::jsonb;
@@ -0,0 +1,6 @@
+-- SHA-256 содержимого картинки: одинаковые байты хранятся один раз.
+-- У старых строк хэш пустой, пока его не посчитает разовая чистка (index.py dedup-images)
+ALTER TABLE hosted_images ADD COLUMN IF NOT EXISTS content_sha256 TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_hosted_images_content_sha256
+    ON hosted_images (content_sha256) WHERE content_sha256 IS NOT NULL;
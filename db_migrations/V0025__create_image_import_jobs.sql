@@ -0,0 +1,22 @@
+-- Возобновляемый импорт внешних картинок статей: job и по строке на каждый исходный URL
+CREATE TABLE IF NOT EXISTS image_import_jobs (
+    id SERIAL PRIMARY KEY,
+    started_by INTEGER REFERENCES users(id),
+    status TEXT NOT NULL DEFAULT 'running',
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- status: pending — ещё не обрабатывался, done — перенесён (hosted_url), failed — ошибка (повтор до 3 попыток)
+CREATE TABLE IF NOT EXISTS image_import_items (
+    job_id INTEGER NOT NULL REFERENCES image_import_jobs(id) ON DELETE CASCADE,
+    source_url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    hosted_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (job_id, source_url)
+);
+
+CREATE INDEX IF NOT EXISTS idx_image_import_items_status ON image_import_items (job_id, status);
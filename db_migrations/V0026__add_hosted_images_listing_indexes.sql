@@ -0,0 +1,15 @@
+-- Keyset-пагинация хостинга по (created_at, id): дата должна быть всегда
+UPDATE hosted_images SET created_at = NOW() WHERE created_at IS NULL;
+ALTER TABLE hosted_images ALTER COLUMN created_at SET NOT NULL;
+
+-- Лента новых картинок; uploaded_by и size_bytes в INCLUDE — статистика по дням читает только индекс
+CREATE INDEX IF NOT EXISTS idx_hosted_images_created
+    ON hosted_images (created_at DESC, id DESC) INCLUDE (uploaded_by, size_bytes);
+
+-- Фильтр по загрузившему
+CREATE INDEX IF NOT EXISTS idx_hosted_images_uploader
+    ON hosted_images (uploaded_by, created_at DESC, id DESC);
+
+-- Поиск по началу имени файла (без учёта регистра)
+CREATE INDEX IF NOT EXISTS idx_hosted_images_filename_prefix
+    ON hosted_images (lower(filename) text_pattern_ops);
@@ -0,0 +1,37 @@
+-- Черновики хранят контент так же, как статьи: JSONB со списком блоков
+-- (старый HTML — JSON-строкой), чтобы автосохранение могло менять отдельные блоки.
+CREATE OR REPLACE FUNCTION draft_content_to_jsonb(content TEXT) RETURNS JSONB AS $$
+DECLARE
+    parsed JSONB;
+BEGIN
+    BEGIN
+        parsed := content::jsonb;
+    EXCEPTION WHEN others THEN
+        parsed := NULL;
+    END;
+
+    IF parsed IS NOT NULL AND jsonb_typeof(parsed) = 'array' THEN
+        RETURN parsed;
+    END IF;
+    RETURN to_jsonb(COALESCE(content, ''));
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+ALTER TABLE article_drafts ALTER COLUMN content DROP DEFAULT;
+ALTER TABLE article_drafts ALTER COLUMN content TYPE JSONB USING draft_content_to_jsonb(content);
+ALTER TABLE article_drafts ALTER COLUMN content SET DEFAULT '[]'::jsonb;
+
+DROP FUNCTION IF EXISTS draft_content_to_jsonb(TEXT);
+
+-- Версия черновика растёт с каждым изменением: клиент присылает её в If-Match
+ALTER TABLE article_drafts ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
+
+-- UNIQUE (user_id, article_id) не мешает нескольким черновикам новой статьи (article_id IS NULL):
+-- оставляем самый свежий и запрещаем дубликаты частичным индексом, на него опирается upsert
+DELETE FROM article_drafts d
+USING article_drafts newer
+WHERE d.article_id IS NULL AND newer.article_id IS NULL
+  AND d.user_id = newer.user_id AND d.id < newer.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_article_drafts_user_new
+    ON article_drafts (user_id) WHERE article_id IS NULL;
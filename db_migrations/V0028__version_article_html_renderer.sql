@@ -0,0 +1,8 @@
+-- Готовый HTML привязан и к версии рендера: после правки разметки или стилей
+-- старые строки перестают совпадать и перерисовываются при чтении.
+-- Строки, отрендеренные до появления версии, содержат заглушку вместо стилей — удаляем их.
+DELETE FROM article_html;
+
+ALTER TABLE article_html ADD COLUMN IF NOT EXISTS renderer INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE article_html DROP CONSTRAINT IF EXISTS article_html_pkey;
+ALTER TABLE article_html ADD PRIMARY KEY (article_id, content_hash, renderer);
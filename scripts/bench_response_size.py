@@ -0,0 +1,95 @@
+"""Сравнение размера ответа action=articles до и после сжатия.
+
+Статьи берутся из миграций db_migrations (реальный блочный контент), список
+размножается до --articles штук. Запуск из корня репозитория:
+
+    python scripts/bench_response_size.py --articles 300
+
+Нужны зависимости backend/wiki-api/requirements.txt (модуль импортирует psycopg2).
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import re
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CONTENT_RE = re.compile(r"UPDATE articles SET content = '(.*?)'\s*WHERE id = (\d+);", re.S)
+
+
+def load_wiki_api():
+    spec = importlib.util.spec_from_file_location('wiki_api', ROOT / 'backend' / 'wiki-api' / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sample_articles(count: int) -> list:
+    """Статьи в форме ответа action=articles с контентом из миграций"""
+    contents = []
+    for path in sorted((ROOT / 'db_migrations').glob('V*.sql')):
+        for content, article_id in CONTENT_RE.findall(path.read_text(encoding='utf-8')):
+            contents.append((int(article_id), content.replace("''", "'")))
+
+    articles = []
+    for i in range(count):
+        source_id, content = contents[i % len(contents)]
+        articles.append({
+            'id': i + 1,
+            'title': f'Статья {i + 1} (по мотивам #{source_id})',
+            'description': 'Краткое описание статьи для карточки на главной странице',
+            'content': content,
+            'category_id': 2,
+            'category_name': 'Гайды',
+            'category_icon': 'Map',
+            'category_ids': [2],
+            'categories': [{'id': 2, 'name': 'Гайды', 'icon': 'Map'}],
+            'author_id': 1,
+            'author_name': 'Super Admin',
+            'author_role': 'administrator',
+            'created_at': '2025-01-01T12:00:00',
+            'updated_at': '2025-01-02T12:00:00',
+            'preview_image': 'https://cdn.poehali.dev/projects/key/bucket/hosting/preview.png',
+            'is_hidden': False
+        })
+    return articles
+
+
+def measure(api, payload: dict, accept_encoding: str):
+    event = {'headers': {'Accept-Encoding': accept_encoding}}
+    started = time.perf_counter()
+    response = api.compress_response(event, api.cors_response(200, payload))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    body = response['body']
+    if response['isBase64Encoded']:
+        wire = len(base64.b64decode(body))
+    else:
+        wire = len(body.encode('utf-8'))
+    return response['headers'].get('Content-Encoding', 'identity'), wire, len(body.encode('utf-8')), elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--articles', type=int, default=300)
+    args = parser.parse_args()
+
+    api = load_wiki_api()
+    payload = {'articles': sample_articles(args.articles)}
+
+    before = len(json.dumps(payload).encode('utf-8'))
+    print(f"articles: {args.articles}")
+    print(f"{'variant':<28}{'on wire, B':>14}{'function body, B':>20}{'vs before':>12}{'time, ms':>10}")
+    print(f"{'before (ensure_ascii=True)':<28}{before:>14}{before:>20}{'100.0%':>12}{'-':>10}")
+
+    for label, accept in (('utf-8, no compression', ''), ('utf-8 + gzip', 'gzip'), ('utf-8 + br', 'br, gzip')):
+        encoding, wire, body_len, elapsed_ms = measure(api, payload, accept)
+        if accept.startswith('br') and encoding != 'br':
+            print(f"{label:<28}{'brotli not installed':>14}")
+            continue
+        print(f"{label:<28}{wire:>14}{body_len:>20}{wire / before:>12.1%}{elapsed_ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,8 @@ import { Input } from '@/components/ui/input';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '@/components/ui/dialog';
 import Icon from '@/components/ui/icon';
 import { compressImage } from '@/lib/compressImage';
-
-const API_URL = 'https://functions.poehali.dev/4db8632d-53f9-40bd-ba69-61a3669656a4';
+import { uploadImageDirect } from '@/lib/directUpload';
+import { imageVariant, imageSrcSet, IMAGE_SIZES } from '@/lib/imageVariants';
 
 interface GuideEditorProps {
   value: string;
@@ -288,6 +288,7 @@ interface BlockEditorProps {
 }
 
 const STEP_COLOR = '#f97316';
+const WIKI_UPLOAD_MAX_BYTES = 5 * 1024 * 1024;
 
 function BlockEditor({ block, index, total, onChange, onDelete, onMove, onAddAfter }: BlockEditorProps) {
   const fileRef = useRef<HTMLInputElement>(null);
@@ -299,23 +300,17 @@ function BlockEditor({ block, index, total, onChange, onDelete, onMove, onAddAft
     onChangeFn(blockId, { uploading: true });
 
     try {
-      // Сжимаем картинку через Canvas до макс. 1600px и качества 85%
-      const compressed = await compressImage(file, 1600, 0.85);
-
-      const token = localStorage.getItem('admin_token');
-      const res = await fetch(`${API_URL}?action=upload_image`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
-        body: JSON.stringify({ image: compressed, filename: file.name }),
-      });
-
-      const data = await res.json();
-      if (data.url) {
-        onChangeFn(blockId, { src: data.url, uploading: false });
-      } else {
-        alert(`Ошибка загрузки: ${data.error || `HTTP ${res.status}`}`);
-        onChangeFn(blockId, { uploading: false });
+      // Варианты и сжатие делает сервер; в браузере ужимаем только то, что не влезает в лимит
+      let upload = file;
+      if (file.size > WIKI_UPLOAD_MAX_BYTES) {
+        const compressed = await compressImage(file, 1600, 0.85);
+        const blob = await (await fetch(compressed)).blob();
+        upload = new File([blob], file.name, { type: blob.type });
       }
+
+      const token = localStorage.getItem('admin_token') || '';
+      const image = await uploadImageDirect(upload, token, 'wiki');
+      onChangeFn(blockId, { src: image.url, uploading: false });
     } catch (err) {
       alert(`Ошибка загрузки: ${err instanceof Error ? err.message : String(err)}`);
       onChangeFn(blockId, { uploading: false });
@@ -520,7 +515,7 @@ function BlockEditor({ block, index, total, onChange, onDelete, onMove, onAddAft
             <div className="space-y-2">
               <div className="relative">
                 <img
-                  src={block.src}
+                  src={imageVariant(block.src, 'card')}
                   alt={block.caption || ''}
                   className="w-full max-w-2xl rounded-lg border border-slate-700 object-cover"
                   style={{ maxHeight: 400 }}
@@ -908,7 +903,9 @@ export function renderBlocksToHtml(blocks: Block[]): string {
     }
     if (b.type === 'image' && b.src) {
       const alt = (b.caption || '').replace(/"/g, '&quot;');
-      parts.push(`<img class="gb-img" src="${b.src}" alt="${alt}" />`);
+      const srcset = imageSrcSet(b.src);
+      const responsive = srcset ? ` srcset="${srcset}" sizes="${IMAGE_SIZES}"` : '';
+      parts.push(`<img class="gb-img" src="${imageVariant(b.src, 'card')}"${responsive} alt="${alt}" />`);
       if (b.caption) parts.push(`<p class="gb-img-cap">${esc(b.caption)}</p>`);
     }
     if (b.type === 'divider') {
@@ -954,7 +951,8 @@ export default function GuideEditor({ value, onChange }: GuideEditorProps) {
   );
 
   const syncToParent = useCallback((newBlocks: Block[]) => {
-    onChange(renderBlocksToHtml(newBlocks));
+    // Сохраняем блоки JSON-ом: API принимает только блочный контент и рендерит его сам
+    onChange(blocksToHtml(newBlocks));
   }, [onChange]);
 
   const updateBlock = useCallback((id: string, updates: Partial<Block>) => {
@@ -7,6 +7,7 @@ import { Plus, Pencil, Trash2, Link, Check, ArrowLeft, Upload, X, Save } from 'l
 import Icon from '@/components/ui/icon';
 import GuideEditor from '@/components/GuideEditor';
 import { compressImage } from '@/lib/compressImage';
+import { imageVariant } from '@/lib/imageVariants';
 
 const API_URL = 'https://functions.poehali.dev/4db8632d-53f9-40bd-ba69-61a3669656a4';
 const DRAFT_KEY = 'article_draft';
@@ -32,7 +33,7 @@ interface Article {
   id: number;
   title: string;
   description: string;
-  content: string;
+  content: string | unknown[];
   category_id: number;
   category_name?: string;
   category_ids?: number[];
@@ -63,6 +64,8 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
   const [description, setDescription] = useState('');
   const [isHidden, setIsHidden] = useState(false);
   const fileInputRef = useRef<HTMLInputElement>(null);
+  const draftVersionRef = useRef<number | null>(null);
+  const draftConflictRef = useRef(false);
 
   const fixLinks = (content: string): string => {
     return content.replace(/href="([^"]+)"/g, (match, url) => {
@@ -76,6 +79,9 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
   const openEditor = async (article?: Article) => {
     const articleIdParam = article ? String(article.id) : 'new';
     let serverDraft: Draft | null = null;
+    let serverDraftVersion: number | null = null;
+    draftVersionRef.current = null;
+    draftConflictRef.current = false;
     try {
       const token = localStorage.getItem('admin_token');
       const res = await fetch(`${API_URL}?action=draft&article_id=${articleIdParam}`, {
@@ -88,12 +94,14 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
             articleId: data.draft.article_id,
             title: data.draft.title,
             description: data.draft.description,
-            content: data.draft.content,
+            // Черновик хранит блоки JSONB-массивом, а редактор работает с JSON-строкой
+            content: typeof data.draft.content === 'string' ? data.draft.content : JSON.stringify(data.draft.content),
             previewImage: data.draft.preview_image || '',
             categoryIds: (data.draft.category_ids || []).map((id: number) => id.toString()),
             isHidden: data.draft.is_hidden,
             savedAt: data.draft.updated_at ? new Date(data.draft.updated_at).getTime() : Date.now(),
           };
+          serverDraftVersion = data.draft.version ?? null;
         }
       }
     } catch {
@@ -104,6 +112,7 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
 
     if (serverDraft && confirm('Найден несохранённый черновик этой статьи. Восстановить его?')) {
       setEditArticle(article || null);
+      draftVersionRef.current = serverDraftVersion;
       setTitle(serverDraft.title);
       setDescription(serverDraft.description);
       setArticleContent(serverDraft.content);
@@ -114,7 +123,8 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
       setEditArticle(article);
       setTitle(article.title);
       setDescription(article.description);
-      setArticleContent(article.content);
+      // content приходит массивом блоков, а редактор работает с JSON-строкой
+      setArticleContent(typeof article.content === 'string' ? article.content : JSON.stringify(article.content));
       setPreviewImage(article.preview_image || '');
       setSelectedCategoryIds(article.category_ids?.map(id => id.toString()) || []);
       setIsHidden(article.is_hidden || false);
@@ -149,6 +159,7 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
 
   const clearDraft = (articleId: number | null) => {
     localStorage.removeItem(DRAFT_KEY);
+    draftVersionRef.current = null;
     const token = localStorage.getItem('admin_token');
     if (!token) return;
     const param = articleId === null ? 'new' : String(articleId);
@@ -177,10 +188,13 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
 
     const timer = setTimeout(() => {
       const token = localStorage.getItem('admin_token');
-      if (!token) return;
+      if (!token || draftConflictRef.current) return;
+      const headers: Record<string, string> = { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` };
+      // Версия черновика защищает от перезаписи правок из другой вкладки или устройства
+      if (draftVersionRef.current !== null) headers['If-Match'] = `"${draftVersionRef.current}"`;
       fetch(`${API_URL}?action=draft`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` },
+        headers,
         body: JSON.stringify({
           article_id: draft.articleId,
           title: draft.title,
@@ -190,7 +204,20 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
           category_ids: draft.categoryIds.map(id => parseInt(id)),
           is_hidden: draft.isHidden,
         }),
-      }).catch(() => {});
+      })
+        .then(async res => {
+          if (res.status === 412) {
+            // Черновик на сервере новее — не затираем его, локальная копия остаётся в браузере
+            draftConflictRef.current = true;
+            alert('Черновик этой статьи изменён в другой вкладке или на другом устройстве. Автосохранение на сервер приостановлено.');
+            return;
+          }
+          if (res.ok) {
+            const data = await res.json();
+            if (typeof data.version === 'number') draftVersionRef.current = data.version;
+          }
+        })
+        .catch(() => {});
     }, 2000);
 
     return () => clearTimeout(timer);
@@ -366,7 +393,7 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
               <p className="text-xs font-semibold text-slate-400 uppercase tracking-wider mb-3">Превью</p>
               {previewImage ? (
                 <div className="relative group">
-                  <img src={previewImage} alt="" className="w-full aspect-video object-cover rounded-lg border border-slate-700" />
+                  <img src={imageVariant(previewImage, 'card')} alt="" className="w-full aspect-video object-cover rounded-lg border border-slate-700" />
                   <div className="absolute inset-0 bg-black/60 opacity-0 group-hover:opacity-100 transition-opacity rounded-lg flex items-center justify-center gap-2">
                     <Button size="sm" variant="outline" className="h-8 text-xs border-slate-500" onClick={() => fileInputRef.current?.click()}>
                       <Upload size={12} className="mr-1" />Заменить
@@ -503,7 +530,7 @@ const ArticlesTab = ({ articles, categories, canEdit, canDelete, loadData }: Art
             {/* Превью */}
             <div className="w-12 h-12 rounded-lg overflow-hidden flex-shrink-0 bg-slate-900 border border-slate-700">
               {article.preview_image
-                ? <img src={article.preview_image} alt="" className="w-full h-full object-cover" />
+                ? <img src={imageVariant(article.preview_image, 'thumb')} alt="" className="w-full h-full object-cover" />
                 : <div className="w-full h-full flex items-center justify-center text-slate-600">
                     <Icon name="FileText" size={20} />
                   </div>
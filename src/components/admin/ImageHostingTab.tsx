@@ -2,6 +2,8 @@ import { useState, useEffect, useRef } from 'react';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
+import { uploadImageDirect } from '@/lib/directUpload';
+import { imageVariant } from '@/lib/imageVariants';
 
 const API_URL = 'https://functions.poehali.dev/4db8632d-53f9-40bd-ba69-61a3669656a4';
 const MAX_SIZE_MB = 10;
@@ -28,22 +30,34 @@ export default function ImageHostingTab({ token, isSuperAdmin }: Props) {
   const [importing, setImporting] = useState(false);
   const [importResult, setImportResult] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [filter, setFilter] = useState('');
   const fileInputRef = useRef<HTMLInputElement>(null);
 
-  const load = async () => {
-    setLoading(true);
+  // Список идёт страницами: cursor — продолжение, без него — первая страница с текущим фильтром
+  const load = async (cursor?: string) => {
+    if (cursor) setLoadingMore(true);
+    else setLoading(true);
     setError(null);
     try {
-      const res = await fetch(`${API_URL}?action=hosting_images`, {
+      const params = new URLSearchParams({ action: 'hosting_images' });
+      if (filter.trim()) params.set('filename', filter.trim());
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`${API_URL}?${params}`, {
         headers: { Authorization: `Bearer ${token}` },
       });
       const data = await res.json();
       if (data.error) setError(data.error);
-      else setImages(data.images || []);
+      else {
+        setImages(prev => cursor ? [...prev, ...(data.images || [])] : (data.images || []));
+        setNextCursor(data.next_cursor || null);
+      }
     } catch {
       setError('Ошибка загрузки');
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -62,33 +76,20 @@ export default function ImageHostingTab({ token, isSuperAdmin }: Props) {
     setError(null);
     setUploading(true);
 
-    const reader = new FileReader();
-    reader.onload = async () => {
-      try {
-        const res = await fetch(`${API_URL}?action=hosting_images`, {
-          method: 'POST',
-          headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' },
-          body: JSON.stringify({ image: reader.result, filename: file.name }),
-        });
-        const data = await res.json();
-        if (data.error) {
-          setError(data.error);
-        } else if (data.url) {
-          setImages(prev => [{
-            key: data.key,
-            url: data.url,
-            filename: file.name,
-            size: file.size,
-            uploaded_at: new Date().toISOString(),
-          }, ...prev]);
-        }
-      } catch {
-        setError('Ошибка загрузки файла');
-      } finally {
-        setUploading(false);
-      }
-    };
-    reader.readAsDataURL(file);
+    try {
+      const image = await uploadImageDirect(file, token);
+      setImages(prev => [{
+        key: image.key,
+        url: image.url,
+        filename: image.filename || file.name,
+        size: image.size ?? file.size,
+        uploaded_at: image.uploaded_at || new Date().toISOString(),
+      }, ...prev.filter(img => img.key !== image.key)]);
+    } catch (err) {
+      setError(err instanceof Error ? err.message : 'Ошибка загрузки файла');
+    } finally {
+      setUploading(false);
+    }
     e.target.value = '';
   };
 
@@ -102,11 +103,17 @@ export default function ImageHostingTab({ token, isSuperAdmin }: Props) {
     if (!confirm('Удалить изображение? Это действие необратимо.')) return;
     setDeletingKey(key);
     try {
-      await fetch(`${API_URL}?action=hosting_images`, {
+      const res = await fetch(`${API_URL}?action=hosting_images`, {
         method: 'DELETE',
         headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' },
         body: JSON.stringify({ key }),
       });
+      if (!res.ok) {
+        const data = await res.json().catch(() => ({}));
+        const used = data.articles?.length ? ` Статьи: ${data.articles.join(', ')}.` : '';
+        alert(`${data.error || `Ошибка удаления (HTTP ${res.status})`}${used}`);
+        return;
+      }
       setImages(prev => prev.filter(img => img.key !== key));
     } finally {
       setDeletingKey(null);
@@ -118,14 +125,21 @@ export default function ImageHostingTab({ token, isSuperAdmin }: Props) {
     setImporting(true);
     setImportResult(null);
     try {
-      const res = await fetch(`${API_URL}?action=hosting_images`, {
-        method: 'POST',
-        headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' },
-        body: JSON.stringify({ import_existing: true }),
-      });
-      const data = await res.json();
-      if (data.error) setImportResult(`Ошибка: ${data.error}`);
-      else setImportResult(`Импортировано: ${data.imported}, ошибок: ${data.failed}`);
+      // Сервер обрабатывает импорт порциями: пока status === 'running', продолжаем тот же job
+      for (;;) {
+        const res = await fetch(`${API_URL}?action=hosting_images`, {
+          method: 'POST',
+          headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' },
+          body: JSON.stringify({ import_existing: true }),
+        });
+        const data = await res.json();
+        if (data.error) {
+          setImportResult(`Ошибка: ${data.error}`);
+          break;
+        }
+        setImportResult(`Импортировано: ${data.imported}, ошибок: ${data.failed}, осталось: ${data.remaining}`);
+        if (data.status !== 'running') break;
+      }
       await load();
     } catch {
       setImportResult('Ошибка соединения');
@@ -145,9 +159,16 @@ export default function ImageHostingTab({ token, isSuperAdmin }: Props) {
       <div className="flex items-center justify-between flex-wrap gap-2">
         <div>
           <h2 className="text-xl font-semibold text-white">Хостинг картинок</h2>
-          <p className="text-sm text-slate-400">{images.length} файлов · макс. {MAX_SIZE_MB} МБ на файл</p>
+          <p className="text-sm text-slate-400">{images.length}{nextCursor ? '+' : ''} файлов · макс. {MAX_SIZE_MB} МБ на файл</p>
         </div>
         <div className="flex gap-2 flex-wrap">
+          <input
+            value={filter}
+            onChange={e => setFilter(e.target.value)}
+            onKeyDown={e => { if (e.key === 'Enter') load(); }}
+            placeholder="Имя файла..."
+            className="h-9 w-40 rounded-md bg-slate-800 border border-slate-700 px-3 text-sm text-white placeholder:text-slate-500"
+          />
           {isSuperAdmin && (
             <Button
               onClick={handleImport}
@@ -204,7 +225,7 @@ export default function ImageHostingTab({ token, isSuperAdmin }: Props) {
           {images.map(img => (
             <Card key={img.key} className="overflow-hidden bg-slate-800/50 border-slate-700">
               <div className="aspect-square bg-slate-900">
-                <img src={img.url} alt="" className="w-full h-full object-cover" loading="lazy" />
+                <img src={imageVariant(img.url, 'thumb')} alt="" className="w-full h-full object-cover" loading="lazy" />
               </div>
               <div className="p-2 space-y-1">
                 <p className="text-xs text-slate-400 truncate" title={img.filename}>{img.filename}</p>
@@ -239,6 +260,17 @@ export default function ImageHostingTab({ token, isSuperAdmin }: Props) {
           ))}
         </div>
       )}
+
+      {!loading && nextCursor && (
+        <div className="text-center">
+          <Button onClick={() => load(nextCursor)} disabled={loadingMore} variant="outline" size="sm" className="border-slate-700">
+            {loadingMore
+              ? <><Icon name="Loader2" size={14} className="animate-spin mr-2" />Загрузка...</>
+              : 'Показать ещё'
+            }
+          </Button>
+        </div>
+      )}
     </div>
   );
 }
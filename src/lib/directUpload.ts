@@ -0,0 +1,45 @@
+const API_URL = 'https://functions.poehali.dev/4db8632d-53f9-40bd-ba69-61a3669656a4';
+
+export interface UploadedImage {
+  key: string;
+  url: string;
+  filename: string;
+  size: number;
+  uploaded_at?: string;
+  width?: number | null;
+  height?: number | null;
+}
+
+async function sha256Hex(file: Blob): Promise<string> {
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function api<T>(action: string, token: string, body: unknown): Promise<T> {
+  const res = await fetch(`${API_URL}?action=${action}`, {
+    method: 'POST',
+    headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  const data = await res.json();
+  if (!res.ok || data.error) throw new Error(data.error || `HTTP ${res.status}`);
+  return data;
+}
+
+// Загрузка картинки прямо в бакет: подписанная форма -> POST в бакет -> подтверждение.
+// Если такие байты уже есть в хостинге, файл не загружается вовсе.
+export async function uploadImageDirect(file: File, token: string, target: 'hosting' | 'wiki' = 'hosting'): Promise<UploadedImage> {
+  const sha256 = await sha256Hex(file);
+  const presign = await api<{ duplicate?: boolean; image?: UploadedImage; key: string; url: string; fields: Record<string, string> }>(
+    'upload_url', token, { target, content_type: file.type, size: file.size, sha256 },
+  );
+  if (presign.duplicate && presign.image) return presign.image;
+
+  const form = new FormData();
+  Object.entries(presign.fields).forEach(([name, value]) => form.append(name, value));
+  form.append('file', file);
+  const upload = await fetch(presign.url, { method: 'POST', body: form });
+  if (!upload.ok) throw new Error(`Ошибка загрузки в хранилище (HTTP ${upload.status})`);
+
+  return api<UploadedImage>('upload_confirm', token, { key: presign.key, filename: file.name });
+}
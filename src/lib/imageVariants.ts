@@ -0,0 +1,18 @@
+// Картинки из бакета лежат вариантами <prefix>/<xx>/<sha256>/<thumb|card|full>.<ext> (см. store_image в wiki-api).
+// В статьях хранится URL варианта full, а показывать нужно вариант под размер места.
+export type ImageVariantName = 'thumb' | 'card' | 'full';
+
+const VARIANT_URL = /(\/[0-9a-f]{2}\/[0-9a-f]{64}\/)(thumb|card|full)\.(jpg|png|webp)$/;
+
+// URL нужного варианта; чужие и старые URL (без вариантов) возвращаются как есть
+export function imageVariant(url: string, name: ImageVariantName): string {
+  return url.replace(VARIANT_URL, `$1${name}.$3`);
+}
+
+// srcset для картинки во всю ширину статьи (колонка до 720px)
+export function imageSrcSet(url: string): string | undefined {
+  if (!VARIANT_URL.test(url)) return undefined;
+  return `${imageVariant(url, 'card')} 800w, ${imageVariant(url, 'full')} 1920w`;
+}
+
+export const IMAGE_SIZES = '(max-width: 760px) 100vw, 720px';
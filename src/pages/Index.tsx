@@ -7,9 +7,12 @@ import { Flame, ExternalLink, Layers, Info, Search, ChevronRight, SearchX, Arrow
 import Icon from '@/components/ui/icon';
 import { Button } from '@/components/ui/button';
 import { renderBlocksToHtml } from '@/components/GuideEditor';
+import { imageVariant } from '@/lib/imageVariants';
 
-function renderContent(content: string): string {
+function renderContent(content: ArticleContent): string {
   if (!content) return '';
+  // API отдаёт блоки готовым массивом; строка — старая HTML-статья (или блоки в JSON-строке)
+  if (Array.isArray(content)) return renderBlocksToHtml(content);
   try {
     const parsed = JSON.parse(content);
     if (Array.isArray(parsed)) return renderBlocksToHtml(parsed);
@@ -21,6 +24,8 @@ function renderContent(content: string): string {
 
 const API_URL = 'https://functions.poehali.dev/4db8632d-53f9-40bd-ba69-61a3669656a4';
 
+type ArticleContent = string | Parameters<typeof renderBlocksToHtml>[0];
+
 interface Article {
   id: number;
   title: string;
@@ -28,7 +33,7 @@ interface Article {
   category_icon: string;
   categories?: Array<{id: number; name: string; icon: string}>;
   description: string;
-  content: string;
+  content: ArticleContent;
   preview_image?: string;
   author_name?: string;
   author_role?: string;
@@ -247,7 +252,7 @@ const Index = () => {
                         {article.preview_image ? (
                           <div className="w-12 h-12 rounded-lg overflow-hidden flex-shrink-0">
                             <img 
-                              src={article.preview_image} 
+                              src={imageVariant(article.preview_image, 'thumb')}
                               alt={article.title}
                               className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
                             />
@@ -324,7 +329,7 @@ const Index = () => {
                   </div>
                   <div className="w-36 h-36 rounded-xl overflow-hidden flex-shrink-0 border border-slate-700 bg-slate-900/60 flex items-center justify-center">
                     {selectedArticle.preview_image ? (
-                      <img src={selectedArticle.preview_image} alt={selectedArticle.title} className="w-full h-full object-cover" />
+                      <img src={imageVariant(selectedArticle.preview_image, 'thumb')} alt={selectedArticle.title} className="w-full h-full object-cover" />
                     ) : (
                       <Map size={48} className="text-orange-400 opacity-60" />
                     )}